@@ -13,6 +13,7 @@ from utils import (
     enrichment,
     json_loader,
     file_parser,
+    parse_cache,
     filtering,
     file_generator,
     batch_editor,
@@ -35,6 +36,7 @@ from history_manager import (
     history,
     delete_history,
     comment,
+    print_in_yellow,
 )
 
 if os.name == "nt" and not hasattr(readline, "backend"):
@@ -86,12 +88,14 @@ COMMANDS = {
         ("exp <filename>", "Expand all abbreviations in the file"),
         ("col <filename>", "Collapse all abbreviations in the file"),
         ("br <filename> <old term> <new term> [fieldslist]", "Replace all occurrences in given fields (OPTIONAL: a list of fields in which to search)"),
-        ("clean <filename>", "Cleans file according to rules in config"),
+        ("clean <filename> [-report]", "Cleans file according to rules in config (OPTIONAL: print the time and changes of every cleanup pass)"),
         ("ord <filename> [reverse=False]", "Orders the bibfile by reference type (OPTIONAL: True/False reverse sorting from Z to A)"),
         ("sub -e <filename> <new filename> <entrytypes list>", "Creates a sub .bib file with only specified entry types"),
         ("sub -t <filename> <new filename> <tags list>", "Creates a sub .bib file with only references with specified tags"),
-        ("tag <tag> <query>", "Adds a tag to all the references that return from a query. A query can either be a filter or search command"),
-        ("untag <tag> <query>", "Untags all references that return from a query. A query can either be a filter or search command"),
+        ("sub -t <filename> <new filename> <tag query>", "Creates a sub .bib file with only references with tags matching a tag query, like 'ML AND (survey OR benchmark) AND NOT retracted'"),
+        ("tag <tag> <query>", "Adds a tag to all the references that return from a query. A query can either be a filter, search or tagged command"),
+        ("tag <tag> tagged <filename> <tag query>", "Adds a tag to all the references in the file with tags matching a tag query"),
+        ("untag <tag> <query>", "Untags all references that return from a query. A query can either be a filter, search or tagged command"),
         ("untag <tag> <citekey list>", "Untags all references that are passed in the list of citekeys."),
         ("mer <filename1> <filename2> <new_filename>", "Merge the references from two bib files into one file"),
         ("mer -all <new_filename>", "Merge all bib files in the current working directory"),
@@ -238,12 +242,16 @@ def load_file_to_storage(source_path):
         print_error_msg(e,e)
 
 
+def filename_to_path(filename) -> str:
+    wd_path = json_loader.get_wd_path()
+    filename = check_extension(filename)
+    return os.path.join(wd_path, filename)
+
+
 def path_to_bibfileobj(filename) -> BibFile:
     try:
-        wd_path = json_loader.get_wd_path()
-        filename = check_extension(filename)
-        path = os.path.join(wd_path, filename)
-        bibfileobj = file_parser.parse_bib(path)
+        path = filename_to_path(filename)
+        bibfileobj = parse_cache.load_bib(path)
         return bibfileobj
     except Exception as e:
         print_error_msg(e,e)
@@ -337,6 +345,10 @@ class CLI(cmd.Cmd):
             print_in_green(
                 f"File {CYAN}'{source_path}'{GREEN} loaded into the storage successfully!"
             )
+            duplicates = parse_cache.load_bib(destination_path).get_duplicate_cite_keys()
+            for cite_key, references in duplicates.items():
+                print_in_yellow(f"Warning: cite key '{cite_key}' is used by {len(references)} references, "
+                                f"only the first one is found by its cite key!")
 
         except (IndexError, ValueError) as e:
             print_error_msg(e, "load <absolute/path/to/file>")
@@ -458,14 +470,15 @@ class CLI(cmd.Cmd):
             else:
                 filename = check_extension(arguments[0])
 
-            bibfileobj = path_to_bibfileobj(filename)
-
             if len(arguments) > 1:
                 if arguments[1] == "-sf":
-                    view.print_bibfile_short(bibfileobj)
+                    # stream the references, so big files start printing right away
+                    with open(filename_to_path(filename), encoding="utf-8") as file:
+                        view.print_entries_short(file_parser.iter_bib(file))
                 else:
                     raise ValueError("Invalid flag!")
             else:
+                bibfileobj = path_to_bibfileobj(filename)
                 view.print_bibfile_pretty(bibfileobj)
 
         except (ValueError, IndexError) as e:
@@ -507,14 +520,14 @@ class CLI(cmd.Cmd):
         try:
             arguments = parse_args(args)
             filename, searchterm = arguments[0], arguments[1]
-            bibfileobj = path_to_bibfileobj(filename)
 
-            array = filtering.search(bibfileobj, searchterm)
-            
-            if len(arguments) > 2 and arguments[2] == "-sf":
-                view.print_refarray_short(array)
-            else:
-                view.print_refarray_pretty(array)
+            with open(filename_to_path(filename), encoding="utf-8") as file:
+                array = filtering.iter_search(file_parser.iter_bib(file), searchterm)
+
+                if len(arguments) > 2 and arguments[2] == "-sf":
+                    view.print_refarray_short(array)
+                else:
+                    view.print_refarray_pretty(array)
         except (IndexError, ValueError) as e:
             print_error_msg(e, "search <filename> <searchterm> [-sf]")
         except (FileNotFoundError, PermissionError, Exception) as e:
@@ -629,7 +642,7 @@ class CLI(cmd.Cmd):
             flag = arguments[0]
 
             if flag == "-ls":
-                tags = json_loader.load_tags()
+                tags = tagging.get_tag_store().to_dict()
                 print_json_pretty(tags,10)
             else:
                 tag = arguments[0]
@@ -650,6 +663,8 @@ class CLI(cmd.Cmd):
                             array = filtering.filterByFieldValue(
                                 bibfileobj, term, query[3]
                             )
+                    case "tagged":
+                        array = filtering.filterByTagQuery(bibfileobj, term)
                     case _:
                         raise ValueError("invalid query! Check your spelling")
 
@@ -666,7 +681,7 @@ class CLI(cmd.Cmd):
         ) as e:  # NOTE! THIS HAS TO BE ON TOP OF THE VALUEERROR
             print_error_msg(e, json_loader.TAGS_FILE)  # TODO: FOR ALL JSON
         except (ValueError, IndexError) as e:
-            print_error_msg(e,f"\ntag -ls\ntag <tag> <query> {WHITE}where {GREEN}<query>{WHITE} is a search or filter command")
+            print_error_msg(e,f"\ntag -ls\ntag <tag> <query> {WHITE}where {GREEN}<query>{WHITE} is a search, filter or tagged command")
         except FileNotFoundError as e:
             print_error_msg(e, e)
         except Exception as e:
@@ -699,6 +714,9 @@ class CLI(cmd.Cmd):
                             array = filtering.filterByFieldValue(
                                 bibfileobj, query[2], query[3]
                             )
+                    case "tagged":
+                        bibfileobj = path_to_bibfileobj(query[1])
+                        array = filtering.filterByTagQuery(bibfileobj, query[2])
                     case _:
                         raise ValueError("Invalid query! Check your spelling")
 
@@ -725,7 +743,7 @@ class CLI(cmd.Cmd):
         except (IndexError, ValueError) as e:
             print_error_msg(
                 e,
-                f"\nuntag <tag> <citekey list>\nuntag <tag> <query> {WHITE}where query can be a search or filter command",
+                f"\nuntag <tag> <citekey list>\nuntag <tag> <query> {WHITE}where query can be a search, filter or tagged command",
             )
         except Exception as e:
             print_error_msg(e, e)
@@ -763,28 +781,37 @@ class CLI(cmd.Cmd):
         except (ValueError, IndexError) as e:
             print_error_msg(
                 e,
-                f'\nsub -e <filename> <new filename> <entrytypes list>\nsub -t <filename> <new filename> <tags list> \n{WHITE}Where the lists are structured like ["item1", "item2", ...]',
+                f'\nsub -e <filename> <new filename> <entrytypes list>\nsub -t <filename> <new filename> <tags list>\nsub -t <filename> <new filename> <tag query> \n{WHITE}Where the lists are structured like ["item1", "item2", ...] and tag queries like \'ML AND (survey OR benchmark) AND NOT retracted\'',
             )
         except (FileNotFoundError, PermissionError, Exception) as e:
             print_error_msg(e, e)
 
     def do_clean(self, arg):
         try:
-            filename = arg
-            if filename == "":
+            arguments = parse_args(arg)
+            if len(arguments) == 0:
                 raise ValueError("no filename given!")
+            filename = arguments[0]
+            report = None
+            if len(arguments) > 1:
+                if arguments[1] == "-report":
+                    report = cleanup.CleanupReport()
+                else:
+                    raise ValueError("Invalid flag!")
 
             bib_file = path_to_bibfileobj(filename)
 
             initialise_history(bib_file)
-            cleanup.cleanup(bib_file)
+            cleanup.cleanup(bib_file, report=report)
             file_generator.generate_bib(bib_file, bib_file.file_path)
             commit(bib_file)
 
             print_in_green("Cleanup has been done successfully!")
+            if report is not None:
+                print(report)
 
         except ValueError as e:
-            print_error_msg(e, "clean <filename>")
+            print_error_msg(e, "clean <filename> [-report]")
         except (FileNotFoundError, PermissionError, Exception) as e:
             print_error_msg(e, e)
 
@@ -799,12 +826,8 @@ class CLI(cmd.Cmd):
                     print_in_yellow("The working directory is empty!")
                     return
                 file_names = get_bib_file_names(wd)
-                merged_bib_file = path_to_bibfileobj(file_names[0][0])
-                for file_name, index in file_names:
-                    if index == 1:
-                        continue
-                    bib_file = path_to_bibfileobj(file_name)
-                    merged_bib_file = merge.merge_files(merged_bib_file, bib_file)
+                bib_files = [path_to_bibfileobj(file_name) for file_name, _ in file_names]
+                merged_bib_file = merge.merge_all_files(bib_files)
                 # Write output inside the configured working directory
                 out_path = os.path.join(json_loader.get_wd_path(), new_file_name)
                 file_generator.generate_bib(merged_bib_file, out_path)
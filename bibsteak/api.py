@@ -2,7 +2,7 @@
 import utils
 import os
 from utils.ordering import GroupingType
-from utils import file_parser, file_generator, ordering, order_by_field, filtering, abbreviations_exec
+from utils import file_parser, file_generator, ordering, order_by_field, filtering, abbreviations_exec, parse_cache
 
 
 
@@ -73,7 +73,7 @@ class API(object):
         try:
             order = GroupingType.ZTOA if order is True else GroupingType.ATOZ
             path = os.path.join(self.wd_path, filename)
-            bib_file = file_parser.parse_bib(path)
+            bib_file = parse_cache.load_bib(path)
 
             # # initialise_history(bib_file)
             ordering.order_by_entry_type(bib_file, order)
@@ -98,7 +98,7 @@ class API(object):
         """
         try:
             path = os.path.join(self.wd_path, filename)
-            bibfileobj = utils.file_parser.parse_bib(path)
+            bibfileobj = parse_cache.load_bib(path)
 
             newFile = filtering.search(bibfileobj, searchterm)
             
@@ -118,7 +118,7 @@ class API(object):
         
         try:
             path = os.path.join(self.wd_path, filename)
-            bib_file = utils.file_parser.parse_bib(path)
+            bib_file = parse_cache.load_bib(path)
 
             abbreviations_exec.execute_abbreviations(bib_file, False, 1000)
             file_generator.generate_bib(bib_file, bib_file.file_path)
@@ -2,13 +2,11 @@ from nicegui import ui, app
 import os, re, json, pprint, asyncio, threading, subprocess, interface_handler
 from merge_ui import Merge
 from objects import BibFile
-from utils import json_loader, cleanup, filtering, enrichment
+from utils import json_loader, cleanup, filtering, enrichment, parse_cache, file_parser
 from utils.merge import *
-import utils.file_parser as file_parser
-from utils.file_parser import parse_bib
 from utils.file_generator import generate_bib
 from utils.abbreviations_exec import execute_abbreviations
-from utils.tagging import tag_refs
+from utils.tagging import tag_refs, get_tag_store
 from history_manager import undo, redo
 
 
@@ -38,6 +36,8 @@ def is_reference(entry) -> bool:
     return hasattr(entry, 'cite_key') and hasattr(entry, 'entry_type')
 
 def iter_references(bib_file) -> list:
+    if isinstance(bib_file, BibFile):
+        return bib_file.get_references()
     return [e for e in getattr(bib_file, 'content', []) if is_reference(e)]
 
 
@@ -61,7 +61,16 @@ def load_all_files_from_storage():
         if filename.endswith(".bib"):
             path = os.path.join(wd, filename)
             try:
-                bib_file = file_parser.parse_bib(path)
+                previous = files.get(filename)
+                if isinstance(previous, BibFile) and os.path.abspath(previous.file_path) == os.path.abspath(path):
+                    # Only parses what changed, and keeps the objects of the unchanged references.
+                    bib_file, changes = file_parser.reparse_bib(previous)
+                    if changes:
+                        print(f"Reloaded {filename}: {changes}")
+                else:
+                    bib_file = parse_cache.load_bib(path)
+                for cite_key, references in bib_file.get_duplicate_cite_keys().items():
+                    print(f"Warning: cite key '{cite_key}' is used by {len(references)} references in {filename}")
                 loaded[filename] = bib_file
             except Exception as e:
                 print(f"Error parsing {filename}: {e}")
@@ -169,7 +178,6 @@ def populate_refs_for_file(filename: str):
     Populates the column for REFERENCES with the REFERENCES in 
     the file and the corresponding buttons
     """
-    tags_dict = json_loader.load_tags()
     load_tag_colors = getattr(json_loader, 'load_tag_colors', lambda: {})
     tag_colors = load_tag_colors() or {}
 
@@ -198,7 +206,7 @@ def populate_refs_for_file(filename: str):
                     ui.label("Select All").classes("font-bold text-xs")
 
         bib_file = files[filename]
-        tags_dict = json_loader.load_tags() or {}
+        tag_store = get_tag_store()
 
         if not getattr(bib_file, 'content', None):
             ui.label("(no references found)").classes("text-sm italic text-gray-600")
@@ -210,7 +218,7 @@ def populate_refs_for_file(filename: str):
             year = normalize_field(getattr(ref, 'year', None) or "N.D.")
             label = f"{author} ({year}): {title}"
 
-            ref_tags = [tag for tag, cite_keys in tags_dict.items() if getattr(ref, 'cite_key', None) in (cite_keys or [])]
+            ref_tags = tag_store.get_tags_of(getattr(ref, 'cite_key', None))
             if ref_tags:
                 with ui.row().classes("ml-8 gap-1"):
                     for tag in sorted(ref_tags):
@@ -269,7 +277,9 @@ def populate_bib_for_ref(ref):
                 if hasattr(ref, "to_bibtex"):
                     entry = ref.to_bibtex()
                 else:
-                    entry = pprint.pformat(ref.__dict__, sort_dicts=False)
+                    entry = pprint.pformat({"comment_above_reference": ref.comment_above_reference,
+                                            "entry_type": ref.entry_type, "cite_key": ref.cite_key,
+                                            **ref.get_fields()}, sort_dicts=False)
             except Exception as e:
                 entry = f"% ERROR converting Reference: {e}\n{ref}"
 
@@ -437,7 +447,7 @@ async def on_filter_click():
     with ui.dialog() as mode_dialog, ui.card().classes("p-4 bg-gray-100 rounded shadow w-80"):
         ui.label("Select Filter Mode").classes("font-bold text-lg mb-4")
         mode = ui.radio(
-            options={"exists": "Has Field", "value": "Field Contains Value"},
+            options={"exists": "Has Field", "value": "Field Contains Value", "tags": "Tag Query"},
             value="exists"
         )
         with ui.row().classes("justify-end gap-2 mt-4"):
@@ -450,7 +460,10 @@ async def on_filter_click():
 
     with ui.dialog() as field_dialog, ui.card().classes("p-4 bg-gray-100 rounded shadow w-80"):
         ui.label("Filter References").classes("font-bold text-lg mb-4")
-        field_input = ui.input(label="Field name(e.g., author, journal, doi)").classes("w-full mb-2")
+        if selected_mode == "tags":
+            field_input = ui.input(label="Tag query (e.g., ML AND (survey OR benchmark) AND NOT retracted)").classes("w-full mb-2")
+        else:
+            field_input = ui.input(label="Field name(e.g., author, journal, doi)").classes("w-full mb-2")
         value_input = None
         if selected_mode == "value":
             value_input = ui.input(label="Field Value").classes("w-full mb-2")
@@ -458,9 +471,16 @@ async def on_filter_click():
         def apply_action():
             field = (field_input.value or "").strip()
             if not field:
-                ui.notify("Enter a field name", color="red")
+                ui.notify("Enter a tag query" if selected_mode == "tags" else "Enter a field name", color="red")
                 return
-            if selected_mode == "exists":
+            if selected_mode == "tags":
+                try:
+                    refs = filtering.filterByTagQuery(bib_file, field)
+                except Exception as e:
+                    ui.notify(str(e), color="orange")
+                    return
+                desc = f"tags match '{field}'"
+            elif selected_mode == "exists":
                 refs = filtering.filterByFieldExistence(bib_file, field)
                 desc = f"has field '{field}'"
             else:
@@ -493,10 +513,10 @@ def on_cleanup_click():
     for filename in list(selected_files):
         try:
             path = os.path.join(wd, filename)
-            bib_file = parse_bib(path)
+            bib_file = parse_cache.load_bib(path)
             cleanup.cleanup(bib_file)
             generate_bib(bib_file, path)
-            files[filename] = parse_bib(path)
+            files[filename] = parse_cache.load_bib(path)
             count += 1
         except Exception as e:
             ui.notify(f"Cleanup failed for {filename}: {e}", color="red")
@@ -588,22 +608,11 @@ def on_untag_click():
         ui.notify("Could not load the current file", color="red")
         return
     
-    tags = json_loader.load_tags() or {}
+    tag_store = get_tag_store()
     selected_tags = list(selected_references)
 
     if selected_tags:
-        changed = False
-        for tag, cite_keys in list(tags.items()):
-            initial = set(cite_keys or [])
-            final = [k for k in initial if k not in selected_tags]
-            if len(final) != len(initial):
-                changed = True
-                if final:
-                    tags[tag] = final
-                else:
-                    tags.pop(tag, None)    
-        if changed:
-            json_loader.dump_tags(tags)
+        if tag_store.untag_all(selected_tags):
             ui.notify(f"Removed tags from {len(selected_references)} selected reference(s)", color="green")
             populate_refs_for_file(file)
         else:
@@ -611,7 +620,7 @@ def on_untag_click():
         return
 
     file_keys = {r.cite_key for r in iter_references(bib_file)}
-    tags_in_file = sorted([t for t, keys in tags.items() if any(k in file_keys for k in (keys or []))])
+    tags_in_file = sorted({t for k in file_keys for t in tag_store.get_tags_of(k)})
     
     with ui.dialog() as dialog, ui.card().classes("p-4 bg-gray-100 rounded shadow w-[360px]"):
         ui.label("Remove tag from current file").classes("font-bold text-lg mb-2")
@@ -624,16 +633,11 @@ def on_untag_click():
             if not tag_name:
                 ui.notify("Enter a tag name", color="red")
                 return
-            if tag_name not in tags:
+            if not tag_store.has_tag(tag_name):
                 ui.notify(f"Tag '{tag_name}' not found", color="orange")
                 dialog.close()
                 return
-            remaining = [k for k in tags.get(tag_name, []) if k not in file_keys]
-            if remaining:
-                tags[tag_name] = remaining
-            else:
-                tags.pop(tag_name, None)
-            json_loader.dump_tags(tags)
+            tag_store.untag(tag_name, file_keys)
             ui.notify(f"Removed tag '{tag_name}' from all references in {file}", color="green")
             dialog.close()
             populate_refs_for_file(file)
@@ -653,9 +657,9 @@ def on_undo_click():
     try: 
         wd = json_loader.get_wd_path()
         path = os.path.join(wd, selected_file)
-        bib = parse_bib(path)
+        bib = parse_cache.load_bib(path)
         undo(bib, 1)
-        files[selected_file] = parse_bib(path)
+        files[selected_file] = parse_cache.load_bib(path)
         ui.notify("Undo successful", color="green")
         populate_refs_for_file(selected_file)
     except Exception as e:
@@ -669,9 +673,9 @@ def on_redo_click():
     try: 
         wd = json_loader.get_wd_path()
         path = os.path.join(wd, selected_file)
-        bib = parse_bib(path)
+        bib = parse_cache.load_bib(path)
         redo(bib, 1)
-        files[selected_file] = parse_bib(path)
+        files[selected_file] = parse_cache.load_bib(path)
         ui.notify("Undo successful", color="green")
         populate_refs_for_file(selected_file)
     except Exception as e:
@@ -683,12 +687,12 @@ def show_search_results(ref_list, term=None):
         header = f"References (search: {term})"
         with ui.row().classes("items-center justify-between w-full mb-5"):
             ui.label(header).classes("font-bold text-lg")
-        tags_dict = json_loader.load_tags() or {}
+        tag_store = get_tag_store()
         tag_colors = json_loader.load_tag_colors() or {}
         for ref in ref_list:
             k = getattr(ref, 'cite_key', None)
 
-            ref_tags = [t for t, keys in tags_dict.items() if k in (keys or [])]
+            ref_tags = tag_store.get_tags_of(k)
             
             if ref_tags:
                 with ui.row().classes("ml-8 gap-1 mb-1"):
@@ -756,7 +760,7 @@ def ref_list(refs: list):
     if not refs:
         ui.label("(no references found)").classes("text-sm italic text-gray-600")
         return
-    tags_dict = json_loader.load_tags() or {}
+    tag_store = get_tag_store()
     tag_colors = json_loader.load_tag_colors() or {}
     for ref in refs:
         author = normalize_field(getattr(ref, 'author', None) or "Unknown Author")
@@ -772,8 +776,8 @@ def ref_list(refs: list):
         if selected_ref and k and getattr(selected_ref, 'cite_key', None) == k:
             btn_classes += " bg-gray-300"
             ui.button(label, on_click=lambda e, r=ref: on_ref_click(r), color=SECONDARY_COLOR).classes(btn_classes).style("text-transform: none;")
-            if k and tags_dict:
-                ref_tags = [t for t, keys in tags_dict.items() if k in (keys or [])]
+            if k:
+                ref_tags = tag_store.get_tags_of(k)
                 if ref_tags:
                     with ui.row().classes("ml-8 gap-1"):
                         for t in sorted(ref_tags):
@@ -803,10 +807,10 @@ def on_enrich_click():
             for filename in list(selected_files):
                 try:
                     path = os.path.join(wd, filename)
-                    bib = parse_bib(path)
+                    bib = parse_cache.load_bib(path)
                     enrichment.sanitize_bib_file(bib)
                     generate_bib(bib, path)
-                    files[filename] = parse_bib(path)
+                    files[filename] = parse_cache.load_bib(path)
                     populate_refs_for_file(filename)
                     count += 1
                 except Exception as e:
@@ -858,7 +862,7 @@ def save_bib_file(filename: str, bib_file):
     path = os.path.join(wd, filename)
     try:
         generate_bib(bib_file, path)
-        files[filename] = parse_bib(path)
+        files[filename] = parse_cache.load_bib(path)
         print(f"Saved {filename} successfully")
         ui.notify(f"Saved {filename} successfully", color="green")
     except Exception as e:
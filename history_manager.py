@@ -2,7 +2,7 @@ import os, json
 import time
 import json
 from objects import BibFile
-from utils import file_generator, file_parser
+from utils import file_generator, file_parser, parse_cache
 from secrets import token_hex
 from datetime import datetime
 
@@ -113,7 +113,7 @@ def commit(bibfile: BibFile):
     tracker = get_json_object(tracker_file_path)
     
     last_commit_path = os.path.join(hist_dir_path, tracker["current_parent"])
-    if not same_commit(file_parser.parse_bib(last_commit_path), bibfile):
+    if not same_commit(parse_cache.load_bib(last_commit_path), bibfile):
         # if tracker["current_parent"] != tracker["TOP"]: # Tip of the branch
         #     print_in_yellow("Branching!")
       
@@ -158,7 +158,7 @@ def undo(bibfile: BibFile):
             parent = tracker['child_to_parent'][tracker['current_parent']]
             past_commit_name = f"{parent}"
             past_file_path = os.path.join(hist_dir_path, past_commit_name)
-            past_bib_file = file_parser.parse_bib(past_file_path)
+            past_bib_file = parse_cache.load_bib(past_file_path)
             file_generator.generate_bib(past_bib_file, file_path)
             
             tracker["current_parent"] = parent
@@ -190,7 +190,7 @@ def redo(bibfile: BibFile):
             child = childs[-1]
             future_commit_name = f"{child}"
             future_file_path = os.path.join(hist_dir_path, future_commit_name)
-            future_bib_file = file_parser.parse_bib(future_file_path)
+            future_bib_file = parse_cache.load_bib(future_file_path)
             file_generator.generate_bib(future_bib_file, file_path)
             
             tracker["current_parent"] = child
@@ -221,7 +221,7 @@ def checkout(bibfile: BibFile, commit_hash: str):
         print_in_yellow("Commit hash is not valid")
         return
     
-    checkout_bib_file = file_parser.parse_bib(checkout_path)
+    checkout_bib_file = parse_cache.load_bib(checkout_path)
     file_generator.generate_bib(checkout_bib_file, file_path)
     
     tracker = get_json_object(tracker_file_path)
@@ -336,7 +336,7 @@ def print_graph(tree, level, root, current_parent="None", ):
         
         
 def same_commit(bib_file1: BibFile, bib_file2: BibFile):
-    return bib_file1.content == bib_file2.content
+    return bib_file1.content_digest() == bib_file2.content_digest()
 
 
 def comment(bibfile: BibFile, commit_hash: str, comment: str):
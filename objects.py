@@ -1,49 +1,185 @@
+import hashlib
+import os
+import re
+import sys
 from enum import Enum
 
 
+def _counts_changes(method):
+    def counted(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.version += 1
+    counted.__name__ = method.__name__
+    counted.__doc__ = method.__doc__
+    return counted
+
+
+class EntryList(list):
+    """
+    The content of a BibFile. A list that counts the changes made to it in version, so the BibFile knows when its
+    indexes have to be built again.
+    """
+    version = 0
+
+    append = _counts_changes(list.append)
+    extend = _counts_changes(list.extend)
+    insert = _counts_changes(list.insert)
+    remove = _counts_changes(list.remove)
+    pop = _counts_changes(list.pop)
+    clear = _counts_changes(list.clear)
+    sort = _counts_changes(list.sort)
+    reverse = _counts_changes(list.reverse)
+    __setitem__ = _counts_changes(list.__setitem__)
+    __delitem__ = _counts_changes(list.__delitem__)
+    __iadd__ = _counts_changes(list.__iadd__)
+    __imul__ = _counts_changes(list.__imul__)
+
+
+# Counts the changes of the attributes that the indexes of a BibFile are built on (cite_key, entry_type and
+# abbreviation) of entries that already had a value, so all indexes built before such a change are rebuilt.
+_index_generation = 0
+_INDEXED_ATTRIBUTES = frozenset(("cite_key", "entry_type", "abbreviation"))
+
+
+def _invalidate_indexes():
+    global _index_generation
+    _index_generation += 1
+
+
+class _BibFileIndexes(object):
+    """
+    The entries of a BibFile partitioned by type, and the references and strings by their keys.
+    """
+    def __init__(self, content, key):
+        self.key = key
+        self.references = []
+        self.strings = []
+        self.comments = []
+        self.preambles = []
+        self.remaining_entries = []
+        self.references_by_cite_key = {}
+        self.duplicate_cite_keys = {}
+        self.references_by_entry_type = {}
+        self.strings_by_abbreviation = {}
+        for entry in content:
+            entry_class = type(entry)
+            if entry_class is Reference:
+                self.references.append(entry)
+                first = self.references_by_cite_key.setdefault(entry.cite_key, entry)
+                if first is not entry:
+                    self.duplicate_cite_keys.setdefault(entry.cite_key, [first]).append(entry)
+                self.references_by_entry_type.setdefault(entry.entry_type, []).append(entry)
+            elif entry_class is String:
+                self.strings.append(entry)
+                self.strings_by_abbreviation.setdefault(entry.abbreviation, entry)
+            elif entry_class is Comment:
+                self.comments.append(entry)
+            if isinstance(entry, Preamble):
+                self.preambles.append(entry)
+            elif not isinstance(entry, (Reference, String, Comment)):
+                self.remaining_entries.append(entry)
+        self.cite_keys = [reference.cite_key for reference in self.references]
+
+
 class BibFile(object):
+    """
+    The indexes of the content (see _BibFileIndexes) are built when they are first needed, and built again after the
+    content changed: the content is an EntryList, which counts its changes, and changes to the cite keys, entry types
+    and abbreviations of the entries are counted globally. The getters return new lists, so they can be changed freely.
+    """
     def __init__(self, file_name):
         self.file_path = file_name
-        self.content = list()
+        self.content = EntryList()
+
+    @property
+    def content(self) -> EntryList:
+        return self._content
+
+    @content.setter
+    def content(self, content):
+        self._content = content if isinstance(content, EntryList) else EntryList(content)
+        self._indexes = None
+
+    def _get_indexes(self) -> _BibFileIndexes:
+        key = (self._content.version, _index_generation)
+        if self._indexes is None or self._indexes.key != key:
+            self._indexes = _BibFileIndexes(self._content, key)
+        return self._indexes
+
+    def __getstate__(self):
+        # The indexes are only valid for the counters of this process.
+        state = self.__dict__.copy()
+        state["_indexes"] = None
+        return state
 
     def __eq__(self, other):
         if not isinstance(other, BibFile):
             return NotImplemented
-        return self.file_path == other.file_path and self.content == other.content
+        return (self.file_path == other.file_path and len(self.content) == len(other.content)
+                and self.content_digest() == other.content_digest())
+
+    def content_digest(self) -> bytes:
+        """
+        Returns a hash of the content (not of the file path), combined from the digests of the entries. Those are
+        cached, so only the entries that changed since their last digest are hashed again.
+        """
+        digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        for entry in self._content:
+            digest.update(entry.content_digest() if isinstance(entry, Entry) else _digest_of(("str", entry)))
+        return digest.digest()
 
     def get_cite_keys(self):
-        cite_keys = []
-        for entry in self.content:
-            if type(entry) is Reference:
-                cite_keys.append(entry.cite_key)
-        return cite_keys
+        return list(self._get_indexes().cite_keys)
 
     def get_reference_by_key(self, cite_key):
-        for entry in self.content:
-            if type(entry) is Reference:
-                if entry.cite_key == cite_key:
-                    return entry
+        """
+        Returns the first reference with the cite_key, or None. See get_duplicate_cite_keys for the others.
+        """
+        return self._get_indexes().references_by_cite_key.get(cite_key)
+
+    def get_duplicate_cite_keys(self) -> dict:
+        """
+        Returns a dict from every cite key that is used by more than one reference to those references, in order.
+        """
+        return {cite_key: list(references)
+                for cite_key, references in self._get_indexes().duplicate_cite_keys.items()}
+
+    def get_references_by_entry_type(self, entry_type) -> list:
+        return list(self._get_indexes().references_by_entry_type.get(entry_type, ()))
+
+    def get_entry_type_dict(self) -> dict:
+        """
+        Returns a dict from entry type to the references of that type, in the order of the file.
+        """
+        return {entry_type: list(references)
+                for entry_type, references in self._get_indexes().references_by_entry_type.items()}
+
+    def get_string_by_abbreviation(self, abbreviation):
+        """
+        Returns the first String with the abbreviation, or None.
+        """
+        return self._get_indexes().strings_by_abbreviation.get(abbreviation)
 
     def get_references(self):
-        return [entry for entry in self.content if type(entry) is Reference]
+        return list(self._get_indexes().references)
 
     def get_strings(self):
-        return [entry for entry in self.content if type(entry) is String]
+        return list(self._get_indexes().strings)
 
     def get_comments(self):
-        return [entry for entry in self.content if type(entry) is Comment]
+        return list(self._get_indexes().comments)
 
     def get_preambles(self):
-        return [entry for entry in self.content if isinstance(entry, Preamble)]
+        return list(self._get_indexes().preambles)
 
     def get_remaining_entries(self):
         """
         Currently there is a single remaining str object if the file ends in something that cannot be parsed.
         :return:
         """
-        return [entry for entry in self.content if not isinstance(entry, Reference)
-                and not isinstance(entry, String) and not isinstance(entry, Comment)
-                and not isinstance(entry, Preamble)]
+        return list(self._get_indexes().remaining_entries)
 
     def __str__(self):
         return f"[File: {self.file_path} - content: {self.content}]"
@@ -52,24 +188,120 @@ class BibFile(object):
         return self.__str__()
 
 
-class Comment(object):
+class SourceFile(object):
+    """
+    The version of a file that entries were parsed from, identified by the size and modification time of the file.
+    """
+    def __init__(self, file_path, size, mtime_ns):
+        self.file_path = file_path
+        self.size = size
+        self.mtime_ns = mtime_ns
+
+    def __eq__(self, other):
+        if not isinstance(other, SourceFile):
+            return NotImplemented
+        return self.file_path == other.file_path and self.size == other.size and self.mtime_ns == other.mtime_ns
+
+    def __hash__(self):
+        return hash((self.file_path, self.size, self.mtime_ns))
+
+    def read_bytes(self):
+        """
+        Returns the bytes of the file, or None if the file changed since the entries were parsed.
+        """
+        try:
+            with open(self.file_path, "rb") as file:
+                stat = os.fstat(file.fileno())
+                if stat.st_size != self.size or stat.st_mtime_ns != self.mtime_ns:
+                    return None
+                data = file.read()
+        except OSError:
+            return None
+        return data if len(data) == self.size else None
+
+
+_MISSING = object()
+# The size in bytes of the content digests, large enough that equal digests can be taken as equal content.
+DIGEST_SIZE = 16
+
+
+def _digest_of(parts: tuple) -> bytes:
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=DIGEST_SIZE).digest()
+
+
+class Entry(object):
+    """
+    Base class of the entries in a bib file.
+    The source_span is (SourceFile, start, end, digest): the bytes of the source file the entry was parsed from,
+    including the text above it, and a hash of those bytes. Changing or deleting any attribute resets it to None, so
+    it is only set for unchanged entries. The same goes for the cached content digest, see content_digest.
+    """
+    __slots__ = ("source_span", "_digest")
+
+    def __setattr__(self, name, value):
+        if name not in _UNTRACKED_ATTRIBUTES:
+            old_value = getattr(self, name, _MISSING)
+            if old_value != value:
+                self._content_changed()
+                if name in _INDEXED_ATTRIBUTES and old_value is not _MISSING:
+                    _invalidate_indexes()
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        object.__delattr__(self, name)
+        self._content_changed()
+        if name in _INDEXED_ATTRIBUTES:
+            _invalidate_indexes()
+
+    def _content_changed(self):
+        object.__setattr__(self, "source_span", None)
+        object.__setattr__(self, "_digest", None)
+
+    def _digest_parts(self) -> tuple:
+        """
+        The content of the entry that the digest is made of, starting with the kind of entry.
+        """
+        raise NotImplementedError
+
+    def content_digest(self) -> bytes:
+        """
+        Returns a hash of the content of the entry (not of its source span), cached until the entry changes.
+        Entries are equal if and only if their digests are equal.
+        """
+        digest = getattr(self, "_digest", None)
+        if digest is None:
+            digest = _digest_of(self._digest_parts())
+            object.__setattr__(self, "_digest", digest)
+        return digest
+
+
+_UNTRACKED_ATTRIBUTES = frozenset(("source_span", "_digest"))
+
+
+class Comment(Entry):
     def __init__(self, comment):
         self.comment = comment
 
     def __eq__(self, other):
         if not isinstance(other, Comment):
             return NotImplemented
-        return self.comment == other.comment
+        return self.content_digest() == other.content_digest()
+
+    def _digest_parts(self) -> tuple:
+        return "comment", self.comment
 
 
-class Preamble(object):
+class Preamble(Entry):
     def __init__(self, preamble):
         self.preamble = preamble
 
     def __eq__(self, other):
         if not isinstance(other, Preamble):
             return NotImplemented
-        return self.preamble == other.preamble
+        return self.content_digest() == other.content_digest()
+
+    def _digest_parts(self) -> tuple:
+        return "preamble", self.preamble
 
 
 class Enclosure(Enum):
@@ -77,7 +309,109 @@ class Enclosure(Enum):
     QUOTATION_MARKS = 2
 
 
-class String(object):
+class TokenType(Enum):
+    BRACED = 1  # {text}
+    QUOTED = 2  # "text"
+    MACRO = 3  # the abbreviation of a String
+    NUMBER = 4
+    RAW = 5  # a value that could not be parsed, kept as it is
+
+
+_BRACE_OR_QUOTE = re.compile(r'[{}"]')
+_MACRO_OR_NUMBER = re.compile(r'[^\s#{}"]+')
+_WHITESPACE = re.compile(r"\s*")
+
+
+def _literal_end(text: str, start: int, closing: str) -> int:
+    # The index of the closing brace or quote of the literal that opens at start, or -1 if it is not closed.
+    depth = 0
+    for match in _BRACE_OR_QUOTE.finditer(text, start + 1):
+        char = match.group()
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            if depth == 0:
+                return match.start() if closing == "}" else -1
+            depth -= 1
+        elif depth == 0 and closing == '"':
+            return match.start()
+    return -1
+
+
+def is_valid_literal(token_type: TokenType, text: str) -> bool:
+    """
+    Returns whether the text can be the text of a braced or quoted literal: its braces are balanced and a quoted
+    literal has no quotation marks outside of braces.
+    """
+    closing = "}" if token_type is TokenType.BRACED else '"'
+    return _literal_end("{" + text + "}" if closing == "}" else '"' + text + '"', 0, closing) == len(text) + 1
+
+
+class FieldValue(tuple):
+    """
+    A field value parsed into its tokens: (TokenType, text) pairs that are concatenated with #. The text of braced
+    and quoted literals is without the enclosure. Values that are not a valid concatenation of literals, macros and
+    numbers are a single RAW token. Use Reference.get_field_value to get the (cached) value of a field.
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def parse(text: str) -> "FieldValue":
+        tokens = []
+        position = 0
+        length = len(text)
+        while True:
+            position = _WHITESPACE.match(text, position).end()
+            if position == length:
+                return FieldValue(((TokenType.RAW, text),))
+            char = text[position]
+            if char == "{" or char == '"':
+                end = _literal_end(text, position, "}" if char == "{" else '"')
+                if end == -1:
+                    return FieldValue(((TokenType.RAW, text),))
+                tokens.append((TokenType.BRACED if char == "{" else TokenType.QUOTED, text[position + 1:end]))
+                position = end + 1
+            else:
+                match = _MACRO_OR_NUMBER.match(text, position)
+                if match is None:
+                    return FieldValue(((TokenType.RAW, text),))
+                name = match.group()
+                tokens.append((TokenType.NUMBER if name.isdigit() else TokenType.MACRO, name))
+                position = match.end()
+            position = _WHITESPACE.match(text, position).end()
+            if position == length:
+                return FieldValue(tokens)
+            if text[position] != "#":
+                return FieldValue(((TokenType.RAW, text),))
+            position += 1
+
+    def is_concatenation(self) -> bool:
+        return len(self) > 1
+
+    def is_valid(self) -> bool:
+        """
+        Returns whether parsing the rendered value gives this value again.
+        """
+        for token_type, text in self:
+            if token_type is TokenType.BRACED or token_type is TokenType.QUOTED:
+                if not is_valid_literal(token_type, text):
+                    return False
+            elif token_type is TokenType.RAW:
+                return len(self) == 1 and FieldValue.parse(text) == self
+            elif _MACRO_OR_NUMBER.fullmatch(text) is None or text.isdigit() != (token_type is TokenType.NUMBER):
+                return False
+        return len(self) > 0
+
+    def render(self) -> str:
+        """
+        Returns the value as it is written in a bib file, with " # " between the tokens.
+        """
+        return " # ".join("{" + text + "}" if token_type is TokenType.BRACED else
+                          '"' + text + '"' if token_type is TokenType.QUOTED else text
+                          for token_type, text in self)
+
+
+class String(Entry):
     def __init__(self, comment_above_string, abbreviation, long_form, enclosure=Enclosure.QUOTATION_MARKS):
         self.comment_above_string = comment_above_string
         self.abbreviation = abbreviation
@@ -87,42 +421,173 @@ class String(object):
     def __eq__(self, other):
         if not isinstance(other, String):
             return NotImplemented
-        return (self.comment_above_string == other.comment_above_string and self.abbreviation == other.abbreviation
-                and self.long_form == other.long_form and self.enclosure == other.enclosure)
+        return self.content_digest() == other.content_digest()
+
+    def _digest_parts(self) -> tuple:
+        return "string", self.comment_above_string, self.abbreviation, self.long_form, self.enclosure.name
 
     def get_fields(self):
         return vars(self)
 
 
-class Reference(object):
+# Tuples of field names, shared by all references that have the same fields in the same order.
+_FIELD_LAYOUTS = {}
+
+
+def _field_layout(field_names: tuple) -> tuple:
+    layout = _FIELD_LAYOUTS.get(field_names)
+    if layout is None:
+        layout = tuple(sys.intern(name) for name in field_names)
+        _FIELD_LAYOUTS[layout] = layout
+    return layout
+
+
+class Reference(Entry):
+    """
+    The meta data of a reference is kept in slots and its BibTeX fields as a (shared) tuple of field names with a
+    tuple of values in the order of the file, so references stay small and the fields can be iterated without skipping the
+    meta data. The fields can still be read, set and deleted as attributes: reference.title,
+    setattr(reference, "title", ...) and delattr(reference, "title").
+    """
+    __slots__ = ("comment_above_reference", "entry_type", "cite_key", "_field_names", "_field_values",
+                 "_parsed_values")
+
     def __init__(self, comment_above_reference, entry_type, cite_key):
+        object.__setattr__(self, "_field_names", ())
+        object.__setattr__(self, "_field_values", ())
+        object.__setattr__(self, "_parsed_values", None)
         self.comment_above_reference = comment_above_reference
         self.entry_type = entry_type
         self.cite_key = cite_key
 
+    def __getattr__(self, name):
+        # Only called for names that are not (set) slots, which are the fields.
+        if name not in _REFERENCE_SLOTS:
+            try:
+                return self._field_values[self._field_names.index(name)]
+            except ValueError:
+                pass
+        raise AttributeError(f"'Reference' object has no attribute '{name}'")
+
+    def __setattr__(self, name, value):
+        if name in _REFERENCE_SLOTS:
+            Entry.__setattr__(self, name, value)
+            return
+        values = self._field_values
+        try:
+            index = self._field_names.index(name)
+        except ValueError:
+            object.__setattr__(self, "_field_names", _field_layout(self._field_names + (name,)))
+            object.__setattr__(self, "_field_values", values + (value,))
+        else:
+            object.__setattr__(self, "_field_values", values[:index] + (value,) + values[index + 1:])
+            if values[index] == value:
+                return
+        self._content_changed()
+
+    def __delattr__(self, name):
+        if name in _REFERENCE_SLOTS:
+            Entry.__delattr__(self, name)
+            return
+        names = self._field_names
+        try:
+            index = names.index(name)
+        except ValueError:
+            raise AttributeError(f"'Reference' object has no attribute '{name}'") from None
+        object.__setattr__(self, "_field_names", _field_layout(names[:index] + names[index + 1:]))
+        object.__setattr__(self, "_field_values", self._field_values[:index] + self._field_values[index + 1:])
+        self._content_changed()
+
+    def __getstate__(self):
+        return (self.comment_above_reference, self.entry_type, self.cite_key, self._field_names, self._field_values,
+                getattr(self, "source_span", None), getattr(self, "_digest", None))
+
+    def __setstate__(self, state):
+        for name, value in zip(_REFERENCE_STATE, state):
+            object.__setattr__(self, name, value)
+        object.__setattr__(self, "_field_names", _field_layout(self._field_names))
+        object.__setattr__(self, "_parsed_values", None)
+
     def __eq__(self, other):
         if not isinstance(other, Reference):
             return NotImplemented
-        for (self_field, self_value), (other_field, other_value) in (
-                zip(self.get_fields().items(), other.get_fields().items())):
-            if self_field != other_field or self_value != other_value:
-                return False
-        return True
+        return self.content_digest() == other.content_digest()
 
-    def get_fields(self):
-        return vars(self)
+    def _digest_parts(self) -> tuple:
+        return ("reference", self.comment_above_reference, self.entry_type, self.cite_key, self._field_names,
+                self._field_values)
+
+    def get_fields(self) -> dict:
+        """
+        Returns the BibTeX fields (without the meta data) as a new dict from field name to value, in the order of
+        the file. Use setattr, delattr or set_fields to change the fields.
+        """
+        return dict(zip(self._field_names, self._field_values))
+
+    def set_fields(self, fields: dict):
+        """
+        Replaces all BibTeX fields by the fields in the dict, in the order of the dict.
+        """
+        names = tuple(fields)
+        values = tuple(fields.values())
+        if names != self._field_names or values != self._field_values:
+            object.__setattr__(self, "_field_names", _field_layout(names))
+            object.__setattr__(self, "_field_values", values)
+            self._content_changed()
+
+    def get_field_value(self, name: str) -> FieldValue:
+        """
+        Returns the value of the field parsed into a FieldValue. The parsed value is cached on the reference until
+        the field changes.
+        """
+        value = getattr(self, name)
+        parsed_values = self._parsed_values
+        if parsed_values is None:
+            parsed_values = {}
+            object.__setattr__(self, "_parsed_values", parsed_values)
+        cached = parsed_values.get(name)
+        if cached is not None and cached[0] is value:
+            return cached[1]
+        parsed = FieldValue.parse(value)
+        parsed_values[name] = (value, parsed)
+        return parsed
+
+    def set_field_value(self, name: str, value: FieldValue):
+        """
+        Sets the field to the rendered FieldValue, and caches the FieldValue if parsing the rendered value gives it
+        back.
+        """
+        rendered = value.render()
+        setattr(self, name, rendered)
+        if value.is_valid():
+            if self._parsed_values is None:
+                object.__setattr__(self, "_parsed_values", {})
+            self._parsed_values[name] = (getattr(self, name), value)
+
+    def field_items(self):
+        """
+        Iterates over the (field name, value) pairs of the BibTeX fields without building a dict. Changes to the
+        fields while iterating do not affect the iteration.
+        """
+        return zip(self._field_names, self._field_values)
 
     def __str__(self):
         # print the reference like a dictionary
-        fields = self.get_fields()
-        field_strings = [f"{key}: {value}" for key, value in fields.items() if
-                         key not in ["comment_above_reference", "entry_type"]]
+        field_strings = [f"cite_key: {self.cite_key}"]
+        field_strings.extend(f"{key}: {value}" for key, value in self.field_items())
         return "\n".join(field_strings)
 
     def __repr__(self):
         return self.__str__()
 
 
+# The slots of a Reference, the source_span and _digest slots come from Entry.
+_REFERENCE_SLOTS = Reference.__slots__ + ("source_span", "_digest")
+# The slots in the order of the state of a Reference, the cached _parsed_values are not part of it.
+_REFERENCE_STATE = ("comment_above_reference", "entry_type", "cite_key", "_field_names", "_field_values",
+                    "source_span", "_digest")
+
+
 class GraphNode(object):
     def __init__(self, title):
         self.title = title
@@ -0,0 +1,421 @@
+import argparse
+import contextlib
+import copy
+import gc
+import json
+import os
+import random
+import shutil
+import time
+import tracemalloc
+from utils import file_parser, file_generator, batch_editor, cleanup, json_loader, fingerprints, abbreviations_exec, \
+    merge, synonyms
+
+WORDS = ["bibliography", "reference", "parser", "scanner", "library", "entry", "Müller", "{LaTeX}", "data",
+         "analysis", "journal", "proceedings", "model", "graph", "network", "learning", "survey", "benchmark",
+         "M{\\\"u}ller", "Erd\\H{o}s", "{\\o}re"]
+
+
+def generate_example_file(path, number_of_entries, seed=42):
+    """
+    Generates a synthetic bib file with strings, comments and references with long abstracts.
+    :param path: the path to generate the file at.
+    :param number_of_entries: the number of references in the file.
+    :param seed: seed for the random generator, so every run benchmarks the same file.
+    """
+    generator = random.Random(seed)
+
+    def words(count):
+        return " ".join(generator.choice(WORDS) for _ in range(count))
+
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("@preamble{\"\\newcommand{\\noop}[1]{}\"}\n")
+        file.write("@string{jlib = \"Journal of Library Science\"}\n")
+        for index in range(number_of_entries):
+            if index % 50 == 0:
+                file.write(f"\n% Group {index // 50}\n")
+            file.write(f"\n@article{{key{index},\n"
+                       f"  author    = {{{words(2)} and {words(2)}}},\n"
+                       f"  title     = {{{words(8)}}},\n"
+                       f"  journal   = jlib,\n"
+                       f"  year      = {1950 + index % 70},\n"
+                       f"  pages     = \"{index}--{index + 10}\",\n"
+                       f"  abstract  = {{{words(generator.randint(50, 400))}}},\n"
+                       f"}}\n")
+
+
+def time_call(function, repeat=3):
+    """
+    Calls the function repeat times and returns (best time in seconds, result of the last call).
+    """
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def print_result(name, seconds, size, baseline=None):
+    throughput = size / seconds / 1024 / 1024 if seconds else float("inf")
+    speedup = f"  x{baseline / seconds:.1f}" if baseline else ""
+    print(f"{name:<40} {seconds:>8.3f} s {throughput:>8.2f} MB/s{speedup}")
+
+
+def peak_memory(function):
+    """
+    Returns the peak size in MB of the memory allocated by python while calling the function.
+    Memory mapped pages are not allocated by python, so they are not counted.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_parser_engines(path, repeat):
+    """
+    Compares the throughput of the scanner engine with the state machine engine.
+    """
+    size = os.path.getsize(path)
+    state_machine_time, state_machine_file = time_call(
+        lambda: file_parser.parse_bib(path, False, engine=file_parser.STATE_MACHINE_ENGINE), repeat)
+    scanner_time, scanner_file = time_call(
+        lambda: file_parser.parse_bib(path, False, engine=file_parser.SCANNER_ENGINE), repeat)
+    assert scanner_file.content == state_machine_file.content, "Engines produced different results!"
+    print_result("parse_bib (state machine)", state_machine_time, size)
+    print_result("parse_bib (scanner)", scanner_time, size, state_machine_time)
+
+
+def benchmark_mmap(path, repeat):
+    """
+    Compares reading the whole file into a str with scanning the memory mapped file.
+    """
+    size = os.path.getsize(path)
+    read_time, read_file = time_call(lambda: file_parser.parse_bib(path, False, use_mmap=False), repeat)
+    mmap_time, mmap_file = time_call(lambda: file_parser.parse_bib(path, False, use_mmap=True), repeat)
+    assert read_file.content == mmap_file.content, "Memory mapped parsing produced different results!"
+    print_result("parse_bib (scanner, read)", read_time, size)
+    print_result("parse_bib (scanner, mmap)", mmap_time, size, read_time)
+    read_peak = peak_memory(lambda: file_parser.parse_bib(path, False, use_mmap=False))
+    mmap_peak = peak_memory(lambda: file_parser.parse_bib(path, False, use_mmap=True))
+    print(f"peak python memory: read {read_peak:.1f} MB, mmap {mmap_peak:.1f} MB")
+
+
+def benchmark_workers(path, repeat, workers):
+    """
+    Compares serial parsing with parsing in a process pool of the given number of workers.
+    """
+    size = os.path.getsize(path)
+    serial_time, serial_file = time_call(lambda: file_parser.parse_bib(path, False, use_mmap=True), repeat)
+    print_result("parse_bib (serial)", serial_time, size)
+    for worker_count in workers:
+        parallel_time, parallel_file = time_call(
+            lambda: file_parser.parse_bib(path, False, workers=worker_count), repeat)
+        assert parallel_file.content == serial_file.content, "Parallel parsing produced different results!"
+        print_result(f"parse_bib (workers={worker_count})", parallel_time, size, serial_time)
+
+
+def benchmark_references(path, repeat):
+    """
+    Measures the memory used per parsed reference and the time to iterate over the fields of all references.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        bib_file = file_parser.parse_bib(path, False)
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    references = bib_file.get_references()
+    print(f"python memory per reference (with values): {retained / max(len(references), 1):.0f} bytes")
+
+    def iterate_fields():
+        for reference in references:
+            for _ in reference.field_items():
+                pass
+
+    iterate_time, _ = time_call(iterate_fields, repeat)
+    print(f"{'iterate fields of all references':<40} {iterate_time:>8.3f} s")
+
+
+def benchmark_reparse(path, repeat):
+    """
+    Compares parsing the whole file again with reparse_bib after a single reference in the middle of it changed.
+    """
+    size = os.path.getsize(path)
+    edit_path = path + ".edited.bib"
+    shutil.copy(path, edit_path)
+    try:
+        with open(edit_path, "rb") as file:
+            data = file.read()
+        middle = data.find(b"\n@", len(data) // 2) + 1
+        brace = data.find(b",", middle) + 1
+        edited = data[:brace] + b"\n  note = {Edited}," + data[brace:]
+
+        def reparse():
+            with open(edit_path, "wb") as edit_file:
+                edit_file.write(data)
+            previous = file_parser.parse_bib(edit_path, False)
+            with open(edit_path, "wb") as edit_file:
+                edit_file.write(edited)
+            start = time.perf_counter()
+            result, _ = file_parser.reparse_bib(previous, False)
+            return time.perf_counter() - start, result
+
+        reparse_time = min(reparse()[0] for _ in range(repeat))
+        full_time, full_file = time_call(lambda: file_parser.parse_bib(edit_path, False), repeat)
+        assert reparse()[1].content == full_file.content, "Incremental parsing produced different results!"
+        print_result("parse_bib (after an edit)", full_time, size)
+        print_result("reparse_bib (after an edit)", reparse_time, size, full_time)
+    finally:
+        os.remove(edit_path)
+
+
+def benchmark_generate(path, repeat, workers):
+    """
+    Measures generating every entry of the parsed file again (without copying unchanged entries), with and without
+    wrapping long fields, the peak memory used while writing, and generating in a process pool of the given number
+    of workers. The pool only pays off once rendering the entries takes longer than sending them to the workers.
+    """
+    size = os.path.getsize(path)
+    bib_file = file_parser.parse_bib(path, False)
+    output_path = path + ".generated.bib"
+
+    def generate(add_newlines, worker_count=1):
+        file_generator.generate_bib(bib_file, output_path, add_newlines_in_fields=add_newlines,
+                                    keep_unchanged_entries=False, workers=worker_count)
+        with open(output_path, "rb") as file:
+            return file.read()
+
+    try:
+        for add_newlines in (False, True):
+            serial_time, serial_output = time_call(lambda: generate(add_newlines), repeat)
+            name = "generate_bib (wrapped, " if add_newlines else "generate_bib ("
+            print_result(name + "serial)", serial_time, size)
+            for worker_count in workers:
+                parallel_time, parallel_output = time_call(lambda: generate(add_newlines, worker_count), repeat)
+                assert parallel_output == serial_output, "Parallel generating produced different results!"
+                print_result(f"{name}workers={worker_count})", parallel_time, size, serial_time)
+        generate_peak = peak_memory(lambda: file_generator.generate_bib(
+            bib_file, output_path, add_newlines_in_fields=False, keep_unchanged_entries=False))
+        print(f"peak python memory while generating: {generate_peak:.1f} MB")
+    finally:
+        if os.path.isfile(output_path):
+            os.remove(output_path)
+
+
+def benchmark_abbreviations(path, repeat, count):
+    """
+    Compares replacing the long forms of count journal abbreviations with one batch_replace call per abbreviation
+    and with a single batch_apply.
+    """
+    size = os.path.getsize(path)
+    bib_file = file_parser.parse_bib(path, False)
+    generator = random.Random(42)
+    operations = [(batch_editor.REPLACE, ["journal", "title"], " ".join(generator.choice(WORDS) for _ in range(3)),
+                   f"abbreviation{index}") for index in range(count)]
+
+    def sequential():
+        edited = copy.deepcopy(bib_file)
+        for _, fields_to_edit, old_string, new_string in operations:
+            batch_editor.batch_replace(edited, fields_to_edit, old_string, new_string)
+        return edited
+
+    def batch():
+        return batch_editor.batch_apply(copy.deepcopy(bib_file), operations)
+
+    sequential_time, sequential_file = time_call(sequential, repeat)
+    batch_time, batch_file = time_call(batch, repeat)
+    assert batch_file.content == sequential_file.content, "batch_apply produced different results!"
+    print_result(f"batch_replace ({count} abbreviations)", sequential_time, size)
+    print_result(f"batch_apply ({count} abbreviations)", batch_time, size, sequential_time)
+
+
+def benchmark_cleanup(path, repeat):
+    """
+    Measures cleaning all references with every cleanup pass enabled, converting the LaTeX symbols without and with
+    the results of earlier values cached, and prints the time of every pass. Then measures cleaning a file that was
+    already cleaned, with the fingerprints of the references that the cleanup left unchanged.
+    """
+    size = os.path.getsize(path)
+    bib_file = file_parser.parse_bib(path, False)
+    options = {"convert_special_symbols_to_unicode": True, "prefer_doi_over_url": True, "remove_comments": True,
+               "remove_comment_entries": True, "lowercase_entry_types": True, "lowercase_fields": True,
+               "change_enclosures_to_braces": True, "unnecessary_fields": ["abstract"],
+               "preferred_field_order": ["author", "title", "year"]}
+    config = json_loader.Config(dict(options, entry_fingerprints=False))
+
+    def clean(report=None):
+        cleanup.convert_latex_to_unicode.cache_clear()
+        return cleanup.cleanup(copy.deepcopy(bib_file), config, report)
+
+    def clean_cached():
+        return cleanup.cleanup(copy.deepcopy(bib_file), config)
+
+    clean_time, cleaned_file = time_call(clean, repeat)
+    cached_time, _ = time_call(clean_cached, repeat)
+    print_result("cleanup", clean_time, size)
+    print_result("cleanup (symbols cached)", cached_time, size, clean_time)
+    report = cleanup.CleanupReport()
+    clean(report)
+    print(report)
+
+    cache_directory = fingerprints.CACHE_DIRECTORY
+    fingerprints.CACHE_DIRECTORY = path + ".fingerprints"
+    try:
+        fingerprint_config = json_loader.Config(dict(options, entry_fingerprints=True))
+        # the first cleanup of the cleaned file remembers the references it leaves unchanged
+        cleanup.cleanup(copy.deepcopy(cleaned_file), fingerprint_config)
+        # copy the file before timing, the cleanup with fingerprints takes less time than copying
+        copies = [copy.deepcopy(cleaned_file) for _ in range(2 * repeat)]
+        again_time, _ = time_call(lambda: cleanup.cleanup(copies.pop(), config), repeat)
+        skip_time, _ = time_call(lambda: cleanup.cleanup(copies.pop(), fingerprint_config), repeat)
+        print_result("cleanup (already clean)", again_time, size)
+        print_result("cleanup (already clean, fingerprints)", skip_time, size, again_time)
+    finally:
+        shutil.rmtree(fingerprints.CACHE_DIRECTORY, ignore_errors=True)
+        fingerprints.CACHE_DIRECTORY = cache_directory
+
+
+def benchmark_transform_workers(path, repeat, workers):
+    """
+    Compares cleaning and collapsing the abbreviations of all references serially with doing it in a process pool
+    of the given number of workers.
+    """
+    size = os.path.getsize(path)
+    bib_file = file_parser.parse_bib(path, False)
+    config = json_loader.Config({"convert_special_symbols_to_unicode": True, "lowercase_fields": True,
+                                 "change_enclosures_to_braces": True, "entry_fingerprints": False})
+    operations = [("cleanup", lambda edited, worker_count: cleanup.cleanup(edited, config, workers=worker_count)),
+                  ("execute_abbreviations", lambda edited, worker_count: abbreviations_exec.execute_abbreviations(
+                      edited, True, 1000, config, worker_count))]
+    for name, operation in operations:
+        serial_time, serial_file = time_call(lambda: operation(copy.deepcopy(bib_file), 1), repeat)
+        print_result(f"{name} (serial)", serial_time, size)
+        for worker_count in workers:
+            parallel_time, parallel_file = time_call(lambda: operation(copy.deepcopy(bib_file), worker_count), repeat)
+            assert parallel_file.content == serial_file.content, f"Parallel {name} produced different results!"
+            print_result(f"{name} (workers={worker_count})", parallel_time, size, serial_time)
+
+
+def benchmark_merge(path, repeat, count):
+    """
+    Compares merging count copies of the file one after another (like mer -all did) with merging them at once, with
+    the files cleaned before merging. The copies match by DOI or author+title, so no choices are prompted.
+    """
+    size = os.path.getsize(path) * count
+    bib_file = file_parser.parse_bib(path, False)
+    config = json_loader.Config({"clean_before_merge": True, "change_enclosures_to_braces": True,
+                                 "entry_fingerprints": False})
+
+    def merge_pairwise():
+        bib_files = [copy.deepcopy(bib_file) for _ in range(count)]
+        with contextlib.redirect_stdout(None):
+            merged_file = bib_files[0]
+            for other_file in bib_files[1:]:
+                merged_file = merge.merge_files(merged_file, other_file, config)
+        return merged_file
+
+    def merge_all():
+        bib_files = [copy.deepcopy(bib_file) for _ in range(count)]
+        with contextlib.redirect_stdout(None):
+            return merge.merge_all_files(bib_files, config)
+
+    pairwise_time, pairwise_file = time_call(merge_pairwise, repeat)
+    all_time, all_file = time_call(merge_all, repeat)
+    assert all_file.content == pairwise_file.content, "merge_all_files produced different results!"
+    print_result(f"merge_files ({count} files, pairwise)", pairwise_time, size)
+    print_result(f"merge_all_files ({count} files)", all_time, size, pairwise_time)
+
+
+def benchmark_synonyms(path, repeat, count):
+    """
+    Compares canonicalizing the authors and journals of all references by reading and scanning synonyms.json for
+    every name, like replace_synonym did, with canonicalize_bib and its index, for count synonyms.
+    """
+    size = os.path.getsize(path)
+    bib_file = file_parser.parse_bib(path, False)
+    generator = random.Random(42)
+    # without braces, which the old lookup did not strip from the variants in the file
+    words = [word for word in WORDS if "{" not in word]
+    synonym_rules = {f"Canonical Name {index}": [" ".join(generator.choice(words) for _ in range(2))
+                                                 for _ in range(3)] for index in range(count)}
+
+    class ScanningIndex(object):
+        def canonical(self, text):
+            text = text.strip().strip("{}")
+            for key, values in json_loader.load_synonyms().items():
+                if text == key or text in values:
+                    return key
+            return None
+
+    def scan():
+        edited = copy.deepcopy(bib_file)
+        index = ScanningIndex()
+        for reference in edited.get_references():
+            for name, value in reference.field_items():
+                if name in synonyms.CANONICALIZED_FIELDS:
+                    setattr(reference, name, synonyms._canonicalize_value(index, value,
+                                                                          name in synonyms.NAME_LIST_FIELDS))
+        return edited
+
+    def canonicalize():
+        edited = copy.deepcopy(bib_file)
+        synonyms.canonicalize_bib(edited)
+        return edited
+
+    synonyms_file = json_loader.SYNONYMS_FILE
+    json_loader.SYNONYMS_FILE = path + ".synonyms.json"
+    try:
+        with open(json_loader.SYNONYMS_FILE, "w", encoding="utf-8") as file:
+            json.dump(synonym_rules, file)
+        # reading the file for every name is slow, once is enough to compare
+        scan_time, scan_file = time_call(scan, 1)
+        index_time, index_file = time_call(canonicalize, repeat)
+        assert index_file.content == scan_file.content, "canonicalize_bib produced different results!"
+        print_result(f"replace_synonym per name ({count} synonyms)", scan_time, size)
+        print_result(f"canonicalize_bib ({count} synonyms)", index_time, size, scan_time)
+    finally:
+        os.remove(json_loader.SYNONYMS_FILE)
+        json_loader.SYNONYMS_FILE = synonyms_file
+        synonyms._index = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the parsing and generating of bib files.")
+    parser.add_argument("path", nargs="?", help="bib file to benchmark, if not given a synthetic file is generated")
+    parser.add_argument("-entries", type=int, default=5000, help="number of references in the synthetic file")
+    parser.add_argument("-repeat", type=int, default=3)
+    parser.add_argument("-workers", type=int, nargs="+", default=[2, 4],
+                        help="worker counts to benchmark parallel parsing, generating and transforming with")
+    parser.add_argument("-abbreviations", type=int, default=200, help="number of abbreviations to replace")
+    parser.add_argument("-merge_files", type=int, default=4, help="number of copies of the file to merge")
+    parser.add_argument("-synonyms", type=int, default=1000, help="number of synonyms to canonicalize with")
+    args = parser.parse_args()
+
+    bench_path = args.path
+    if bench_path is None:
+        bench_path = "benchmark-temporary-file.bib"
+        generate_example_file(bench_path, args.entries)
+    print(f"Benchmarking '{bench_path}' ({os.path.getsize(bench_path) / 1024 / 1024:.1f} MB)")
+    try:
+        benchmark_parser_engines(bench_path, args.repeat)
+        benchmark_mmap(bench_path, args.repeat)
+        benchmark_workers(bench_path, args.repeat, sorted(set(args.workers)))
+        benchmark_reparse(bench_path, args.repeat)
+        benchmark_references(bench_path, args.repeat)
+        benchmark_generate(bench_path, args.repeat, sorted(set(args.workers)))
+        benchmark_abbreviations(bench_path, args.repeat, args.abbreviations)
+        benchmark_cleanup(bench_path, args.repeat)
+        benchmark_transform_workers(bench_path, args.repeat, sorted(set(args.workers)))
+        benchmark_merge(bench_path, args.repeat, args.merge_files)
+        benchmark_synonyms(bench_path, args.repeat, args.synonyms)
+    finally:
+        if args.path is None and os.path.isfile(bench_path):
+            os.remove(bench_path)
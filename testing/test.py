@@ -104,6 +104,9 @@ def test_files(directory_path) -> bool:
 
         # Check if the contents are the same when the generated file is parsed again:
         assert file_parser.parse_bib(temp_file_name).content == bib_file.content
+        # And when it is generated and parsed in memory:
+        generated = file_generator.render_bib_to_bytes(bib_file)
+        assert file_parser.parse_bib_bytes(generated).content == bib_file.content
     if os.path.isfile(temp_file_name):
         os.remove(temp_file_name)
     return True
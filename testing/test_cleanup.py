@@ -0,0 +1,44 @@
+from objects import Reference, TokenType
+from utils import cleanup
+
+# (value, value with braces, value with quotation marks)
+ENCLOSURE_CASES = [
+    ('{plain}', '{plain}', '"plain"'),
+    ('"plain"', '{plain}', '"plain"'),
+    ('{2001}', '2001', '2001'),
+    ('jan', 'jan', 'jan'),
+    ('jan # "x"', 'jan # "x"', 'jan # "x"'),
+    # An enclosure in an enclosure loses all its enclosures.
+    ('{"https://doi.org/10.1/x"}', '{https://doi.org/10.1/x}', '"https://doi.org/10.1/x"'),
+    ('"{https://doi.org/10.1/x}"', '{https://doi.org/10.1/x}', '"https://doi.org/10.1/x"'),
+    ('{{Title}}', '{Title}', '"Title"'),
+    # Braces inside the text are kept.
+    ('{Nested {deep}}', '{Nested {deep}}', '"Nested {deep}"'),
+    ('"Nested {deep}"', '{Nested {deep}}', '"Nested {deep}"'),
+    ('{{A} and {B}}', '{{A} and {B}}', '"{A} and {B}"'),
+    # A quotation mark can not be in a quoted value.
+    ('{"a" and "b"}', '{"a" and "b"}', '{"a" and "b"}'),
+    ('{say "hi"}', '{say "hi"}', '{say "hi"}'),
+]
+
+
+def test_change_field_enclosure() -> bool:
+    """
+    Checks the values the cleanup gives when changing the enclosures to braces and to quotation marks.
+    :return: True if all values are as expected.
+    """
+    correct = True
+    for value, braced, quoted in ENCLOSURE_CASES:
+        for enclosure, expected in [(TokenType.BRACED, braced), (TokenType.QUOTED, quoted)]:
+            reference = Reference("", "article", "key")
+            reference.set_fields({"title": value})
+            result = cleanup._change_field_enclosure(reference, "title", value, enclosure)
+            if result != expected:
+                print(f"Changing the enclosure of {value} to {enclosure.name} gives {result} instead of {expected}")
+                correct = False
+    return correct
+
+
+if __name__ == '__main__':
+    if test_change_field_enclosure():
+        print("Changing the enclosures of field values works.")
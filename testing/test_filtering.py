@@ -0,0 +1,41 @@
+import os
+from utils import file_parser, filtering
+
+EXAMPLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../bib_files/bibtests.bib")
+
+
+def test_search_meta_data(path=EXAMPLE_PATH) -> bool:
+    """
+    Checks that search, iter_search and filterByFieldValue find references by their cite key and entry type, which
+    are not fields of the references.
+    :param path: the path of the file to test, with references with 'test' in their cite key.
+    :return: True if the references are found.
+    """
+    bib_file = file_parser.parse_bib(path, False)
+    references = bib_file.get_references()
+    for name in ["cite_key", "entry_type"]:
+        value = getattr(references[0], name)
+        expected = [ref.cite_key for ref in references if value.lower() in getattr(ref, name).lower()]
+        found = [ref.cite_key for ref in filtering.search(bib_file, value)]
+        if not set(expected) <= set(found):
+            print(f"search('{value}') did not find the references with that {name}: {found} != {expected}")
+            return False
+        found = [ref.cite_key for ref in filtering.iter_search(bib_file.content, value)]
+        if not set(expected) <= set(found):
+            print(f"iter_search('{value}') did not find the references with that {name}: {found} != {expected}")
+            return False
+        found = [ref.cite_key for ref in filtering.filterByFieldValue(bib_file, name, value)]
+        if found != expected:
+            print(f"filterByFieldValue('{name}', '{value}') gives {found} instead of {expected}")
+            return False
+
+    found = [ref.cite_key for ref in filtering.search(bib_file, "test")]
+    if "test" not in found:
+        print(f"search('test') did not find the reference with cite key 'test': {found}")
+        return False
+    return True
+
+
+if __name__ == '__main__':
+    if test_search_meta_data():
+        print("Searching and filtering by cite key and entry type works.")
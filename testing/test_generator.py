@@ -0,0 +1,50 @@
+import os
+import tempfile
+from utils import file_parser, file_generator
+
+EXAMPLE_FILE = """% A comment above the reference.
+@article{multiline,
+  title = {A long
+     title},
+  year  = {2000}
+}
+
+@article{oneline,
+  title = {A short title},
+  year = {2001}
+}
+"""
+
+
+def test_keep_unchanged_entries_after_removed_newlines() -> bool:
+    """
+    Checks that generate_bib copies the unchanged entries from the file, but not the entries whose values lost their
+    newlines while parsing (remove_newlines_in_fields), since their bytes in the file differ from their values.
+    :return: True if the generated file has the same values as the parsed file.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "newlines.bib")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(EXAMPLE_FILE)
+        for workers in [1, 2]:
+            bib_file = file_parser.parse_bib(path, True, workers=workers)
+            generated_path = os.path.join(directory, "generated.bib")
+            file_generator.generate_bib(bib_file, generated_path, keep_unchanged_entries=True)
+            with open(generated_path, encoding="utf-8") as file:
+                generated = file.read()
+            if "A long title" not in generated:
+                print(f"The removed newlines were written back:\n{generated}")
+                return False
+            if "@article{oneline,\n  title = {A short title},\n  year = {2001}\n}" not in generated:
+                print(f"The unchanged entry was not copied from the file:\n{generated}")
+                return False
+            generated_file = file_parser.parse_bib(generated_path, False)
+            if generated_file.content != bib_file.content:
+                print(f"The generated file does not have the parsed values:\n{generated}")
+                return False
+    return True
+
+
+if __name__ == '__main__':
+    if test_keep_unchanged_entries_after_removed_newlines():
+        print("Generating after removing newlines in fields writes the parsed values.")
@@ -0,0 +1,86 @@
+import contextlib
+import io
+import interface_handler
+from objects import Preamble, Reference
+from utils import file_parser, json_loader, merge
+
+CONFIG = json_loader.Config({"clean_before_merge": False})
+
+FILES = [
+    """@string{acm = "ACM"}
+@preamble{"first preamble"}
+@article{doi_a, author = {Smith, John}, title = {Sparse graphs}, year = {2001}, doi = {10.1000/a}}
+@article{sig_b, author = {Chen, Li}, title = {Robust learning}, year = {2010}}
+@article{both_c, author = {Rossi, Anna}, title = {Fast theory}, year = {2003}}
+@article{only_1, author = {Kumar, Ravi}, title = {Only in the first file}, year = {1999}}
+""",
+    """@string{acm = "ACM"}
+@string{ieee = "IEEE"}
+@preamble{"first preamble"}
+@article{doi_a2, author = {Smith, John}, title = {Sparse graphs}, year = {2001}, doi = {10.1000/a}, pages = {1--10}}
+@article{sig_b2, author = {Chen, Li}, title = {Robust Learning}, year = {2010}}
+@article{both_c2, author = {Rossi, Anna}, title = {Fast theory}, year = {2004}}
+""",
+    """@preamble{"second preamble"}
+@article{doi_a3, author = {Smith, J.}, title = {Graphs revisited}, doi = {https://doi.org/10.1000/A}, pages = {1-10}}
+@article{both_c3, author = {Rossi, Anna}, title = {Fast theory}, year = {2005}, note = {Third}}
+@article{only_3, author = {Novak, Jan}, title = {Only in the third file}, year = {2020}}
+""",
+    """@string{ieee = "IEEE"}
+@article{sig_b4, author = {Chen, Li}, title = {Robust learning}, year = {2010}, journal = ieee}
+@article{both_c4, author = {Rossi, Anna}, title = {Fast theory}, year = {2006}}
+""",
+]
+
+
+def _merge(choice, n_way) -> list:
+    # Parses the files again for every merge, since merging can change them, and answers every prompt with choice.
+    merge._prompt_ref_merge_decision = lambda reference_1, reference_2: choice
+    merge._prompt_field_conflict_choice = lambda field, value_1, value_2, reference_1, reference_2: 1
+    bib_files = [file_parser.parse_bib_string(text, False, file_path=f"file{number}.bib", config=CONFIG)
+                 for number, text in enumerate(FILES)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        if n_way:
+            merged = merge.merge_all_files(bib_files, CONFIG)
+        else:
+            merged = bib_files[0]
+            for bib_file in bib_files[1:]:
+                merged = merge.merge_files(merged, bib_file, CONFIG)
+    references = [(entry.cite_key, sorted(entry.field_items())) if isinstance(entry, Reference) else entry.preamble
+                  for entry in merged.content if isinstance(entry, (Reference, Preamble))]
+    strings = [(string.abbreviation, string.long_form) for string in merged.get_strings()]
+    return references, strings
+
+
+def test_merge_all_files() -> bool:
+    """
+    Checks that merge_all_files gives the same references and preambles as merging the files one after another with
+    merge_files, with references matched by DOI, by author and title and by the user, for every answer to the
+    prompt. Unlike merge_files, merge_all_files also keeps the strings that only occur in later files.
+    :return: True if the merged files are the same.
+    """
+    interface_handler.user_interface = "CLI"
+    prompt_reference_merge = merge._prompt_ref_merge_decision
+    prompt_field_conflict = merge._prompt_field_conflict_choice
+    correct = True
+    try:
+        for choice in [1, 2, 3, 4]:
+            pairwise, _ = _merge(choice, False)
+            n_way, n_way_strings = _merge(choice, True)
+            if n_way != pairwise:
+                print(f"Answering {choice} gives other references with merge_all_files:")
+                print(f"merge_files:     {pairwise}")
+                print(f"merge_all_files: {n_way}")
+                correct = False
+            if n_way_strings != [("acm", "ACM"), ("ieee", "IEEE")]:
+                print(f"Answering {choice} gives the strings {n_way_strings} with merge_all_files")
+                correct = False
+    finally:
+        merge._prompt_ref_merge_decision = prompt_reference_merge
+        merge._prompt_field_conflict_choice = prompt_field_conflict
+    return correct
+
+
+if __name__ == '__main__':
+    if test_merge_all_files():
+        print("Merging all files at once gives the same file as merging them one after another.")
@@ -37,7 +37,7 @@ def compare_parsing(original_path) -> bool:
                 return False
             else:
                 file_parser_reference = file_parser_example_file.get_reference_by_key(cite_key)
-                file_parser_reference_fields = len(file_parser_reference.get_fields()) - 1
+                file_parser_reference_fields = len(file_parser_reference.get_fields()) + 2  # ENTRYTYPE and ID
                 if file_parser_reference_fields != len(entry):
                     print(f"Entry with cite key '{cite_key}' "
                           f"does not have the same number of fields in the parsed file: "
@@ -0,0 +1,54 @@
+import os
+import tempfile
+from utils import file_parser
+
+# Input the scanner hands over to the state machine halfway through, which must give the same result as parsing
+# everything with the state machine.
+ENGINE_CASES = [
+    '@article{a, title = {T}}\n@strng{abbr = "v"}',
+    '@article{a, title = {T}, year = {1}}\n@misc{k = "v", note = {x}}\n',
+    '@article{a, title = {T},}\n@misc{k = "v"}\n@article{b, x = {1}}\n@misc{k2 = 3}',
+    '@string{s = "S"}\n@misc{k = "v"}',
+    '@misc{k = "v"}',
+    '@article{a, title = {T}}\n@article{b, title = {unterminated',
+    '@article{a, title = {A\n   long title}}\n% comment\n@misc{k = "v"}\n',
+    '@article{a, title = {T}}\n@comment{c}\n@preamble{"p"}\n@misc{k = {v}}',
+]
+
+
+def _parse(text, remove_newlines_in_fields, engine, path=None):
+    # Returns the content, or the error if the text can not be parsed.
+    try:
+        if path is None:
+            return file_parser.parse_bib_string(text, remove_newlines_in_fields, engine=engine).content
+        return file_parser.parse_bib(path, remove_newlines_in_fields, engine=engine).content
+    except ValueError as e:
+        return str(e)
+
+
+def test_same_result_for_both_engines() -> bool:
+    """
+    Checks that the scanner and the state machine engine give the same entries (or the same error) for malformed
+    input, both for text in memory and for a file.
+    :return: True if both engines give the same result for every case.
+    """
+    correct = True
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "engines.bib")
+        for text in ENGINE_CASES:
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(text)
+            for remove_newlines_in_fields in [False, True]:
+                for file_path in [None, path]:
+                    scanned = _parse(text, remove_newlines_in_fields, file_parser.SCANNER_ENGINE, file_path)
+                    expected = _parse(text, remove_newlines_in_fields, file_parser.STATE_MACHINE_ENGINE, file_path)
+                    if scanned != expected:
+                        print(f"The engines give different results for {text!r} "
+                              f"(remove_newlines_in_fields={remove_newlines_in_fields}, file={file_path is not None})")
+                        correct = False
+    return correct
+
+
+if __name__ == '__main__':
+    if test_same_result_for_both_engines():
+        print("Both parser engines give the same result.")
@@ -0,0 +1,70 @@
+import os
+import tempfile
+from utils import file_parser
+
+ENTRIES = {
+    "first": "@article{first,\n  title = {First},\n  year = {2001}\n}\n",
+    "second": "% A comment above the reference.\n@book{second,\n  title = {Second},\n  year = {2002}\n}\n",
+    "third": "@misc{third,\n  title = {Third},\n  note = {A note}\n}\n",
+    "fourth": "@article{fourth,\n  title = {Fourth},\n  year = {2004}\n}\n",
+}
+
+# (description, cite keys of the new version of the file, changed entries, added, removed, modified)
+REPARSE_CASES = [
+    ("nothing changed", ["first", "second", "third", "fourth"], {}, [], [], []),
+    ("a field changed", ["first", "second", "third", "fourth"],
+     {"third": ENTRIES["third"].replace("A note", "Another note")}, [], [], ["third"]),
+    ("a comment changed", ["first", "second", "third", "fourth"],
+     {"second": ENTRIES["second"].replace("A comment", "Another comment")}, [], [], ["second"]),
+    ("a reference added", ["first", "second", "new", "third", "fourth"],
+     {"new": "@article{new,\n  title = {New}\n}\n"}, ["new"], [], []),
+    ("the first reference removed", ["second", "third", "fourth"], {}, [], ["first"], []),
+    ("the last reference removed", ["first", "second", "third"], {}, [], ["fourth"], []),
+    ("added, removed and modified", ["new", "second", "third"],
+     {"new": "@article{new,\n  title = {New}\n}\n", "second": ENTRIES["second"].replace("2002", "2020")},
+     ["new"], ["first", "fourth"], ["second"]),
+]
+
+
+def _write_file(path, cite_keys, changed_entries):
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("\n".join(changed_entries.get(cite_key, ENTRIES.get(cite_key)) for cite_key in cite_keys))
+        file.write("\n% The end of the file.\n")
+
+
+def test_reparse_changes() -> bool:
+    """
+    Checks that reparse_bib finds the references that were added, removed and modified after a file changed, gives
+    the same content as parsing the whole file again, and keeps the Reference objects of the unchanged references.
+    :return: True if all changes are found.
+    """
+    correct = True
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "reparse.bib")
+        for description, cite_keys, changed_entries, added, removed, modified in REPARSE_CASES:
+            _write_file(path, list(ENTRIES), {})
+            previous = file_parser.parse_bib(path, False)
+            old_references = {ref.cite_key: ref for ref in previous.get_references()}
+            _write_file(path, cite_keys, changed_entries)
+
+            result, changes = file_parser.reparse_bib(previous, False)
+            expected = file_parser.parse_bib(path, False)
+            if result.content != expected.content:
+                print(f"{description}: the content differs from parsing the whole file")
+                correct = False
+            for name, found, wanted in [("added", changes.added, added), ("removed", changes.removed, removed),
+                                        ("modified", changes.modified, modified)]:
+                if sorted(found) != sorted(wanted):
+                    print(f"{description}: {name} is {found} instead of {wanted}")
+                    correct = False
+            for ref in result.get_references():
+                unchanged = ref.cite_key in old_references and ref.cite_key not in changed_entries
+                if unchanged and ref is not old_references[ref.cite_key]:
+                    print(f"{description}: the unchanged reference {ref.cite_key} is a new object")
+                    correct = False
+    return correct
+
+
+if __name__ == '__main__':
+    if test_reparse_changes():
+        print("Parsing a changed file again finds the changes.")
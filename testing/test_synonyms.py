@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+from utils import file_parser, json_loader, synonyms
+
+SYNONYMS = {
+    "John Doe": ["{Doe, J.}", " J. Doe "],
+    "P Visser": ["Visser, Pepijn", "Pepijn Visser"],
+    "Journal of Library Science": ["J. Libr. Sci."],
+}
+
+EXAMPLE_FILE = """@string{jlib = "J. Libr. Sci."}
+@article{names,
+  author = {Doe, J. and Someone Else and Pepijn Visser},
+  editor = {J. Doe},
+  journal = {J. Libr. Sci.},
+  year = 2000
+}
+@article{macro,
+  author = "J. Doe",
+  journal = jlib,
+  title = {J. Doe}
+}
+@article{unchanged,
+  author = {John Doe and P Visser},
+  journal = {Journal of Library Science}
+}
+"""
+
+EXPECTED_FIELDS = {
+    "names": {"author": "{John Doe and Someone Else and P Visser}", "editor": "{J. Doe}",
+              "journal": "{Journal of Library Science}", "year": "2000"},
+    "macro": {"author": "\"John Doe\"", "journal": "jlib", "title": "{J. Doe}"},
+    "unchanged": {"author": "{John Doe and P Visser}", "journal": "{Journal of Library Science}"},
+}
+
+
+def test_canonicalize_bib() -> bool:
+    """
+    Checks that canonicalize_bib replaces every name of an author field by its canonical name, replaces journals as
+    a whole, leaves macros and the other fields alone and counts the changed fields. Uses a temporary synonyms file,
+    so the synonyms.json of the user is not used.
+    :return: True if the fields and the number of changed fields are as expected.
+    """
+    synonyms_file = json_loader.SYNONYMS_FILE
+    correct = True
+    with tempfile.TemporaryDirectory() as directory:
+        json_loader.SYNONYMS_FILE = os.path.join(directory, "synonyms.json")
+        try:
+            with open(json_loader.SYNONYMS_FILE, "w", encoding="utf-8") as file:
+                json.dump(SYNONYMS, file)
+            bib_file = file_parser.parse_bib_string(EXAMPLE_FILE, False)
+            changed = synonyms.canonicalize_bib(bib_file)
+            if changed != 3:
+                print(f"canonicalize_bib changed {changed} fields instead of 3")
+                correct = False
+            for reference in bib_file.get_references():
+                fields = reference.get_fields()
+                if fields != EXPECTED_FIELDS[reference.cite_key]:
+                    print(f"The fields of {reference.cite_key} are {fields} instead of "
+                          f"{EXPECTED_FIELDS[reference.cite_key]}")
+                    correct = False
+            if bib_file.get_strings()[0].long_form != "J. Libr. Sci.":
+                print("canonicalize_bib changed a string")
+                correct = False
+            if synonyms.canonicalize_bib(bib_file) != 0:
+                print("canonicalize_bib changed fields that were already canonical")
+                correct = False
+        finally:
+            json_loader.SYNONYMS_FILE = synonyms_file
+            synonyms._index = None  # Read the synonyms of the user again on the next lookup.
+    return correct
+
+
+if __name__ == '__main__':
+    if test_canonicalize_bib():
+        print("Canonicalizing the names of a file works.")
@@ -0,0 +1,82 @@
+import os
+import tempfile
+from utils.tagging import TagQuery, TagStore, _JsonTagBackend
+
+TAGS = {
+    "ML": ["a", "b", "c"],
+    "survey": ["a", "d"],
+    "benchmark": ["b"],
+    "retracted": ["c"],
+    "O'Brien": ["d"],
+    "Computer Science": ["e"],
+}
+ALL_CITE_KEYS = ["a", "b", "c", "d", "e", "f"]
+
+# (query, cite keys that match it)
+QUERY_CASES = [
+    ("ML", {"a", "b", "c"}),
+    # NOT binds stronger than AND, and AND stronger than OR.
+    ("ML AND NOT retracted", {"a", "b"}),
+    ("survey OR ML AND benchmark", {"a", "d", "b"}),
+    ("(survey OR ML) AND benchmark", {"b"}),
+    ("NOT ML OR survey", {"a", "d", "e", "f"}),
+    ("NOT (ML OR survey)", {"e", "f"}),
+    ("ML and not retracted", {"a", "b"}),
+    ("ML AND (survey OR benchmark) AND NOT retracted", {"a", "b"}),
+    # NOT selects from the given cite keys, also the ones without tags.
+    ("NOT ML", {"d", "e", "f"}),
+    ("NOT NOT survey", {"a", "d"}),
+    ("unknown", set()),
+    ('"Computer Science" OR benchmark', {"b", "e"}),
+    # A single quote inside an unquoted tag is part of the tag.
+    ("O'Brien", {"d"}),
+    ("O'Brien OR retracted", {"c", "d"}),
+]
+
+INVALID_QUERIES = ["", "ML AND", "(ML", "ML)", "AND ML", "\"ML", "'ML", "ML survey"]
+
+
+def test_tag_queries() -> bool:
+    """
+    Checks the results of tag queries, like the precedence of NOT, AND and OR, parentheses and quoted tags, on a
+    temporary tags file, so the tags.json of the user is not used.
+    :return: True if all queries give the expected cite keys and the invalid queries fail.
+    """
+    correct = True
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tags.json")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write("{}")
+        store = TagStore(_JsonTagBackend(path))
+        with store.transaction():
+            for tag, cite_keys in TAGS.items():
+                store.tag(tag, cite_keys)
+
+        for query, expected in QUERY_CASES:
+            found = store.query(query, ALL_CITE_KEYS)
+            if found != expected:
+                print(f"The query {query} gives {sorted(found)} instead of {sorted(expected)}")
+                correct = False
+
+        for query in INVALID_QUERIES:
+            try:
+                TagQuery(query)
+            except ValueError:
+                continue
+            print(f"The invalid query {query} did not fail")
+            correct = False
+
+        # A new store numbers the cite keys again, which must give the same results.
+        store.close()
+        store = TagStore(_JsonTagBackend(path))
+        for query, expected in QUERY_CASES:
+            if store.query(query, list(reversed(ALL_CITE_KEYS))) != expected:
+                print(f"The query {query} gives another result after reading the tags again")
+                correct = False
+        store.close()
+    return correct
+
+
+if __name__ == '__main__':
+    if test_tag_queries():
+        print("Tag queries work.")
@@ -1,40 +1,61 @@
 import utils.batch_editor as batch_editor
 from objects import String
-from utils import json_loader, file_parser, file_generator
+from utils import json_loader, file_parser, file_generator, fingerprints
 
 
-def execute_abbreviations(bib_file, minimize, max_abbreviations):
+def execute_abbreviations(bib_file, minimize, max_abbreviations, config: json_loader.Config = None, workers=1):
+    """
+    Collapses (minimize) or expands the abbreviations of abbreviations.json in the file. References that an earlier
+    call with the same abbreviations and arguments left unchanged are skipped, see fingerprints.EntryFingerprints.
+    :param bib_file: the BibFile to change.
+    :param minimize: collapse the long forms to their abbreviations, otherwise expand the abbreviations.
+    :param max_abbreviations: the number of abbreviations that are used (the others are expanded when minimizing).
+    :param config: the json_loader.Config to use. If None: json_loader.get_config().
+    :param workers: the number of processes the references are edited in, see batch_editor.batch_apply.
+    :return: the changed BibFile.
+    """
     data = json_loader.load_abbreviations()
-    config = json_loader.load_config()
-    add_abbreviations_as_strings = config.get("add_abbreviations_as_strings", False)
+    if config is None:
+        config = json_loader.get_config()
+    add_abbreviations_as_strings = config.add_abbreviations_as_strings
+
+    # The batch editor calls, which are applied with one pass over the file.
+    operations = []
 
     # Minimize everything.
     for abbreviation, list in data.items():
         if add_abbreviations_as_strings:
             # First replace everything for the long_form, to ensure that shorten_string finds all occurrences.
-            batch_editor.batch_replace(bib_file, list[1], abbreviation, list[0])
+            operations.append((batch_editor.REPLACE, list[1], abbreviation, list[0]))
 
-            batch_editor.batch_shorten_string(bib_file, list[1], String("", abbreviation, list[0]))
-            batch_editor.replace_string(bib_file, list[0], abbreviation)
+            operations.append((batch_editor.SHORTEN_STRING, list[1], String("", abbreviation, list[0])))
+            operations.append((batch_editor.REPLACE_STRING, list[0], abbreviation))
         else:
-            batch_editor.batch_replace(bib_file, list[1], list[0], abbreviation)
+            operations.append((batch_editor.REPLACE, list[1], list[0], abbreviation))
 
     if minimize:
         # Expand everything after counter + 1 > max_abbreviations.
         for counter, (abbreviation, list) in enumerate(data.items()):
             if counter + 1 > max_abbreviations:
                 if add_abbreviations_as_strings:
-                    batch_editor.replace_string(bib_file, abbreviation, list[0])
+                    operations.append((batch_editor.REPLACE_STRING, abbreviation, list[0]))
                 else:
-                    batch_editor.batch_replace(bib_file, list[1], abbreviation, list[0])
+                    operations.append((batch_editor.REPLACE, list[1], abbreviation, list[0]))
     else:
         # Expand everything before counter + 1 > max_abbreviations.
         for counter, (abbreviation, list) in enumerate(data.items()):
             if counter + 1 < max_abbreviations:
                 if add_abbreviations_as_strings:
-                    batch_editor.replace_string(bib_file, abbreviation, list[0])
+                    operations.append((batch_editor.REPLACE_STRING, abbreviation, list[0]))
                 else:
-                    batch_editor.batch_replace(bib_file, list[1], abbreviation, list[0])
+                    operations.append((batch_editor.REPLACE, list[1], abbreviation, list[0]))
+    # Collapsing and expanding keep their own fingerprints, so switching between them does not forget the other's.
+    operation = "abbreviations-collapse" if minimize else "abbreviations-expand"
+    settings = (data, max_abbreviations, add_abbreviations_as_strings)
+    entry_fingerprints = fingerprints.get_fingerprints(operation, bib_file, settings, config)
+    batch_editor.batch_apply(bib_file, operations, entry_fingerprints, workers)
+    if entry_fingerprints is not None:
+        entry_fingerprints.save()
     return bib_file
 
 
@@ -1,51 +1,59 @@
-from objects import BibFile, Reference, String
-from utils import file_parser, file_generator, cleanup
+import bisect
+import re
 
+from objects import BibFile, Reference, String, FieldValue, TokenType, is_valid_literal
+from utils import file_parser, file_generator, parallel
 
-def batch_replace(bib_file: BibFile, fields_to_edit: list[str], old_string: str, new_string: str) -> BibFile:
+
+def batch_replace(bib_file: BibFile, fields_to_edit: list[str], old_string: str, new_string: str,
+                  workers=1) -> BibFile:
     """
     Searches the references for occurrences of the old_string and replaces them with the new_string.
     Only searches the fields given in the fields_to_edit parameter, or all if empty.
     Also replaces the long_form of string definitions, does not replace string abbreviations.
+    :param workers: the number of processes the references are edited in, see parallel.transform_references.
     """
+    references = []
     for entry in bib_file.content:
         # keep strings
         if type(entry) is String:
             entry.long_form = entry.long_form.replace(old_string, new_string)
 
         if type(entry) is Reference:
-            fields = entry.get_fields()
-            for field_type, data in fields.items():
-                # simply keep comments, entry types and citekeys
-                if field_type == "comment_above_reference" or field_type == "entry_type" or field_type == "cite_key":
-                    continue
-                # we either look through all fields OR if the specific field type is found we also go ahead
-                if fields_to_edit == [] or field_type in fields_to_edit:
-                    if "#" not in data:
-                        if "\"" in data or "{" in data:
-                            fields[field_type] = data.replace(old_string, new_string)
-                    else:
-                        data_list = data.split(" # ")
-                        final_data = ""
-                        # Loop over all elements except the last one (to add the #s back)
-                        for string in data_list[:-1]:
-                            stripped = string.strip()
-                            if "\"" in stripped or "{" in stripped:
-                                final_data += stripped.replace(old_string, new_string) + " # "
-                            else:
-                                final_data += stripped + " # "
-
-                        # Add the final part of the string.
-                        stripped = data_list[-1].strip()
-                        if "\"" in stripped or "{" in stripped:
-                            final_data += stripped.replace(old_string, new_string)
-                        else:
-                            final_data += stripped
-
-                        fields[field_type] = final_data
+            references.append(entry)
+    parallel.transform_references(references, _replace_in_reference, (fields_to_edit, old_string, new_string),
+                                  workers)
     return bib_file
 
 
+def _replace_in_reference(reference: Reference, fields_to_edit: list[str], old_string: str, new_string: str):
+    for field_type, data in reference.field_items():
+        # we either look through all fields OR if the specific field type is found we also go ahead
+        if (fields_to_edit == [] or field_type in fields_to_edit) and old_string in data:
+            value = reference.get_field_value(field_type)
+            new_value = _replace_in_field_value(value, old_string, new_string)
+            if new_value is not value:
+                reference.set_field_value(field_type, new_value)
+
+
+def _replace_in_field_value(value: FieldValue, old_string: str, new_string: str) -> FieldValue:
+    """
+    Replaces the old_string in the braced and quoted literals of a field value, see batch_replace. Macros and numbers
+    are kept. Returns the value itself if nothing changed.
+    """
+    tokens = []
+    changed = False
+    for token_type, text in value:
+        if (token_type is TokenType.BRACED or token_type is TokenType.QUOTED or
+                token_type is TokenType.RAW and ("\"" in text or "{" in text)):
+            new_text = text.replace(old_string, new_string)
+            if new_text != text:
+                changed = True
+                text = new_text
+        tokens.append((token_type, text))
+    return FieldValue(tokens) if changed else value
+
+
 def batch_rename_abbreviation(bib_file: BibFile, old_abbreviation: str, new_abbreviation: str) -> BibFile:
     """
     Rename a String abbreviation in the BibFile.
@@ -57,31 +65,14 @@ def batch_rename_abbreviation(bib_file: BibFile, old_abbreviation: str, new_abbr
             elif entry.abbreviation == new_abbreviation:
                 raise ValueError(f"Abbreviation '{new_abbreviation}' already exists in the bib file!")
         if isinstance(entry, Reference):
-            fields = entry.get_fields()
-            for field_type, data in fields.items():
-                if field_type == "comment_above_reference" or field_type == "entry_type" or field_type == "cite_key":
+            for field_type, data in entry.field_items():
+                if old_abbreviation not in data:
                     continue
-                if data == old_abbreviation:
-                    fields[field_type] = new_abbreviation
-                elif " # " in data:
-                    data_list = data.split(" # ")
-                    final_data = ""
-                    # Loop over all elements except the last one (to add the #s back)
-                    for string in data_list[:-1]:
-                        stripped = string.strip()
-                        if stripped == old_abbreviation:
-                            final_data += new_abbreviation + " # "
-                        else:
-                            final_data += stripped + " # "
-
-                    # Add the final part of the string.
-                    stripped = data_list[-1].strip()
-                    if stripped == old_abbreviation:
-                        final_data += new_abbreviation
-                    else:
-                        final_data += stripped
-
-                    fields[field_type] = final_data
+                value = entry.get_field_value(field_type)
+                if (TokenType.MACRO, old_abbreviation) in value:
+                    entry.set_field_value(field_type, FieldValue(
+                        (TokenType.MACRO, new_abbreviation) if token == (TokenType.MACRO, old_abbreviation) else token
+                        for token in value))
     return bib_file
 
 
@@ -97,33 +88,13 @@ def batch_shorten_string(bib_file: BibFile, fields_to_edit: list[str], string: S
     found = False
     for entry in bib_file.content:
         if isinstance(entry, Reference):
-            fields = entry.get_fields()
-            for field_type, data in fields.items():
-                if field_type == "comment_above_reference" or field_type == "entry_type" or field_type == "cite_key":
-                    continue
-                if not fields_to_edit or field_type in fields_to_edit:
-                    number_of_occurrences = data.count(string.long_form)
-                    if number_of_occurrences == 0:
-                        continue
-                    found = True
-                    if data == "{" + string.long_form + "}" or data == "\"" + string.long_form + "\"":
-                        fields[field_type] = string.abbreviation
-                    else:
-                        updated_data = cleanup.remove_enclosure(fields[field_type])
-                        # Replace start of field.
-                        if updated_data.startswith(string.long_form):
-                            updated_data = string.abbreviation + " # \"" + updated_data[len(string.long_form):]
-                        else:
-                            updated_data = "\"" + updated_data
-                        # Replace end of field
-                        if updated_data.endswith(string.long_form):
-                            updated_data = updated_data[:-len(string.long_form)] + "\" # " + string.abbreviation
-                        else:
-                            updated_data = updated_data + "\""
-                        # Replace all occurrences in the middle.
-                        updated_data = updated_data.replace(string.long_form, "\" # " + string.abbreviation + " # \"")
-
-                        fields[field_type] = updated_data
+            for field_type, data in entry.field_items():
+                if (not fields_to_edit or field_type in fields_to_edit) and string.long_form in data:
+                    value = entry.get_field_value(field_type)
+                    new_value = _shorten_field_value(value, string.long_form, string.abbreviation)
+                    if new_value is not value:
+                        found = True
+                        entry.set_field_value(field_type, new_value)
     if found:
         existing_string_dict = {x.abbreviation: x.long_form for x in bib_file.get_strings()}
         if string.abbreviation not in existing_string_dict:
@@ -134,6 +105,55 @@ def batch_shorten_string(bib_file: BibFile, fields_to_edit: list[str], string: S
     return bib_file
 
 
+def _split_outside_braces(text: str, separator: str) -> list:
+    # Splits the text at the occurrences of the separator that are not inside braces.
+    pieces = []
+    start = 0
+    depth = 0
+    scanned = 0
+    position = text.find(separator)
+    while position != -1:
+        depth += text.count("{", scanned, position) - text.count("}", scanned, position)
+        scanned = position
+        if depth == 0:
+            pieces.append(text[start:position])
+            # the separator has balanced braces, so the depth after it is the same
+            start = scanned = position + len(separator)
+            position = text.find(separator, start)
+        else:
+            position = text.find(separator, position + 1)
+    pieces.append(text[start:])
+    return pieces
+
+
+def _shorten_field_value(value: FieldValue, long_form: str, abbreviation: str) -> FieldValue:
+    """
+    Replaces the long_form in the literals of a field value by the abbreviation of its String, see
+    batch_shorten_string. The text around it becomes quoted literals, so "{A long form B}" becomes
+    "\"A \" # abbreviation # \" B\"". Occurrences inside braces of a literal are kept, because splitting
+    there would break the braces. Returns the value itself if nothing changed.
+    """
+    if not long_form or not is_valid_literal(TokenType.BRACED, long_form):
+        return value
+    tokens = []
+    changed = False
+    for token_type, text in value:
+        if token_type is TokenType.BRACED or token_type is TokenType.QUOTED:
+            pieces = _split_outside_braces(text, long_form)
+            if len(pieces) > 1:
+                changed = True
+                for index, piece in enumerate(pieces):
+                    if index:
+                        tokens.append((TokenType.MACRO, abbreviation))
+                    if piece:
+                        piece_type = (TokenType.QUOTED if is_valid_literal(TokenType.QUOTED, piece)
+                                      else TokenType.BRACED)
+                        tokens.append((piece_type, piece))
+                continue
+        tokens.append((token_type, text))
+    return FieldValue(tokens) if changed else value
+
+
 def replace_string(bib_file: BibFile, old_long_form, new_long_form) -> BibFile:
     """
     Replaces the long form of the strings in the bib file with the new_long_form, if the long_form == old_long_form.
@@ -161,31 +181,13 @@ def batch_extend_strings(bib_file: BibFile, abbreviations: list[str]) -> BibFile
                          if not abbreviations or x.abbreviation in abbreviations}
     for entry in bib_file.content:
         if isinstance(entry, Reference):
-            fields = entry.get_fields()
-            for field_type, data in fields.items():
-                if field_type == "comment_above_reference" or field_type == "entry_type" or field_type == "cite_key":
-                    continue
-                if data in strings_to_extend:
-                    fields[field_type] = "{" + strings_to_extend[data] + "}"
-                elif " # " in data:
-                    data_list = data.split(" # ")
-                    final_data = ""
-                    # Loop over all elements except the last one (to add the #s back)
-                    for string in data_list[:-1]:
-                        stripped = string.strip()
-                        if stripped in strings_to_extend:
-                            final_data += "{" + strings_to_extend[stripped] + "} # "
-                        else:
-                            final_data += stripped + " # "
-
-                    # Add the final part of the string.
-                    stripped = data_list[-1].strip()
-                    if stripped in strings_to_extend:
-                        final_data += "{" + strings_to_extend[stripped] + "}"
-                    else:
-                        final_data += stripped
-
-                    fields[field_type] = final_data
+            for field_type, data in entry.field_items():
+                value = entry.get_field_value(field_type)
+                if any(token_type is TokenType.MACRO and text in strings_to_extend for token_type, text in value):
+                    entry.set_field_value(field_type, FieldValue(
+                        (TokenType.BRACED, strings_to_extend[text])
+                        if token_type is TokenType.MACRO and text in strings_to_extend else (token_type, text)
+                        for token_type, text in value))
 
     # Remove the strings (what an abomination).
     bib_file.content = [x for x in bib_file.content if
@@ -193,6 +195,302 @@ def batch_extend_strings(bib_file: BibFile, abbreviations: list[str]) -> BibFile
     return bib_file
 
 
+# The operations of batch_apply.
+REPLACE = "replace"
+SHORTEN_STRING = "shorten_string"
+REPLACE_STRING = "replace_string"
+
+
+def _build_trie(patterns) -> dict:
+    trie = {}
+    for pattern in patterns:
+        node = trie
+        for char in pattern:
+            node = node.setdefault(char, {})
+        # the empty key marks the end of a pattern, the other keys are single characters
+        node[""] = True
+    return trie
+
+
+def _trie_regex(node: dict) -> str:
+    branches = []
+    for char, child in node.items():
+        if char == "":
+            continue
+        # a chain of nodes with a single child becomes one literal
+        literal = char
+        while len(child) == 1 and "" not in child:
+            (char, child), = child.items()
+            literal += char
+        branches.append(re.escape(literal) + _trie_regex(child))
+    if not branches:
+        return ""
+    regex = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    # try the longer patterns first, so the longest pattern that starts at a position matches
+    return "(?:" + regex + ")?" if "" in node else regex
+
+
+class PatternSet(object):
+    """
+    Finds which of a set of strings occur in a text with one scan of the text. The strings are compiled into a single
+    regular expression shaped like a trie, which matches the longest string that starts at each position of the
+    text. The other strings that start at that position are prefixes of it, so they are looked up in the trie.
+    """
+    def __init__(self, patterns):
+        patterns = set(patterns)
+        # the empty string occurs in every text
+        self._always = {""} & patterns
+        patterns.discard("")
+        trie = _build_trie(patterns)
+        self._prefixes = {}
+        for pattern in patterns:
+            node = trie
+            prefixes = []
+            for length, char in enumerate(pattern, 1):
+                node = node[char]
+                if "" in node:
+                    prefixes.append(pattern[:length])
+            self._prefixes[pattern] = prefixes
+        self._regex = re.compile("(?=(" + _trie_regex(trie) + "))") if patterns else None
+
+    def occurring_in(self, text: str) -> set:
+        """
+        Returns the strings of the set that occur in the text.
+        """
+        occurring = set(self._always)
+        if self._regex is not None:
+            for match in self._regex.finditer(text):
+                occurring.update(self._prefixes[match.group(1)])
+        return occurring
+
+
+def _next_position(keys, positions: dict, position: int, end: int) -> int:
+    # The first position at or after position of one of the keys, or end.
+    next_position = end
+    for key in keys:
+        key_positions = positions.get(key)
+        if key_positions:
+            index = bisect.bisect_left(key_positions, position)
+            if index < len(key_positions) and key_positions[index] < next_position:
+                next_position = key_positions[index]
+    return next_position
+
+
+def _field_operations(operations: list, field_type: str) -> tuple:
+    # The REPLACE and SHORTEN_STRING operations that edit the field, as (kind, old, new, index in operations).
+    field_operations = []
+    for index, operation in enumerate(operations):
+        if operation[0] is REPLACE:
+            _, fields_to_edit, old_string, new_string = operation
+            if fields_to_edit == [] or field_type in fields_to_edit:
+                field_operations.append((REPLACE, old_string, new_string, index))
+        elif operation[0] is SHORTEN_STRING:
+            _, fields_to_edit, string = operation
+            if not fields_to_edit or field_type in fields_to_edit:
+                field_operations.append((SHORTEN_STRING, string.long_form, string.abbreviation, index))
+    return tuple(field_operations)
+
+
+def _compile_operations(operations) -> tuple:
+    # The operations with the positions of every old string and a PatternSet of the old strings.
+    positions = {}
+    for position, (kind, old, *_) in enumerate(operations):
+        if kind is REPLACE or kind is SHORTEN_STRING:
+            positions.setdefault(old, []).append(position)
+    return operations, positions, PatternSet(positions)
+
+
+def _edit_field_value(data: str, value: FieldValue, compiled: tuple, found: set) -> str:
+    """
+    Applies the operations of a field to its value one after another, like batch_replace and batch_shorten_string
+    would. Only the operations whose old string occurs in the value can change it, so those are looked up in the
+    PatternSet and the others are skipped.
+    """
+    operations, positions, patterns = compiled
+    position = 0
+    end = len(operations)
+    occurring = None
+    while True:
+        if occurring is None:
+            occurring = patterns.occurring_in(data)
+        next_position = _next_position(occurring, positions, position, end)
+        if next_position == end:
+            return data
+        kind, old, new, operation_index = operations[next_position]
+        if kind is REPLACE:
+            new_value = _replace_in_field_value(value, old, new)
+        else:
+            new_value = _shorten_field_value(value, old, new)
+            if new_value is not value:
+                found.add(operation_index)
+        if new_value is not value:
+            data = new_value.render()
+            # like Reference.set_field_value and get_field_value
+            value = new_value if new_value.is_valid() else FieldValue.parse(data)
+            occurring = None
+        position = next_position + 1
+
+
+def _edit_long_form(long_form: str, compiled: tuple, equal_positions: dict, position: int, history: list) -> str:
+    """
+    Applies the operations to the long form of a String from the position on, like batch_replace and replace_string
+    would, and adds every change to the history as (position, new long form).
+    """
+    operations, positions, patterns = compiled
+    end = len(operations)
+    occurring = None
+    while True:
+        if occurring is None:
+            occurring = patterns.occurring_in(long_form)
+        next_position = min(_next_position(occurring, positions, position, end),
+                            _next_position((long_form,), equal_positions, position, end))
+        if next_position == end:
+            return long_form
+        kind, old, new = operations[next_position]
+        new_long_form = long_form.replace(old, new) if kind is REPLACE else new
+        if new_long_form != long_form:
+            long_form = new_long_form
+            occurring = None
+            history.append((next_position, long_form))
+        position = next_position + 1
+
+
+def _long_form_at(initial: str, history: list, position: int) -> str:
+    # The long form before the operation at the position.
+    long_form = initial
+    for change_position, changed in history:
+        if change_position >= position:
+            break
+        long_form = changed
+    return long_form
+
+
+# The operations of the last _edit_reference call in this process, with their compiled operations by field type and
+# by list of operations.
+_compiled_operations = None
+
+
+def _edit_reference(reference: Reference, operations: list) -> tuple:
+    """
+    Computes the edits of the operations of batch_apply to the fields of the reference, without changing it.
+    :return: the list of (field type, new value) of the fields that change, and the set of positions of the
+    batch_shorten_string operations that found their long form.
+    """
+    global _compiled_operations
+    if _compiled_operations is None or _compiled_operations[0] is not operations:
+        _compiled_operations = (operations, {}, {})
+    # Every field gets the operations that edit it, compiled once for every different list of operations.
+    _, compiled_by_field, compiled_by_operations = _compiled_operations
+    changes = []
+    found = set()
+    for field_type, data in reference.field_items():
+        compiled = compiled_by_field.get(field_type)
+        if compiled is None:
+            field_operations = _field_operations(operations, field_type)
+            compiled = compiled_by_operations.get(field_operations)
+            if compiled is None:
+                compiled = compiled_by_operations[field_operations] = _compile_operations(field_operations)
+            compiled_by_field[field_type] = compiled
+        if not compiled[0]:
+            continue
+        new_data = _edit_field_value(data, reference.get_field_value(field_type), compiled, found)
+        if new_data != data:
+            changes.append((field_type, new_data))
+    return changes, found
+
+
+def batch_apply(bib_file: BibFile, operations: list, entry_fingerprints=None, workers=1) -> BibFile:
+    """
+    Applies a list of batch_replace, batch_shorten_string and replace_string calls with one pass over the references,
+    with the same result as calling them one after another. Instead of searching every field for every old string,
+    every field value is scanned once for all old strings of the operations that edit that field (see PatternSet),
+    and only the operations that find their old string are applied.
+    :param bib_file: input BibFile object.
+    :param operations: list of (REPLACE, fields_to_edit, old_string, new_string),
+    (SHORTEN_STRING, fields_to_edit, string) and (REPLACE_STRING, old_long_form, new_long_form) tuples, with the
+    arguments of batch_replace, batch_shorten_string and replace_string.
+    :param entry_fingerprints: the fingerprints.EntryFingerprints of earlier calls with the same operations, or None.
+    References that those calls left unchanged are skipped, the fingerprints of the references this call leaves
+    unchanged are added (with the batch_shorten_string calls that found their long form in the reference).
+    :param workers: the number of processes the edits of the references are computed in, see
+    parallel.map_references.
+    :return: output BibFile object. If batch_shorten_string would raise a ValueError, it is raised before the file is
+    changed.
+    """
+    global _compiled_operations
+    operations = list(operations)
+    found = set()
+    references = []
+    for entry in bib_file.content:
+        if type(entry) is Reference:
+            entry_found = entry_fingerprints.get(entry) if entry_fingerprints is not None else None
+            if entry_found is not None:
+                found.update(entry_found)
+            else:
+                references.append(entry)
+    try:
+        edits = parallel.map_references(references, _edit_reference, (operations,), workers)
+    finally:
+        _compiled_operations = None
+    changed_fields = []
+    for entry, (changes, entry_found) in zip(references, edits):
+        found.update(entry_found)
+        for field_type, new_data in changes:
+            changed_fields.append((entry, field_type, new_data))
+        if entry_fingerprints is not None and not changes:
+            entry_fingerprints.add(entry, tuple(sorted(entry_found)))
+
+    # The long forms of the strings, including the strings batch_shorten_string adds to the file.
+    string_operations = []
+    for operation in operations:
+        if operation[0] is REPLACE:
+            string_operations.append((REPLACE, operation[2], operation[3]))
+        elif operation[0] is SHORTEN_STRING:
+            # adds the string to the file, see below
+            string_operations.append((None, None, None))
+        else:
+            string_operations.append(operation)
+    compiled = _compile_operations(string_operations)
+    equal_positions = {}
+    for position, (kind, old, _) in enumerate(string_operations):
+        if kind is REPLACE_STRING:
+            equal_positions.setdefault(old, []).append(position)
+
+    long_forms = []
+    strings_by_abbreviation = {}
+    for entry in bib_file.content:
+        if type(entry) is String:
+            history = []
+            long_forms.append((entry, _edit_long_form(entry.long_form, compiled, equal_positions, 0, history)))
+            # like {x.abbreviation: x.long_form for x in bib_file.get_strings()}, the last string wins
+            strings_by_abbreviation[entry.abbreviation] = (entry.long_form, history)
+    added_strings = []
+    for position, operation in enumerate(operations):
+        if operation[0] is not SHORTEN_STRING or position not in found:
+            continue
+        string = operation[2]
+        existing = strings_by_abbreviation.get(string.abbreviation)
+        if existing is None:
+            # added strings go in front of the other strings, so they only win if there is no other string
+            history = []
+            long_forms.append((string, _edit_long_form(string.long_form, compiled, equal_positions, position + 1,
+                                                       history)))
+            strings_by_abbreviation[string.abbreviation] = (string.long_form, history)
+            added_strings.append(string)
+        else:
+            existing_long_form = _long_form_at(existing[0], existing[1], position)
+            if string.long_form != existing_long_form and existing_long_form != string.abbreviation:
+                raise ValueError("Abbreviation is already in use with a different long form!")
+
+    for entry, field_type, data in changed_fields:
+        setattr(entry, field_type, data)
+    for string, long_form in long_forms:
+        string.long_form = long_form
+    for string in added_strings:
+        bib_file.content.insert(0, string)
+    return bib_file
+
+
 # JUST FOR TESTING
 if __name__ == "__main__":
     test_file = file_parser.parse_bib("../bib_files/biblatex-examples.bib")
@@ -1,128 +1,216 @@
-from copy import copy
-from objects import BibFile, Reference, String, Comment
-from utils import json_loader, file_parser, file_generator
-
-
-def _convert_symbols(reference: Reference):
-    special_latex_to_unicode = {
-        '{\\ss}': 'ß', '\\ss': 'ß',
-        '{\\o}': 'ø', '\\o': 'ø',
-        '{\\O}': 'Ø', '\\O': 'Ø',
-        '{\\ae}': 'æ', '\\ae': 'æ',
-        '{\\AE}': 'Æ', '\\AE': 'Æ',
-        '{\\l}': 'ł', '\\l': 'ł',
-        '{\\L}': 'Ł', '\\L': 'Ł'
-    }
-    latex_to_unicode = {
-        "\\`": ('\u0300', ['a', 'e', 'i', 'o', 'u']),  # Grave accent
-        "\\'": ('\u0301', ['a', 'e', 'i', 'o', 'u', 'y', 'c']),  # Acute accent
-        "\\^": ('\u0302', ['a', 'e', 'i', 'o', 'u']),  # Circumflex accent
-        "\\~": ('\u0303', ['a', 'n', 'o']),  # Tilde
-        "\\=": ('\u0304', ['a', 'e', 'i', 'o', 'u', 'p']),  # Macron
-        "\\u": ('\u0306', ['a', 'e', 'i', 'o', 'u']),  # Breve
-        "\\.": ('\u0307', ['o']),  # Dot above
-        '\\"': ('\u0308', ['a', 'e', 'i', 'o', 'u']),  # Diaeresis
-        "\\a": ('\u030A', ['a']), "\\r": ('\u030A', ['a']),  # Ring above
-        "\\H": ('\u030B', ['o', 'u']),  # Double acute accent
-        "\\v": ('\u030C', ['c', 'r', 's', 'z']),  # Caron
-        "\\c": ('\u0327', ['c', 's']),  # Cedilla
-        "\\k": ('\u030C', ['a', 'e', 'i', 'o', 'u']),  # Ogonek
-    }
-    for field_type, data in reference.get_fields().items():
-        if field_type == "comment_above_reference" or field_type == "entry_type" or field_type == "cite_key":
-            continue
-        for key, value in special_latex_to_unicode.items():
-            data = data.replace(key, value)
-        for latex_command, (combining_mark, letters) in latex_to_unicode.items():
-            capitalized = [x.capitalize() for x in letters]
-            for letter in letters + capitalized:
-                data = data.replace('{' + latex_command + '{\\' + letter + '}}', letter + combining_mark)
-                data = data.replace(latex_command + '{\\' + letter + '}', letter + combining_mark)
-                data = data.replace('{' + latex_command + '{' + letter + '}}', letter + combining_mark)
-                data = data.replace(latex_command + '{' + letter + '}', letter + combining_mark)
-                data = data.replace('{' + latex_command + '\\' + letter + '}', letter + combining_mark)
-                data = data.replace('{' + latex_command + letter + '}', letter + combining_mark)
-                data = data.replace('{' + latex_command + ' ' + letter + '}', letter + combining_mark)
-        setattr(reference, field_type, data)  # Actually update the field.
-
-
-def _clean_url_if_doi(reference: Reference) -> Reference:
-    fields = reference.get_fields()
-    url_field = fields.get("url")
-    doi_field = fields.get("doi")
-
+import functools
+import re
+import time
+
+from objects import BibFile, Reference, String, Comment, FieldValue, TokenType, is_valid_literal
+from utils import json_loader, file_parser, file_generator, fingerprints, parallel
+
+# LaTeX commands of special letters, written as {\ss} or \ss.
+SPECIAL_LATEX_TO_UNICODE = {
+    "ss": "ß", "o": "ø", "O": "Ø", "ae": "æ", "AE": "Æ", "oe": "œ", "OE": "Œ", "aa": "å", "AA": "Å",
+    "l": "ł", "L": "Ł", "dh": "ð", "DH": "Ð", "th": "þ", "TH": "Þ", "ng": "ŋ", "NG": "Ŋ", "dj": "đ", "DJ": "Đ",
+}
+# LaTeX accent commands with their combining mark and the letters they are converted on, the capitals of the
+# letters are converted too.
+LATEX_ACCENT_TO_UNICODE = {
+    "\\`": ("\u0300", "aeinouwy"),  # Grave accent
+    "\\'": ("\u0301", "acegiklmnoprsuwyz"),  # Acute accent
+    "\\^": ("\u0302", "aceghijosuwyz"),  # Circumflex accent
+    "\\~": ("\u0303", "aeinouvy"),  # Tilde
+    "\\=": ("\u0304", "aegiopuy"),  # Macron
+    "\\u": ("\u0306", "aegiou"),  # Breve
+    "\\.": ("\u0307", "cegoz"),  # Dot above
+    '\\"': ("\u0308", "aehiotuwxy"),  # Diaeresis
+    "\\a": ("\u030A", "a"), "\\r": ("\u030A", "auwy"),  # Ring above
+    "\\H": ("\u030B", "ou"),  # Double acute accent
+    "\\v": ("\u030C", "acdeghiklnorstuz"),  # Caron
+    "\\c": ("\u0327", "cegklnst"),  # Cedilla
+    "\\k": ("\u0328", "aeiou"),  # Ogonek
+    "\\d": ("\u0323", "aehiklmnorstuvwyz"),  # Dot below
+    "\\b": ("\u0331", "bdhklnrtz"),  # Macron below
+}
+
+
+class LatexTranslator(object):
+    """
+    Converts the LaTeX special letters and accents of SPECIAL_LATEX_TO_UNICODE and LATEX_ACCENT_TO_UNICODE to unicode
+    in one scan of a text. Every way an accent can be written ({\\'e}, \\'{e}, {\\'{e}}, \\'{\\i}, ...) is put in a
+    table once, and a single regular expression finds them.
+    """
+    def __init__(self, specials: dict, accents: dict):
+        self._table = {}
+        branches = []
+        names = sorted(specials, key=len, reverse=True)
+        for name in names:
+            self._table["{\\" + name + "}"] = specials[name]
+            self._table["\\" + name] = specials[name]
+        # A special letter without braces is not converted when it is the start of a longer command like \LaTeX.
+        branches.append(r"\{\\(?:" + "|".join(names) + r")\}")
+        branches.append(r"\\(?:" + "|".join(names) + r")(?![A-Za-z])")
+        for command, (combining_mark, letters) in accents.items():
+            letters += letters.upper()
+            # \o and \l are special letters, so \'{\o} is not the accent on o
+            escaped_letters = "".join(letter for letter in letters if letter not in specials)
+            for letter in letters:
+                for form in ("{" + command + "{" + letter + "}}", command + "{" + letter + "}",
+                             "{" + command + letter + "}", "{" + command + " " + letter + "}"):
+                    self._table[form] = letter + combining_mark
+            for letter in escaped_letters:
+                for form in ("{" + command + "{\\" + letter + "}}", command + "{\\" + letter + "}",
+                             "{" + command + "\\" + letter + "}"):
+                    self._table[form] = letter + combining_mark
+            command = re.escape(command)
+            letters = "[" + letters + "]"
+            escaped_letters = "[" + escaped_letters + "]"
+            branches.append(r"\{" + command + r"(?:\{(?:\\" + escaped_letters + "|" + letters + r")\}|\\"
+                            + escaped_letters + "| ?" + letters + r")\}")
+            branches.append(command + r"\{(?:\\" + escaped_letters + "|" + letters + r")\}")
+        self._regex = re.compile("|".join(branches))
+
+    def _replace(self, match) -> str:
+        return self._table[match.group()]
+
+    def translate(self, text: str) -> str:
+        """
+        Returns the text with its LaTeX special letters and accents converted.
+        """
+        if "\\" not in text:
+            return text
+        return self._regex.sub(self._replace, text)
+
+
+_latex_translator = None
+
+
+@functools.lru_cache(maxsize=65536)
+def convert_latex_to_unicode(text: str) -> str:
+    """
+    Converts the LaTeX special letters and accents in the text to unicode. Results are cached, because the same
+    values (like author names and journals) come back in many references.
+    """
+    global _latex_translator
+    if _latex_translator is None:
+        _latex_translator = LatexTranslator(SPECIAL_LATEX_TO_UNICODE, LATEX_ACCENT_TO_UNICODE)
+    return _latex_translator.translate(text)
+
+
+def _convert_symbols(reference: Reference, field_type: str, data: str) -> str:
+    return convert_latex_to_unicode(data)
+
+
+def _clean_url_if_doi(reference: Reference, fields: dict) -> dict:
     # Only delete when both fields exist.
-    if url_field and doi_field:
-        delattr(reference, "url")
-    return reference
+    if fields.get("url") and fields.get("doi"):
+        del fields["url"]
+    return fields
 
 
-def _remove_fields(reference: Reference, fields: [str]) -> Reference:
-    for field in fields:
-        if field in reference.get_fields():
-            delattr(reference, field)
-    return reference
+def _remove_fields(reference: Reference, fields: dict, unnecessary_fields: [str]) -> dict:
+    for field in unnecessary_fields:
+        fields.pop(field, None)
+    return fields
 
 
-def _remove_comments(bib_file: BibFile):
-    for entry in bib_file.content:
-        if isinstance(entry, Reference):
-            entry.comment_above_reference = ""
-        elif isinstance(entry, String):
-            entry.comment_above_string = ""
-        elif isinstance(entry, str):
-            bib_file.content.remove(entry)
+def _remove_comments(entry) -> bool:
+    # Returns whether the entry is kept, the comments above references and strings are emptied.
+    if isinstance(entry, Reference):
+        entry.comment_above_reference = ""
+    elif isinstance(entry, String):
+        entry.comment_above_string = ""
+    elif isinstance(entry, str):
+        return False
+    return True
 
 
-def _remove_comment_entries(bib_file: BibFile):
-    for entry in bib_file.content:
-        if isinstance(entry, Comment):
-            bib_file.content.remove(entry)
+def _remove_comment_entries(entry) -> bool:
+    return not isinstance(entry, Comment)
 
 
-def _lower_entry_type(reference: Reference):
-    reference.entry_type = reference.entry_type.lower()
+def _lower_entry_type(reference: Reference) -> bool:
+    entry_type = reference.entry_type.lower()
+    if entry_type == reference.entry_type:
+        return False
+    reference.entry_type = entry_type
+    return True
 
 
-def _lower_fields(reference: Reference):
-    for field_type, data in copy(reference).get_fields().items():
-        delattr(reference, field_type)
-        setattr(reference, field_type.lower(), data)
+def _lower_fields(reference: Reference, fields: dict) -> dict:
+    lowered = {}
+    for field_type, data in fields.items():
+        # a field that is already there is replaced at the end, like setting the attribute again would
+        lowered.pop(field_type.lower(), None)
+        lowered[field_type.lower()] = data
+    return lowered
 
 
-def _order_field_names(reference: Reference, field_order: list[str]) -> Reference:
+def _order_field_names(reference: Reference, fields: dict, config: json_loader.Config) -> dict:
     def order_key(item: (str, str)):
-        # Use order from field_order.
-        # If field is not in field_order return the len(field_order).
-        # This means that all other fields will have the same value, so the original order will be kept.
-        return field_order.index(item[0]) if item[0] in field_order else len(field_order)
-
-    fields = copy(reference).get_fields()
-    # Remove internal/meta fields from ordering context.
-    for k in ["comment_above_reference", "entry_type", "cite_key"]:
-        if k in fields:
-            fields.pop(k)
-    sorted_fields = sorted(fields.items(), key=order_key)
-
-    # Every field in sorted_fields will be removed and added in the sorted order.
-    for field_type, data in sorted_fields:
-        delattr(reference, field_type)
-        setattr(reference, field_type, data)
-    return reference
-
-
-def _change_field_enclosure(reference: Reference, start_enclosure: str, end_enclosure: str):
-    for field_type, data in reference.get_fields().items():
-        if field_type == "comment_above_reference" or field_type == "entry_type" or field_type == "cite_key":
-            continue
-        if ' # ' in data:
-            continue
-        new_data = remove_enclosure(data)
-        if new_data == data:
-            continue
-        if not new_data.isdigit():
-            new_data = start_enclosure + new_data + end_enclosure
-        setattr(reference, field_type, new_data)
+        # Use the position in the preferred field order.
+        # All other fields get the length of that order, so the original order of those will be kept.
+        return config.field_position(item[0])
+
+    return dict(sorted(fields.items(), key=order_key))
+
+
+def _parsed_value(reference: Reference, field_type: str, data: str) -> FieldValue:
+    # The parsed value cached on the reference, unless an earlier pass changed the value.
+    if getattr(reference, field_type, None) is data:
+        return reference.get_field_value(field_type)
+    return FieldValue.parse(data)
+
+
+def _change_field_enclosure(reference: Reference, field_type: str, data: str, enclosure: TokenType) -> str:
+    """
+    Changes the enclosure of a field value that is a single braced or quoted literal to the enclosure (BRACED or
+    QUOTED). Literals that are a number lose their enclosure, concatenations are kept as they are. A literal whose
+    text is itself enclosed, like {"https://..."} or {{Title}}, loses all its enclosures before it gets the new one,
+    so only braces inside the text (like in {Nested {deep}}) are kept.
+    :return: the new value of the field.
+    """
+    value = _parsed_value(reference, field_type, data)
+    if value.is_concatenation():
+        return data
+    (token_type, text), = value
+    if token_type is TokenType.RAW or _is_single_enclosure(text):
+        # not a valid value or an enclosure in an enclosure, so the best we can do is to guess the enclosure
+        return _replace_enclosures(data, enclosure)
+    elif token_type is TokenType.BRACED or token_type is TokenType.QUOTED:
+        if text.isdigit():
+            return text
+        elif token_type is not enclosure and is_valid_literal(enclosure, text):
+            return FieldValue(((enclosure, text),)).render()
+    return data
+
+
+def _is_single_enclosure(text: str) -> bool:
+    # Whether the text is one braced or quoted part, like {Title} or "https://...", and not like {A} and {B}.
+    if len(text) < 2:
+        return False
+    if text[0] == '"' and text[-1] == '"':
+        return '"' not in text[1:-1]
+    if text[0] != '{' or text[-1] != '}':
+        return False
+    braces_level = 0
+    for char in text[:-1]:
+        if char == '{':
+            braces_level += 1
+        elif char == '}':
+            braces_level -= 1
+            if braces_level == 0:
+                return False
+    return True
+
+
+def _replace_enclosures(data: str, enclosure: TokenType) -> str:
+    # Removes all enclosures around the value with remove_enclosure and adds the enclosure (BRACED or QUOTED).
+    if ' # ' in data:
+        return data
+    new_data = remove_enclosure(data)
+    if new_data == data:
+        return data
+    if not new_data.isdigit():
+        new_data = ("{" + new_data + "}" if enclosure is TokenType.BRACED else '"' + new_data + '"')
+    return new_data
 
 
 def remove_enclosure(field_value: str) -> str:
@@ -171,46 +259,213 @@ def remove_enclosure(field_value: str) -> str:
     return result
 
 
-def cleanup(bib_file: BibFile):
-    config = json_loader.load_config()
-
-    # Load values from config (or default values).
-    convert_special_symbols = config.get("convert_special_symbols_to_unicode", False)
-    prefer_doi_over_url = config.get("prefer_doi_over_url", False)
-    delete_comments = config.get("remove_comments", False)
-    delete_comment_entries = config.get("remove_comment_entries", False)
-    lowercase_entry_types = config.get("lowercase_entry_types", False)
-    lowercase_fields = config.get("lowercase_fields", False)
-    braces_enclosure = config.get("change_enclosures_to_braces", False)
-    quotation_marks_enclosure = config.get("change_enclosures_to_quotation_marks", False)
-
-    fields = config.get("unnecessary_fields", [])
-    field_order = config.get("preferred_field_order", [])
-
-    if delete_comments:
-        _remove_comments(bib_file)
-    if delete_comment_entries:
-        _remove_comment_entries(bib_file)
-
+# The kinds of cleanup passes, with the arguments of their functions:
+CONTENT_PASS = "content"  # (entry) -> whether the entry is kept in the file
+ENTRY_PASS = "entry"  # (reference) -> whether it changed the meta data of the reference
+FIELDS_PASS = "fields"  # (reference, fields dict) -> the new fields dict
+VALUE_PASS = "value"  # (reference, field type, value) -> the new value
+
+
+class CleanupPass(object):
+    """
+    A step of the cleanup: its name in the report, the Config option that turns it on (None: always on), its kind
+    and its function. Extra arguments are read from the Config by arguments(config).
+    """
+    def __init__(self, name: str, option: str | None, kind: str, function, arguments=lambda config: ()):
+        self.name = name
+        self.option = option
+        self.kind = kind
+        self.function = function
+        self.arguments = arguments
+
+    def is_enabled(self, config: json_loader.Config) -> bool:
+        return self.option is None or bool(getattr(config, self.option))
+
+
+# All passes of the cleanup in the order they are run.
+CLEANUP_PASSES = (
+    CleanupPass("remove comments", "remove_comments", CONTENT_PASS, _remove_comments),
+    CleanupPass("remove comment entries", "remove_comment_entries", CONTENT_PASS, _remove_comment_entries),
+    CleanupPass("lowercase entry types", "lowercase_entry_types", ENTRY_PASS, _lower_entry_type),
+    CleanupPass("lowercase fields", "lowercase_fields", FIELDS_PASS, _lower_fields),
+    CleanupPass("prefer doi over url", "prefer_doi_over_url", FIELDS_PASS, _clean_url_if_doi),
+    CleanupPass("convert special symbols", "convert_special_symbols_to_unicode", VALUE_PASS, _convert_symbols),
+    CleanupPass("change enclosures to braces", "change_enclosures_to_braces", VALUE_PASS, _change_field_enclosure,
+                lambda config: (TokenType.BRACED,)),
+    CleanupPass("change enclosures to quotation marks", "change_enclosures_to_quotation_marks", VALUE_PASS,
+                _change_field_enclosure, lambda config: (TokenType.QUOTED,)),
+    CleanupPass("remove unnecessary fields", None, FIELDS_PASS, _remove_fields,
+                lambda config: (config.unnecessary_fields,)),
+    CleanupPass("order fields", None, FIELDS_PASS, _order_field_names, lambda config: (config,)),
+)
+
+
+class CleanupReport(object):
+    """
+    The time spent in every pass of a cleanup and the number of entries, references or fields it changed.
+    """
+    def __init__(self):
+        self.passes = {}
+
+    def add(self, name: str, seconds: float, changed: int):
+        total_seconds, total_changed = self.passes.get(name, (0.0, 0))
+        self.passes[name] = (total_seconds + seconds, total_changed + changed)
+
+    def update(self, other: "CleanupReport"):
+        """
+        Adds the times and changes of the other report.
+        """
+        for name, (seconds, changed) in other.passes.items():
+            self.add(name, seconds, changed)
+
+    def __str__(self):
+        lines = [f"{'pass':<40} {'time':>10} {'changed':>8}"]
+        for name, (seconds, changed) in self.passes.items():
+            lines.append(f"{name:<40} {seconds * 1000:>7.1f} ms {changed:>8}")
+        return "\n".join(lines)
+
+
+def _compile_passes(config: json_loader.Config) -> list:
+    # The enabled passes as (pass, function with its arguments), consecutive value passes are grouped in a list,
+    # so they are run in one loop over the fields.
+    compiled = []
+    for cleanup_pass in CLEANUP_PASSES:
+        if not cleanup_pass.is_enabled(config):
+            continue
+        arguments = cleanup_pass.arguments(config)
+        step = (cleanup_pass, cleanup_pass.function, arguments)
+        if cleanup_pass.kind == VALUE_PASS:
+            if compiled and isinstance(compiled[-1], list):
+                compiled[-1].append(step)
+            else:
+                compiled.append([step])
+        else:
+            compiled.append(step)
+    return compiled
+
+
+def _clean_reference(reference: Reference, compiled: list, report: CleanupReport | None):
+    fields = None
+    for step in compiled:
+        if isinstance(step, list):
+            # the value passes, fused into one loop over the fields
+            items = fields.items() if fields is not None else reference.field_items()
+            new_fields = {}
+            for field_type, data in items:
+                for cleanup_pass, function, arguments in step:
+                    if report is None:
+                        data = function(reference, field_type, data, *arguments)
+                    else:
+                        start = time.perf_counter()
+                        new_data = function(reference, field_type, data, *arguments)
+                        report.add(cleanup_pass.name, time.perf_counter() - start, new_data != data)
+                        data = new_data
+                new_fields[field_type] = data
+            fields = new_fields
+            continue
+        cleanup_pass, function, arguments = step
+        start = time.perf_counter() if report is not None else 0.0
+        if cleanup_pass.kind == ENTRY_PASS:
+            changed = function(reference, *arguments)
+        else:
+            if fields is None:
+                fields = reference.get_fields()
+            old_fields = list(fields.items()) if report is not None else None
+            fields = function(reference, fields, *arguments)
+            changed = report is not None and list(fields.items()) != old_fields
+        if report is not None:
+            report.add(cleanup_pass.name, time.perf_counter() - start, changed)
+    if fields is not None:
+        # the only time the fields of the reference are rebuilt
+        reference.set_fields(fields)
+
+
+def _reference_steps(compiled: list) -> list:
+    return [step for step in compiled if isinstance(step, list) or step[0].kind != CONTENT_PASS]
+
+
+# The config and the compiled reference passes of the last _clean_reference_with_config call in this process.
+_compiled_config = None
+
+
+def _clean_reference_with_config(reference: Reference, config: json_loader.Config, with_report: bool):
+    # Cleans a reference in a worker process of the cleanup, returns its CleanupReport if with_report.
+    global _compiled_config
+    if _compiled_config is None or _compiled_config[0] is not config:
+        _compiled_config = (config, _reference_steps(_compile_passes(config)))
+    report = CleanupReport() if with_report else None
+    _clean_reference(reference, _compiled_config[1], report)
+    return report
+
+
+def _cleanup_settings(config: json_loader.Config) -> tuple:
+    # Everything the result of cleaning a reference depends on, for the fingerprints.
+    enabled = tuple(cleanup_pass.name for cleanup_pass in CLEANUP_PASSES if cleanup_pass.is_enabled(config))
+    return (enabled, config.unnecessary_fields, config.preferred_field_order, SPECIAL_LATEX_TO_UNICODE,
+            LATEX_ACCENT_TO_UNICODE)
+
+
+def cleanup(bib_file: BibFile, config: json_loader.Config = None, report: CleanupReport = None, workers=1):
+    """
+    Cleans the BibFile as set in the config. The enabled passes of CLEANUP_PASSES are run in one traversal of the
+    file, and the fields of a reference are only set once, after all passes.
+    References that an earlier cleanup with the same config left unchanged are skipped, see
+    fingerprints.EntryFingerprints.
+    :param bib_file: the BibFile to clean.
+    :param config: the json_loader.Config with the cleanup options. If None: json_loader.get_config().
+    :param report: a CleanupReport to add the time and number of changes of every pass to, or None.
+    :param workers: the number of processes the references are cleaned in, see parallel.transform_references.
+    :return: the cleaned BibFile.
+    """
+    if config is None:
+        config = json_loader.get_config()
+    if config.change_enclosures_to_braces and config.change_enclosures_to_quotation_marks:
+        raise ValueError("Config file has invalid enclosures set, set only one to true.")
+
+    compiled = _compile_passes(config)
+    content_steps = [step for step in compiled if not isinstance(step, list) and step[0].kind == CONTENT_PASS]
+
+    entry_fingerprints = fingerprints.get_fingerprints("cleanup", bib_file, _cleanup_settings(config), config)
+    content = []
+    references = []
     for entry in bib_file.content:
+        kept = True
+        for cleanup_pass, function, arguments in content_steps:
+            start = time.perf_counter() if report is not None else 0.0
+            kept = function(entry, *arguments)
+            if report is not None:
+                report.add(cleanup_pass.name, time.perf_counter() - start, not kept)
+            if not kept:
+                break
+        if not kept:
+            continue
         if isinstance(entry, Reference):
-            if lowercase_entry_types:
-                _lower_entry_type(entry)
-            if lowercase_fields:
-                _lower_fields(entry)
-            if prefer_doi_over_url:
-                _clean_url_if_doi(entry)
-            if braces_enclosure and quotation_marks_enclosure:
-                raise ValueError("Config file has invalid enclosures set, set only one to true.")
-            if convert_special_symbols:
-                _convert_symbols(entry)
-            if braces_enclosure:
-                _change_field_enclosure(entry, '{', '}')
-            if quotation_marks_enclosure:
-                _change_field_enclosure(entry, '"', '"')
-
-            _remove_fields(entry, fields)
-            _order_field_names(entry, field_order)
+            if entry_fingerprints is None or entry_fingerprints.get(entry) is None:
+                references.append(entry)
+            elif report is not None:
+                report.add("skipped (unchanged since the last cleanup)", 0.0, 1)
+        content.append(entry)
+
+    digests = [reference.content_digest() for reference in references] if entry_fingerprints is not None else None
+    if workers > 1:
+        reports = parallel.transform_references(references, _clean_reference_with_config,
+                                                (config, report is not None), workers)
+        if report is not None:
+            for reference_report in reports:
+                report.update(reference_report)
+    else:
+        reference_steps = _reference_steps(compiled)
+        for reference in references:
+            _clean_reference(reference, reference_steps, report)
+    if entry_fingerprints is not None:
+        for reference, digest in zip(references, digests):
+            if reference.content_digest() == digest:
+                entry_fingerprints.add(reference)
+
+    if len(content) != len(bib_file.content):
+        bib_file.content[:] = content
+    if entry_fingerprints is not None:
+        entry_fingerprints.save()
 
     return bib_file
 
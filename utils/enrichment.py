@@ -13,7 +13,7 @@ def sanitize_bib_file(bib_file: BibFile):
             lookup = None
             if type(entry) is Reference:
                 fields = entry.get_fields()
-                if fields['entry_type'] != 'set':
+                if entry.entry_type != 'set':
                     if 'author' in fields:
                         authors = _split_authors(fields['author'])
                         iterable = iter(authors)
@@ -27,7 +27,7 @@ def sanitize_bib_file(bib_file: BibFile):
                 if lookup:
                     for k, v in lookup.items():
                         if not k in fields:
-                            fields[k] = f"\"{v}\""
+                            setattr(entry, k, f"\"{v}\"")
         return bib_file
     else:
         print(f"\033[31m No internet connection found, please connect to the internet and try again! \033[0m")
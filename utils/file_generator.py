@@ -1,7 +1,28 @@
+import collections
+import concurrent.futures
+import hashlib
+import io
+import multiprocessing
+import os
+import shutil
+import threading
 from objects import BibFile, Reference, Comment, String, Preamble, Enclosure
 from utils import json_loader
 
 MAXIMUM_FIELD_LENGTH = 100
+WRITE_BUFFER_SIZE = 1024 * 1024
+PARALLEL_CHUNK_ENTRIES = 1000  # Number of entries per task when generating in parallel.
+HASH_BLOCK_SIZE = 1024 * 1024
+# How sure generate_bib makes that a saved file survives a crash of the system ("save_durability" in the config).
+DURABILITY_NONE = "none"  # The operating system writes the file to disk when it wants to.
+DURABILITY_FILE = "file"  # The new file is written to disk before it replaces the old one.
+DURABILITY_FULL = "full"  # The directory is written to disk as well, so the replacement itself is durable.
+DEFAULT_DURABILITY = DURABILITY_FILE
+
+# The entries that are rendered in parallel, only set inside the worker processes (see _share_entries). Forked worker
+# processes inherit them, so only the ranges of the chunks have to be sent to the workers instead of the pickled
+# entries.
+_shared_entries = None
 
 
 def _get_maximum_alignment(bib_file: BibFile) -> int:
@@ -15,9 +36,7 @@ def _get_maximum_alignment(bib_file: BibFile) -> int:
         if isinstance(entry, String):
             maximum = max(maximum, len(entry.abbreviation) + 9)  # len(@string{)=8 +1 for a space after the abbreviation
         elif isinstance(entry, Reference):
-            for field_type, data in entry.get_fields().items():
-                if field_type == "comment_above_reference" or field_type == "entry_type" or field_type == "cite_key":
-                    continue
+            for field_type, _ in entry.field_items():
                 maximum = max(maximum, len(field_type) + 3)  # two spaces before field_type, 1 space after
     return maximum
 
@@ -30,67 +49,329 @@ def _generate_field(field_type: str, data: str, align_fields_position: int, add_
     position_minus_length = align_fields_position - len(field_start)
     padding_size = position_minus_length if position_minus_length > 0 else 0
     field = field_start + " " * padding_size + "= " + data + ",\n"
-    if add_newlines:
-        counter = 0
-        last_word = ""
-        new_field = ""
-        for char in field:
-            if char == " ":
-                if counter >= MAXIMUM_FIELD_LENGTH:
-                    padding = " " * (align_fields_position + 1)
-                    new_field += "\n" + padding + last_word
-                    counter = len(padding + last_word)
-                else:
-                    new_field += last_word
-                last_word = ""
-            last_word += char
-            counter += 1
-        field = new_field + last_word
+    if add_newlines and len(field) > MAXIMUM_FIELD_LENGTH:
+        field = _wrap_field(field, align_fields_position)
     return field
 
 
-def generate_bib(bib_file: BibFile, file_path, align_fields_position=None, add_newlines_in_fields=None):
+def _wrap_field(field: str, align_fields_position: int) -> str:
+    """
+    Starts a new (aligned) line at the first space after every MAXIMUM_FIELD_LENGTH characters. The space stays at
+    the start of the new line, and newlines in the data do not count as the end of a line.
+    """
+    padding = "\n" + " " * (align_fields_position + 1)
+    words = field.split(" ")
+    parts = []
+    counter = 0  # The number of characters on the current line, including the space before the current word.
+    for index, word in enumerate(words[:-1]):
+        counter += len(word)
+        if index > 0:
+            word = " " + word
+        if counter >= MAXIMUM_FIELD_LENGTH:
+            parts.append(padding)
+            counter = len(padding) - 1 + len(word)
+        parts.append(word)
+        counter += 1  # The space after the word.
+    parts.append(words[-1] if len(words) == 1 else " " + words[-1])
+    return "".join(parts)
+
+
+def _generate_entry(entry, align_fields_position: int, add_newlines_in_fields: bool) -> str:
+    """
+    Generates the str of a single entry (or the remaining str at the end of a file).
+    """
+    entry_string = ""
+    match entry:
+        case Comment():
+            entry_string += "@comment{" + entry.comment + "}\n"
+        case Preamble():
+            entry_string += "@preamble{" + entry.preamble + "}\n"
+        case String():
+            if entry.comment_above_string != "":
+                entry_string += entry.comment_above_string + "\n"
+            string_start = "@string{" + entry.abbreviation
+            position_minus_length = align_fields_position - len(string_start)
+            padding_size = position_minus_length if position_minus_length > 0 else 0
+            if entry.enclosure == Enclosure.BRACES:
+                entry_string += string_start + " " * padding_size + "= {" + entry.long_form + "}}\n"
+            elif entry.enclosure == Enclosure.QUOTATION_MARKS:
+                entry_string += string_start + " " * padding_size + "= \"" + entry.long_form + "\"}\n"
+        case Reference():
+            if entry.comment_above_reference != "":
+                entry_string += "\n"
+            entry_string += entry.comment_above_reference + "\n@" + entry.entry_type + "{" + entry.cite_key + ",\n"
+            for field_type, data in entry.field_items():
+                entry_string += _generate_field(field_type, data, align_fields_position, add_newlines_in_fields)
+            entry_string += "}\n"
+        case _:
+            entry_string += entry
+    return entry_string
+
+
+def _read_unchanged_sources(bib_file: BibFile) -> dict:
+    """
+    Reads the source files of the entries that have a source span.
+    :return: a dict from SourceFile to its bytes, only contains the source files that did not change since parsing.
+    """
+    sources = {}
+    for entry in bib_file.content:
+        span = getattr(entry, "source_span", None)
+        if span is not None and span[0] not in sources:
+            sources[span[0]] = span[0].read_bytes()
+    return {source: data for source, data in sources.items() if data is not None}
+
+
+def _is_remaining_text(text: str, sources: dict, previous_span) -> bool:
+    """
+    Checks if the text is the (stripped) remaining text of the source file after the previous_span.
+    """
+    remaining = sources[previous_span[0]][previous_span[2]:]
+    return remaining.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n").strip() == text
+
+
+def _copy_ranges(content, sources: dict):
+    """
+    Yields (entry, (SourceFile, start, end)) for the entries that are copied from their unchanged source file, and
+    (entry, None) for the entries that have to be generated.
+    """
+    previous_span = None
+    for entry in content:
+        span = getattr(entry, "source_span", None)
+        if span is not None and span[0] in sources:
+            yield entry, (span[0], span[1], span[2])
+            previous_span = span
+        elif isinstance(entry, str) and previous_span is not None and _is_remaining_text(entry, sources, previous_span):
+            # The unchanged end of the source file.
+            yield entry, (previous_span[0], previous_span[2], len(sources[previous_span[0]]))
+            previous_span = None
+        else:
+            yield entry, None
+            previous_span = None
+
+
+def _render_entry(entry, align_fields_position: int, add_newlines_in_fields: bool, binary: bool):
+    data = _generate_entry(entry, align_fields_position, add_newlines_in_fields)
+    if binary:
+        if os.linesep != "\n":  # Same newlines as a file opened in text mode.
+            data = data.replace("\n", os.linesep)
+        data = data.encode("utf-8")
+    return data
+
+
+def _share_entries(entries):
+    """
+    Initializer of the forked worker processes of the parallel generator. The entries are passed to the process when
+    it is forked instead of pickled, and every pool gets its own, so concurrent calls (in threads) do not mix them up.
+    """
+    global _shared_entries
+    _shared_entries = entries
+
+
+def _render_chunk(entries, align_fields_position: int, add_newlines_in_fields: bool, binary: bool) -> list:
+    """
+    Renders a chunk of entries, runs inside the worker processes of the parallel generator.
+    :param entries: the list of entries, or a (start, end) range of the inherited _shared_entries.
+    """
+    if isinstance(entries, tuple):
+        entries = _shared_entries[entries[0]:entries[1]]
+    return [_render_entry(entry, align_fields_position, add_newlines_in_fields, binary) for entry in entries]
+
+
+def _render_parallel(entries: list, align_fields_position: int, add_newlines_in_fields: bool, binary: bool,
+                     workers: int):
+    """
+    Renders the entries in a process pool, in chunks of PARALLEL_CHUNK_ENTRIES, and yields them in order.
+    At most two chunks per worker are rendered ahead of the writer, so the memory use stays bounded.
+    """
+    forked = multiprocessing.get_start_method() == "fork"
+    initializer, initargs = (_share_entries, (entries,)) if forked else (None, ())
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs) as executor:
+        pending = collections.deque()
+        for start in range(0, len(entries), PARALLEL_CHUNK_ENTRIES):
+            end = start + PARALLEL_CHUNK_ENTRIES
+            chunk = (start, end) if forked else entries[start:end]
+            pending.append(executor.submit(_render_chunk, chunk, align_fields_position, add_newlines_in_fields,
+                                           binary))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _write_entries(bib_file: BibFile, write, binary: bool, sources: dict, align_fields_position,
+                   add_newlines_in_fields: bool, workers=1):
+    """
+    Generates the entries one by one and passes each to write, as bytes if binary and otherwise as str.
+    The entries with a source span in sources are copied from their source file instead of generated.
+    With more than one worker and at least two chunks of entries to generate, those are rendered in a process pool.
+    The alignment is then computed up front, so all workers use the same one.
+    """
+    rendered = None
+    if workers > 1:
+        generated = [entry for entry, copy_range in _copy_ranges(bib_file.content, sources) if copy_range is None]
+        if len(generated) >= 2 * PARALLEL_CHUNK_ENTRIES:
+            if align_fields_position is None:
+                align_fields_position = _get_maximum_alignment(bib_file)
+            rendered = _render_parallel(generated, align_fields_position, add_newlines_in_fields, binary, workers)
+    try:
+        for entry, copy_range in _copy_ranges(bib_file.content, sources):
+            if copy_range is not None:
+                source_file, start, end = copy_range
+                data = sources[source_file][start:end]
+                write(data if binary else data.decode("utf-8"))
+            elif rendered is not None:
+                write(next(rendered))
+            else:
+                if align_fields_position is None:  # Only needed once an entry is generated.
+                    align_fields_position = _get_maximum_alignment(bib_file)
+                write(_render_entry(entry, align_fields_position, add_newlines_in_fields, binary))
+    finally:
+        if rendered is not None:
+            rendered.close()
+
+
+def _resolve_options(add_newlines_in_fields, keep_unchanged_entries, config, durability=DEFAULT_DURABILITY):
+    if config is None and (add_newlines_in_fields is None or keep_unchanged_entries is None or durability is None):
+        config = json_loader.get_config()
+    if add_newlines_in_fields is None:
+        add_newlines_in_fields = config.remove_newlines_in_fields
+    if keep_unchanged_entries is None:
+        keep_unchanged_entries = config.keep_unchanged_entries
+    if durability is None:
+        durability = config.save_durability
+    if durability not in (DURABILITY_NONE, DURABILITY_FILE, DURABILITY_FULL):
+        raise ValueError(f"Unknown save durability '{durability}', use '{DURABILITY_NONE}', '{DURABILITY_FILE}' or "
+                         f"'{DURABILITY_FULL}'.")
+    return add_newlines_in_fields, keep_unchanged_entries, durability
+
+
+def _has_content(file_path, size: int, digest: str) -> bool:
+    """
+    Checks if the file exists with the given size and blake2b hash.
+    """
+    try:
+        if os.path.getsize(file_path) != size:
+            return False
+        file_digest = hashlib.blake2b()
+        with open(file_path, "rb") as file:
+            for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+                file_digest.update(block)
+    except OSError:
+        return False
+    return file_digest.hexdigest() == digest
+
+
+def _fsync_directory(directory):
+    if os.name == "nt":
+        return  # Directories can not be opened on Windows, the rename is written with the file system metadata.
+    directory_descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(directory_descriptor)
+    finally:
+        os.close(directory_descriptor)
+
+
+def write_bib(bib_file: BibFile, stream, align_fields_position=None, add_newlines_in_fields=None,
+              keep_unchanged_entries=None, workers=1, config=None):
+    """
+    Writes the BibFile object to a stream, one entry at a time, so only the current entry is kept in memory.
+    :param bib_file: the BibFile object.
+    :param stream: a binary stream or bytearray (gets UTF-8 with the newlines of the platform, like generate_bib) or
+    a text stream (the generated entries get plain newlines, the stream can translate them).
+    :param align_fields_position: the position to align the '=' at. If None: calculated based on entries.
+    :param add_newlines_in_fields: add newlines to fields if they are longer than MAXIMUM_FIELD_LENGTH characters.
+    :param keep_unchanged_entries: copy the original text of entries that did not change since they were parsed.
+    If None: taken from the config.
+    :param workers: the number of processes that render the entries, rendering in parallel only pays off for
+    large outputs (see testing/benchmark.py).
+    :param config: the json_loader.Config to take the options that are None from. If None: json_loader.get_config().
+    """
+    add_newlines_in_fields, keep_unchanged_entries, _ = _resolve_options(add_newlines_in_fields,
+                                                                         keep_unchanged_entries, config)
+    sources = _read_unchanged_sources(bib_file) if keep_unchanged_entries else {}
+    if isinstance(stream, bytearray):
+        write, binary = stream.extend, True
+    else:
+        write, binary = stream.write, not isinstance(stream, io.TextIOBase)
+    _write_entries(bib_file, write, binary, sources, align_fields_position, add_newlines_in_fields, workers)
+
+
+def render_bib_to_string(bib_file: BibFile, align_fields_position=None, add_newlines_in_fields=None,
+                         keep_unchanged_entries=None, workers=1, config=None) -> str:
+    """
+    Returns the text generate_bib would write for the BibFile object (with plain newlines), without touching disk
+    except for reading the unchanged entries. See write_bib for the parameters.
+    """
+    stream = io.StringIO()
+    write_bib(bib_file, stream, align_fields_position, add_newlines_in_fields, keep_unchanged_entries, workers,
+              config)
+    return stream.getvalue()
+
+
+def render_bib_to_bytes(bib_file: BibFile, align_fields_position=None, add_newlines_in_fields=None,
+                        keep_unchanged_entries=None, workers=1, config=None) -> bytes:
+    """
+    Returns the bytes generate_bib would write for the BibFile object, without touching disk except for reading the
+    unchanged entries. See write_bib for the parameters.
+    """
+    add_newlines_in_fields, keep_unchanged_entries, _ = _resolve_options(add_newlines_in_fields,
+                                                                         keep_unchanged_entries, config)
+    sources = _read_unchanged_sources(bib_file) if keep_unchanged_entries else {}
+    parts = []
+    _write_entries(bib_file, parts.append, True, sources, align_fields_position, add_newlines_in_fields, workers)
+    return b"".join(parts)
+
+
+def generate_bib(bib_file: BibFile, file_path, align_fields_position=None, add_newlines_in_fields=None,
+                 keep_unchanged_entries=None, workers=1, durability=None, config=None) -> bool:
     """
     Generates a bib file from the BibFile object at the file_path (overwrites if the path already exists).
+    The entries are written one at a time (see write_bib) to a temporary file next to the file_path, which then
+    atomically replaces the file, so a crash while saving never leaves a half written file behind. If the file
+    already has exactly the generated content it is left untouched, so its modification time (and its snapshot in
+    the parse cache) stays valid.
     :param bib_file: the BibFile object.
     :param file_path: the path to generate the file at.
     :param align_fields_position: the position to align the '=' at. If None: calculated based on entries.
     :param add_newlines_in_fields: add newlines to fields if they are longer than MAXIMUM_FIELD_LENGTH characters.
-    :return:
+    :param keep_unchanged_entries: copy the original bytes of entries that did not change since they were parsed,
+    instead of generating them again. If None: taken from the config.
+    :param workers: the number of processes that render the entries, see write_bib.
+    :param durability: DURABILITY_NONE, DURABILITY_FILE or DURABILITY_FULL. If None: taken from the config.
+    :param config: the json_loader.Config to take the options that are None from. If None: json_loader.get_config().
+    :return: True if the file was written, False if it already had the generated content.
     """
-    if align_fields_position is None:
-        align_fields_position = _get_maximum_alignment(bib_file)
-    if add_newlines_in_fields is None:
-        add_newlines_in_fields = json_loader.load_config().get("remove_newlines_in_fields", False)
-
-    with open(file_path, "w", encoding="utf-8") as file:
-        final_string = ""
-
-        for entry in bib_file.content:
-            match entry:
-                case Comment():
-                    final_string += "@comment{" + entry.comment + "}\n"
-                case Preamble():
-                    final_string += "@preamble{" + entry.preamble + "}\n"
-                case String():
-                    if entry.comment_above_string != "":
-                        final_string += entry.comment_above_string + "\n"
-                    string_start = "@string{" + entry.abbreviation
-                    position_minus_length = align_fields_position - len(string_start)
-                    padding_size = position_minus_length if position_minus_length > 0 else 0
-                    if entry.enclosure == Enclosure.BRACES:
-                        final_string += string_start + " " * padding_size + "= {" + entry.long_form + "}}\n"
-                    elif entry.enclosure == Enclosure.QUOTATION_MARKS:
-                        final_string += string_start + " " * padding_size + "= \"" + entry.long_form + "\"}\n"
-                case Reference():
-                    if entry.comment_above_reference != "":
-                        final_string += "\n"
-                    final_string += entry.comment_above_reference + "\n@" + entry.entry_type + "{" + entry.cite_key + ",\n"
-                    for field_type, data in entry.get_fields().items():
-                        if field_type == "comment_above_reference" or field_type == "entry_type" or field_type == "cite_key":
-                            continue
-                        final_string += _generate_field(field_type, data, align_fields_position, add_newlines_in_fields)
-                    final_string += "}\n"
-                case _:
-                    final_string += entry
-        file.write(final_string)
+    add_newlines_in_fields, keep_unchanged_entries, durability = _resolve_options(
+        add_newlines_in_fields, keep_unchanged_entries, config, durability)
+    file_path = os.path.realpath(file_path)  # Replace the target of a symbolic link, not the link.
+    # Read the unchanged entries before writing, since the file_path can be the source file itself.
+    sources = _read_unchanged_sources(bib_file) if keep_unchanged_entries else {}
+    temporary_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    file_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0),
+                              0o666)
+    try:
+        digest = hashlib.blake2b()
+        with open(file_descriptor, "wb", buffering=WRITE_BUFFER_SIZE) as file:
+            def write(data):
+                digest.update(data)
+                file.write(data)
+
+            _write_entries(bib_file, write, True, sources, align_fields_position, add_newlines_in_fields, workers)
+            file.flush()
+            if _has_content(file_path, file.tell(), digest.hexdigest()):
+                return False
+            if durability != DURABILITY_NONE:
+                os.fsync(file.fileno())
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, temporary_path)
+        os.replace(temporary_path, file_path)
+        temporary_path = None
+        if durability == DURABILITY_FULL:
+            _fsync_directory(os.path.dirname(file_path))
+        return True
+    finally:
+        if temporary_path is not None:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
@@ -1,6 +1,33 @@
+import codecs
+import concurrent.futures
+import hashlib
+import io
+import itertools
+import mmap
+import os
+import re
 from enum import Enum
 import utils.json_loader
-from objects import BibFile, Reference, String, Comment, Preamble, Enclosure
+from objects import BibFile, Reference, String, Comment, Preamble, Enclosure, SourceFile
+
+SCANNER_ENGINE = "scanner"
+STATE_MACHINE_ENGINE = "state_machine"
+DEFAULT_ENGINE = SCANNER_ENGINE
+STREAM_CHUNK_SIZE = 64 * 1024
+MMAP_THRESHOLD = 8 * 1024 * 1024  # Files of at least this size are memory mapped by the scanner engine.
+MMAP_RELEASE_SIZE = 16 * 1024 * 1024  # Scanned parts of a memory mapped file are given back in steps of this size.
+PARALLEL_CHUNK_SIZE = 1024 * 1024  # Minimum number of bytes per worker when parsing in parallel.
+
+# Structural delimiters the scanner jumps between, one pattern per parser state.
+_ENTRY_KEY_RE = re.compile(r'[,=]')
+_FIELD_KEY_RE = re.compile(r'[=}]')
+_VALUE_RE = re.compile(r'[{",}]')
+_COMMENT_VALUE_RE = re.compile(r'[{"}]')  # Commas do not end the value of a comment entry.
+_BRACES_RE = re.compile(r'[{}]')
+_QUOTATION_MARKS_RE = re.compile(r'[\\"]')
+_NEWLINE_RUN_RE = re.compile(r'\n[\n ]*')
+_LINE_END_RE = re.compile(rb'[ \t\r]*\n')  # The rest of the line after an entry, part of the source span of the entry.
+_CAN_RELEASE_PAGES = hasattr(mmap, "MADV_DONTNEED")
 
 
 class State(Enum):
@@ -13,6 +40,18 @@ class State(Enum):
     EXTRA = 7
 
 
+class _AmbiguousInput(Exception):
+    """
+    Raised by the scanner when the input needs the exact character by character handling of the state machine.
+    """
+
+
+class _IncompleteInput(_AmbiguousInput):
+    """
+    Raised by the scanner when the entry does not end before the end of the text read so far.
+    """
+
+
 def _parse_string(data):
     return data[1:-1]
 
@@ -28,139 +67,929 @@ def _add_field(fields, field_type, field_value):
     fields[field_type] = field_value
 
 
-def parse_bib(file_path, remove_newlines_in_fields=None) -> BibFile:
+def _iter_state_machine(lines, remove_newlines_in_fields, remove_whitespace=False, field_type=""):
     """
-    Parses the file at the file_path into a BibFile object.
+    Parses the lines character by character and yields the entries in order.
+    The final item is always the (stripped) text that remains after the last entry.
+    :param lines: an iterable of str, for example an open file.
+    :param remove_newlines_in_fields: replace newlines (and the whitespace after them) in field values by a space.
+    :param remove_whitespace: initial whitespace state, used when the scanner hands over halfway through a file.
+    :param field_type: the last field type of the entries before, used when the scanner hands over halfway through a
+    file. It is not reset between entries, so an entry without a field type of its own (like "@misc{key = value}")
+    gets it.
+    """
+    token = ""
+    comment = ""
+    entry_type = ""
+    key = ""
+    fields = {}
+    ignore_next = False
+    braces_level = 0
+    current_state = State.EXTRA
+    for line in lines:
+        for char in line:
+            if ignore_next:  # In case of escape sequences.
+                ignore_next = False
+                token += char
+                continue
+            match char:
+                case "@":
+                    if current_state == State.EXTRA:  # Start of a new entry
+                        comment = token.strip()
+                        token = ""
+                        current_state = State.ENTRY_TYPE
+                        continue
+                case "{":
+                    if current_state == State.ENTRY_TYPE:
+                        entry_type = token
+                        token = ""
+                        current_state = State.KEY  # For references and strings.
+                        if entry_type.lower() == "comment" or entry_type.lower() == "preamble":
+                            current_state = State.VALUE  # Preambles and comments don't have keys.
+                        continue
+                    elif current_state == State.VALUE:  # Start of an enclosure.
+                        current_state = State.BRACES_ENCLOSURE
+                        braces_level += 1
+                    elif current_state == State.BRACES_ENCLOSURE:  # Enclosure inside enclosure.
+                        braces_level += 1
+                case "=":
+                    if current_state == State.KEY:  # Start of the long_form inside a string.
+                        key = token.strip()
+                        token = ""
+                        current_state = State.VALUE
+                        continue
+                    elif current_state == State.FIELD_KEY:  # Start of the field_value
+                        field_type = token.strip()
+                        if " " and "\n" in field_type:
+                            unsupported_comment = field_type.split("\n")[0]
+                            raise ValueError(f"Parser does not support comments after field values: "
+                                             f"key: '{key}', comment: '{unsupported_comment}'")
+                        token = ""
+                        current_state = State.VALUE
+                        continue
+                case ",":
+                    if current_state == State.KEY:  # Start of fields inside reference.
+                        key = token.strip()
+                        token = ""
+                        current_state = State.FIELD_KEY
+                        continue
+                    elif current_state == State.VALUE and entry_type.lower() != "comment":  # End of the field value.
+                        _add_field(fields, field_type, token.strip())
+                        token = ""
+                        current_state = State.FIELD_KEY
+                        continue
+                case "\"":
+                    if current_state == State.VALUE:  # Start of enclosure.
+                        current_state = State.QUOTATION_MARKS_ENCLOSURE
+                    elif current_state == State.QUOTATION_MARKS_ENCLOSURE:  # End of enclosure.
+                        current_state = State.VALUE
+                case "\\":
+                    if current_state == State.QUOTATION_MARKS_ENCLOSURE:  # Escape sequence.
+                        ignore_next = True
+                case "\n":
+                    if current_state == State.VALUE or current_state == State.QUOTATION_MARKS_ENCLOSURE or current_state == State.BRACES_ENCLOSURE:
+                        if remove_newlines_in_fields:
+                            remove_whitespace = True
+                            continue
+                case " ":
+                    if remove_whitespace:
+                        continue
+                case "}":
+                    if current_state == State.FIELD_KEY or current_state == State.VALUE:  # End of reference.
+                        # Can also come at the state of VALUE because the last comma is optional.
+                        token = token.strip()
+                        if entry_type.lower() == "comment":
+                            if comment != "":
+                                raise ValueError(f"Parser does not support comments above comment entries: "
+                                                 f"comment entry: {token}, unsupported comment: {comment}")
+                            yield Comment(token)
+                        elif entry_type.lower() == "preamble":
+                            if comment != "":
+                                raise ValueError(f"Parser does not support comments above preamble entries: "
+                                                 f"preamble entry: {token}, unsupported comment: {comment}")
+                            yield Preamble(token)
+                        elif entry_type.lower() == "string":
+                            if token.startswith("{") and token.endswith("}"):
+                                enclosure = Enclosure.BRACES
+                            elif token.startswith("\"") and token.endswith("\""):
+                                enclosure = Enclosure.QUOTATION_MARKS
+                            else:
+                                raise ValueError(f"Bib file contains a string with invalid enclosure: {token}")
+                            yield String(comment, key, _parse_string(token), enclosure)
+                        else:
+                            reference = Reference(comment, entry_type, key)
+                            token = token.strip()
+                            if token != "":
+                                if current_state == State.VALUE:  # Since a comma in the last field is optional.
+                                    _add_field(fields, field_type, token)
+                                else:
+                                    raise ValueError(f"Parser does not support comments after final field value: "
+                                                     f"key: '{key}', comment: '{token}'")
+                            reference.set_fields(fields)
+                            yield reference
+                        token = ""
+                        current_state = State.EXTRA
+                        fields = {}
+                        comment = ""
+                        continue
+                    elif current_state == State.BRACES_ENCLOSURE:
+                        braces_level -= 1
+                        if braces_level == 0:
+                            current_state = State.VALUE
+            if remove_whitespace:
+                remove_whitespace = False
+                token += " "  # Add a single space to replace all the removed whitespace.
+            token += char
+    yield token.strip()
+
+
+class _TextSource:
+    """
+    Scanner input that is read as str, for example from a file opened in text mode.
+    """
+    at = "@"
+    open_brace = "{"
+    entry_key_re = _ENTRY_KEY_RE
+    field_key_re = _FIELD_KEY_RE
+    value_re = _VALUE_RE
+    comment_value_re = _COMMENT_VALUE_RE
+    braces_re = _BRACES_RE
+    quotation_marks_re = _QUOTATION_MARKS_RE
+    char = str  # Turns a matched delimiter into a str.
+    decode = str  # Turns a slice of the text into a str.
+
+    def __init__(self, read, chunk_size=-1):
+        """
+        :param read: a function like file.read that returns the next part of the text, or "" at the end.
+        :param chunk_size: the number of characters to read at once, -1 reads everything at once.
+        """
+        self.read = read
+        self.chunk_size = chunk_size
+
+    def remaining(self, text, position, end_of_file):
+        """
+        Returns the rest of the input from position as an iterable of str, used to hand over to the state machine.
+        """
+        remaining_chunks = iter(lambda: self.read(self.chunk_size), "") if not end_of_file else []
+        return itertools.chain([text[position:]], remaining_chunks)
+
+    def release(self, position):
+        """
+        Called when everything before position is scanned and will not be looked at again.
+        """
+
+
+def _decode_bytes(data):
+    """
+    Decodes a slice of utf-8 bytes with the same newline translation as a file opened in text mode.
+    """
+    text = data.decode("utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+class _MappedSource(_TextSource):
+    """
+    Scanner input that is a memory mapped file (or any other bytes-like object).
+    The scanner only looks for ascii delimiters, which never occur inside a multi-byte utf-8 character, so every slice
+    between two delimiters is valid utf-8 on its own and only the slices that become tokens are decoded.
+    """
+    at = b"@"
+    open_brace = b"{"
+    entry_key_re = re.compile(_ENTRY_KEY_RE.pattern.encode())
+    field_key_re = re.compile(_FIELD_KEY_RE.pattern.encode())
+    value_re = re.compile(_VALUE_RE.pattern.encode())
+    comment_value_re = re.compile(_COMMENT_VALUE_RE.pattern.encode())
+    braces_re = re.compile(_BRACES_RE.pattern.encode())
+    quotation_marks_re = re.compile(_QUOTATION_MARKS_RE.pattern.encode())
+    char = staticmethod(bytes.decode)
+    decode = staticmethod(_decode_bytes)
+
+    def __init__(self, data):
+        super().__init__(self._read_once)
+        self.data = data
+        self.is_read = False
+        self.released = 0
+
+    def _read_once(self, size):
+        if self.is_read:
+            return b""
+        self.is_read = True
+        return self.data
+
+    def remaining(self, text, position, end_of_file):
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(), translate=True)
+        for start in range(position, len(text), STREAM_CHUNK_SIZE):
+            yield decoder.decode(text[start:start + STREAM_CHUNK_SIZE])
+        yield decoder.decode(b"", final=True)
+
+    def release(self, position):
+        # Give the pages that are scanned back to the os, so the resident memory does not grow with the file size.
+        position -= position % mmap.PAGESIZE
+        if position - self.released >= MMAP_RELEASE_SIZE and _CAN_RELEASE_PAGES and isinstance(self.data, mmap.mmap):
+            self.data.madvise(mmap.MADV_DONTNEED, self.released, position - self.released)
+            self.released = position
+
+
+def _scan_value(text, position, value_re, source):
+    """
+    Finds the end of a field value that starts at position.
+    Enclosures are skipped as a whole, so only the delimiters outside of them are inspected.
+    :return: (index of the delimiter that ends the value, the delimiter).
+    """
+    while True:
+        match = value_re.search(text, position)
+        if match is None:
+            raise _IncompleteInput
+        char = source.char(match.group())
+        if char == "{":
+            braces_level = 1
+            position = match.end()
+            while braces_level:
+                match = source.braces_re.search(text, position)
+                if match is None:
+                    raise _IncompleteInput
+                braces_level += 1 if match.group() == source.open_brace else -1
+                position = match.end()
+        elif char == "\"":
+            position = match.end()
+            while True:
+                match = source.quotation_marks_re.search(text, position)
+                if match is None:
+                    raise _IncompleteInput
+                if source.char(match.group()) == "\\":  # Escape sequence, skip the next character.
+                    position = match.end() + 1
+                    continue
+                position = match.end()
+                break
+        else:
+            return match.start(), char
+
+
+def _clean_value(raw, remove_newlines_in_fields):
+    """
+    Turns the raw text of a field value into a token, just like the state machine does.
+    :return: (token, whether the state machine would still be skipping whitespace after the value, whether newlines
+    inside the value were removed).
+    """
+    stripped = raw.strip()
+    if not remove_newlines_in_fields:
+        return stripped, False, False
+    if "\\\n" in raw:
+        raise _AmbiguousInput  # Escaped newlines are kept by the state machine.
+    trailing_whitespace = raw[len(raw.rstrip(" \n")):]
+    token = _NEWLINE_RUN_RE.sub(" ", raw).strip()
+    return token, "\n" in trailing_whitespace, token != stripped
+
+
+def _scan_entry(text, position, remove_newlines_in_fields, remove_whitespace, source):
+    """
+    Scans a single entry (and the text above it) starting at position.
+    :return: (entry, position after the entry, whitespace state, whether newlines inside its values were removed,
+    the last field type of the entry or None if it has no fields) or None if there are no entries left.
+    """
+    decode = source.decode
+    at = text.find(source.at, position)
+    if at == -1:
+        return None
+    comment = decode(text[position:at])
+    # The state machine keeps skipping whitespace until it adds a character, which can be inside the entry type.
+    remove_whitespace = remove_whitespace and comment.strip(" ") == ""
+    comment = comment.strip()
+
+    brace = text.find(source.open_brace, at + 1)
+    if brace == -1:
+        raise _IncompleteInput
+    entry_type = decode(text[at + 1:brace])
+    if remove_whitespace:
+        if entry_type.lstrip(" ") == "":
+            raise _AmbiguousInput
+        entry_type = " " + entry_type.lstrip(" ")
+    lower_entry_type = entry_type.lower()
+
+    if lower_entry_type == "comment" or lower_entry_type == "preamble":
+        if comment != "":
+            raise _AmbiguousInput  # Unsupported, let the state machine raise the error.
+        value_re = source.comment_value_re if lower_entry_type == "comment" else source.value_re
+        end, delimiter = _scan_value(text, brace + 1, value_re, source)
+        if delimiter != "}":
+            raise _AmbiguousInput
+        token, remove_whitespace, changed = _clean_value(decode(text[brace + 1:end]), remove_newlines_in_fields)
+        entry = Comment(token) if lower_entry_type == "comment" else Preamble(token)
+        return entry, end + 1, remove_whitespace, changed, None
+
+    match = source.entry_key_re.search(text, brace + 1)
+    if match is None:
+        raise _IncompleteInput
+    key = decode(text[brace + 1:match.start()]).strip()
+    delimiter = source.char(match.group())
+
+    if lower_entry_type == "string":
+        if delimiter != "=":
+            raise _AmbiguousInput
+        end, delimiter = _scan_value(text, match.end(), source.value_re, source)
+        if delimiter != "}":
+            raise _AmbiguousInput
+        token, remove_whitespace, changed = _clean_value(decode(text[match.end():end]), remove_newlines_in_fields)
+        if token.startswith("{") and token.endswith("}"):
+            enclosure = Enclosure.BRACES
+        elif token.startswith("\"") and token.endswith("\""):
+            enclosure = Enclosure.QUOTATION_MARKS
+        else:
+            raise _AmbiguousInput
+        return String(comment, key, _parse_string(token), enclosure), end + 1, remove_whitespace, changed, None
+
+    if delimiter != ",":
+        raise _AmbiguousInput
+    fields = {}
+    position = match.end()
+    remove_whitespace = False
+    changed = False
+    field_type = None
+    while True:
+        match = source.field_key_re.search(text, position)
+        if match is None:
+            raise _IncompleteInput
+        if source.char(match.group()) == "}":
+            between = decode(text[position:match.start()])
+            if between.strip() != "":
+                raise _AmbiguousInput  # Unsupported comment after the final field value.
+            if between.strip(" ") != "":
+                remove_whitespace = False  # Newlines and tabs outside of values end the skipped whitespace.
+            end = match.start()
+            break
+        field_type = decode(text[position:match.start()]).strip()
+        if "\n" in field_type:
+            raise _AmbiguousInput  # Unsupported comment after a field value.
+        end, delimiter = _scan_value(text, match.end(), source.value_re, source)
+        token, remove_whitespace, changed_value = _clean_value(decode(text[match.end():end]), remove_newlines_in_fields)
+        changed = changed or changed_value
+        if delimiter == "}":
+            if token != "":
+                _add_field(fields, field_type, token)
+            break
+        _add_field(fields, field_type, token)
+        position = end + 1
+
+    reference = Reference(comment, entry_type, key)
+    reference.set_fields(fields)
+    return reference, end + 1, remove_whitespace, changed, field_type
+
+
+def _span_end(data, position):
+    """
+    Returns the end of the source span of an entry that ends at position: the rest of the line is included if it
+    only contains whitespace, so the next entry starts on its own line when copying the span.
+    """
+    match = _LINE_END_RE.match(data, position)
+    return match.end() if match else position
+
+
+def _span_digest(data, start, end):
+    return hashlib.blake2b(data[start:end], digest_size=8).digest()
+
+
+def _span(source_file, data, start, end, offset=0):
+    """
+    Returns the source span of the entry in data[start:end], where data starts at offset in the file. The digest of
+    the bytes of the span lets reparse_bib recognize the entry when the file changed somewhere else.
+    """
+    return source_file, offset + start, offset + end, _span_digest(data, start, end)
+
+
+def _source_file(file):
+    """
+    Returns the SourceFile of an open binary file.
+    """
+    stat = os.fstat(file.fileno())
+    return SourceFile(os.path.abspath(file.name), stat.st_size, stat.st_mtime_ns)
+
+
+def _scan_entries(source, remove_newlines_in_fields, source_file=None):
+    """
+    Scanner engine: jumps between the structural delimiters instead of visiting every character and slices the
+    tokens out of the text. Yields exactly the same entries as the state machine, and hands the rest of the text
+    over to the state machine as soon as the input is ambiguous (unterminated entries, unsupported comments, etc.).
+    The final item is always the (stripped) text that remains after the last entry.
+    :param source: a _TextSource or _MappedSource to read the text from.
+    :param remove_newlines_in_fields: replace newlines (and the whitespace after them) in field values by a space.
+    :param source_file: the SourceFile of the bytes of a _MappedSource, to set the source_span of the entries.
+    If None: the source spans are not set.
+    """
+    chunk_size = source.chunk_size
+    text = source.read(chunk_size)
+    end_of_file = chunk_size < 0 or not text
+    position = 0
+    span_start = 0
+    remove_whitespace = False
+    field_type = ""  # The state machine keeps the last field type of the entries before.
+    while True:
+        try:
+            scanned = _scan_entry(text, position, remove_newlines_in_fields, remove_whitespace, source)
+        except _IncompleteInput:
+            scanned = None
+        except (_AmbiguousInput, ValueError):
+            yield from _iter_state_machine(source.remaining(text, position, end_of_file),
+                                           remove_newlines_in_fields, remove_whitespace, field_type)
+            return
+        if scanned is None:
+            if end_of_file:
+                break
+            # Only keep the unfinished part and read at least as much again, so long entries stay linear.
+            more = source.read(max(chunk_size, len(text) - position))
+            end_of_file = not more
+            text = text[position:] + more
+            position = 0
+            continue
+        entry, position, remove_whitespace, changed, last_field_type = scanned
+        if last_field_type is not None:
+            field_type = last_field_type
+        if source_file is not None:
+            span_end = _span_end(text, position)
+            if not changed:
+                entry.source_span = _span(source_file, text, span_start, span_end)
+            span_start = span_end
+        source.release(position)
+        yield entry
+    if text.find(source.at, position) != -1:  # An unterminated entry at the end of the file.
+        yield from _iter_state_machine(source.remaining(text, position, True),
+                                       remove_newlines_in_fields, remove_whitespace, field_type)
+        return
+    yield source.decode(text[position:]).strip()
+
+
+def iter_bib(file, remove_newlines_in_fields=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Parses an open file (or buffer) lazily, yielding the Reference, String, Comment and Preamble objects one at a time.
+    Only the entry that is currently parsed is kept in memory, so the first results are available before the
+    whole file is read. The text after the last entry is yielded as a str if there is any, just like in the
+    content of parse_bib.
+    :param file: an open text file or buffer, binary files are decoded as utf-8.
+    :param remove_newlines_in_fields: replace newlines in field values by a space. If None: taken from the config.
+    :param chunk_size: the number of characters to read at once.
     """
     if remove_newlines_in_fields is None:
-        remove_newlines_in_fields = utils.json_loader.load_config().get("remove_newlines_in_fields", False)
-    result = BibFile(file_path)
+        remove_newlines_in_fields = utils.json_loader.get_config().remove_newlines_in_fields
+    if isinstance(file, (io.RawIOBase, io.BufferedIOBase)):
+        file = io.TextIOWrapper(file, encoding="utf-8")
+    for entry in _scan_entries(_TextSource(file.read, chunk_size), remove_newlines_in_fields):
+        if entry != "":
+            yield entry
+
+
+def _scan_mapped_file(file_path, remove_newlines_in_fields) -> list:
+    """
+    Runs the scanner engine over a memory mapped file, so the file is never read into a str as a whole.
+    """
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return [""]  # Empty files can not be mapped.
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            if hasattr(mmap, "MADV_SEQUENTIAL"):
+                mapping.madvise(mmap.MADV_SEQUENTIAL)
+            return list(_scan_entries(_MappedSource(mapping), remove_newlines_in_fields, _source_file(file)))
+
+
+def _scan_range(data, offset, remove_newlines_in_fields, source_file):
+    """
+    Scans the entries in data, the bytes of the file from offset on, which must start at the beginning of an entry
+    (or the file). The source spans of the entries are relative to the file, the first one starts at offset.
+    :return: (entries, position after the last entry, end of the span of the last entry, whitespace state) or raises
+    _AmbiguousInput (or ValueError) if the bytes do not end cleanly after an entry or need the state machine.
+    """
+    source = _MappedSource(data)
+    entries = []
+    position = 0
+    span_start = 0
+    remove_whitespace = False
+    while True:
+        scanned = _scan_entry(data, position, remove_newlines_in_fields, remove_whitespace, source)
+        if scanned is None:
+            return entries, position, span_start, remove_whitespace
+        entry, position, remove_whitespace, changed, _ = scanned
+        span_end = _span_end(data, position)
+        if not changed:
+            entry.source_span = _span(source_file, data, span_start, span_end, offset)
+        span_start = span_end
+        entries.append(entry)
+
+
+def _scan_chunk(file_path, start, end, remove_newlines_in_fields):
+    """
+    Scans the bytes between start and end of the file, which must start at the beginning of an entry (or the file).
+    Runs inside the worker processes of the parallel parser.
+    The source spans of the entries are relative to the file, but the first one starts at the start of the chunk.
+    :return: (entries, end of the span of the last entry in the file, stripped text after the last entry) or None if
+    the chunk does not end cleanly after an entry or needs the state machine, in which case the caller scans it again
+    together with the next chunk.
+    """
+    with open(file_path, "rb") as file:
+        source_file = _source_file(file)
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            data = mapping[start:end]
+    try:
+        entries, position, span_end, _ = _scan_range(data, start, remove_newlines_in_fields, source_file)
+    except (_AmbiguousInput, ValueError):
+        return None
+    return entries, start + span_end, _decode_bytes(data[position:]).strip()
 
-    with open(file_path, encoding='utf-8') as file:
-        token = ""
+
+def _find_chunk_boundaries(mapping, workers):
+    """
+    Splits the file in (at most) workers chunks of about equal size. Every chunk starts at an "@" at the beginning
+    of a line, the only place where top-level entries start in practice. Whether the "@" really is outside of any
+    braces or quotation marks is only known after the chunk before it is scanned.
+    :return: a list of (start, end) tuples.
+    """
+    size = len(mapping)
+    starts = [0]
+    for index in range(1, workers):
+        newline = mapping.find(b"\n@", max(size * index // workers, starts[-1]))
+        if newline == -1:
+            break
+        starts.append(newline + 1)
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def _join_chunk(entry, comment, span_start, mapping):
+    """
+    Gives the first entry of a chunk the comment that was scanned at the end of the chunk before it, and lets its
+    source span start at the end of the span of the last entry in the chunk before it.
+    :param mapping: the memory mapped file, to compute the digest of the longer span.
+    """
+    span = entry.source_span
+    if comment != "":
+        if type(entry) is Reference:
+            entry.comment_above_reference = comment
+        elif type(entry) is String:
+            entry.comment_above_string = comment
+        else:
+            raise _AmbiguousInput  # Unsupported comment above a comment or preamble entry, let the serial parser raise.
+    if span is not None:  # Entries whose values changed while parsing have no span.
+        entry.source_span = _span(span[0], mapping, span_start, span[2])
+
+
+def _scan_file_parallel(file_path, remove_newlines_in_fields, workers) -> list:
+    """
+    Parallel variant of _scan_mapped_file: the chunks of the file are scanned in a process pool and the entries are
+    stitched back together in their original order. A chunk is only accepted if the chunk before it ended cleanly
+    after an entry, otherwise both chunks are scanned again as one. Falls back to a serial parse of the whole file
+    if the input is ambiguous, so the result (and any error) is always the same as with serial parsing.
+    """
+    size = os.path.getsize(file_path)
+    workers = min(workers, size // PARALLEL_CHUNK_SIZE)
+    if workers <= 1:
+        return _scan_mapped_file(file_path, remove_newlines_in_fields)
+    with open(file_path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+            chunks = _find_chunk_boundaries(mapping, workers)
+            if len(chunks) == 1:
+                return _scan_mapped_file(file_path, remove_newlines_in_fields)
+            content = _scan_chunks_parallel(file_path, remove_newlines_in_fields, chunks, mapping)
+    if content is None:
+        return _scan_mapped_file(file_path, remove_newlines_in_fields)
+    return content
+
+
+def _scan_chunks_parallel(file_path, remove_newlines_in_fields, chunks, mapping):
+    """
+    Scans the chunks of the file in a process pool, see _scan_file_parallel.
+    :return: the content, or None if the file has to be parsed serially.
+    """
+    with concurrent.futures.ProcessPoolExecutor(len(chunks) - 1) as executor:
+        # The first chunk is scanned in this process while the workers scan the others.
+        futures = [None] + [executor.submit(_scan_chunk, file_path, start, end, remove_newlines_in_fields)
+                            for start, end in chunks[1:]]
+        content = []
         comment = ""
-        entry_type = ""
-        key = ""
-        field_type = ""
-        fields = {}
-        ignore_next = False
-        remove_whitespace = False
-        braces_level = 0
-        current_state = State.EXTRA
-        for line in file:
-            for char in line:
-                if ignore_next:  # In case of escape sequences.
-                    ignore_next = False
-                    token += char
+        span_end = 0
+        unfinished_start = None  # Start of the chunk that did not end cleanly.
+        try:
+            for (start, end), future in zip(chunks, futures):
+                if unfinished_start is None and future is not None:
+                    scanned = future.result()
+                else:
+                    if future is not None:
+                        future.cancel()
+                    if unfinished_start is not None:
+                        start = unfinished_start
+                    scanned = _scan_chunk(file_path, start, end, remove_newlines_in_fields)
+                if scanned is None:
+                    if unfinished_start is None:
+                        unfinished_start = start
                     continue
-                match char:
-                    case "@":
-                        if current_state == State.EXTRA:  # Start of a new entry
-                            comment = token.strip()
-                            token = ""
-                            current_state = State.ENTRY_TYPE
-                            continue
-                    case "{":
-                        if current_state == State.ENTRY_TYPE:
-                            entry_type = token
-                            token = ""
-                            current_state = State.KEY  # For references and strings.
-                            if entry_type.lower() == "comment" or entry_type.lower() == "preamble":
-                                current_state = State.VALUE  # Preambles and comments don't have keys.
-                            continue
-                        elif current_state == State.VALUE:  # Start of an enclosure.
-                            current_state = State.BRACES_ENCLOSURE
-                            braces_level += 1
-                        elif current_state == State.BRACES_ENCLOSURE:  # Enclosure inside enclosure.
-                            braces_level += 1
-                    case "=":
-                        if current_state == State.KEY:  # Start of the long_form inside a string.
-                            key = token.strip()
-                            token = ""
-                            current_state = State.VALUE
-                            continue
-                        elif current_state == State.FIELD_KEY:  # Start of the field_value
-                            field_type = token.strip()
-                            if " " and "\n" in field_type:
-                                unsupported_comment = field_type.split("\n")[0]
-                                raise ValueError(f"Parser does not support comments after field values: "
-                                                 f"key: '{key}', comment: '{unsupported_comment}'")
-                            token = ""
-                            current_state = State.VALUE
-                            continue
-                    case ",":
-                        if current_state == State.KEY:  # Start of fields inside reference.
-                            key = token.strip()
-                            token = ""
-                            current_state = State.FIELD_KEY
-                            continue
-                        elif current_state == State.VALUE and entry_type.lower() != "comment":  # End of the field value.
-                            _add_field(fields, field_type, token.strip())
-                            token = ""
-                            current_state = State.FIELD_KEY
-                            continue
-                    case "\"":
-                        if current_state == State.VALUE:  # Start of enclosure.
-                            current_state = State.QUOTATION_MARKS_ENCLOSURE
-                        elif current_state == State.QUOTATION_MARKS_ENCLOSURE:  # End of enclosure.
-                            current_state = State.VALUE
-                    case "\\":
-                        if current_state == State.QUOTATION_MARKS_ENCLOSURE:  # Escape sequence.
-                            ignore_next = True
-                    case "\n":
-                        if current_state == State.VALUE or current_state == State.QUOTATION_MARKS_ENCLOSURE or current_state == State.BRACES_ENCLOSURE:
-                            if remove_newlines_in_fields:
-                                remove_whitespace = True
-                                continue
-                    case " ":
-                        if remove_whitespace:
-                            continue
-                    case "}":
-                        if current_state == State.FIELD_KEY or current_state == State.VALUE:  # End of reference.
-                            # Can also come at the state of VALUE because the last comma is optional.
-                            token = token.strip()
-                            if entry_type.lower() == "comment":
-                                result.content.append(Comment(token))
-                                if comment != "":
-                                    raise ValueError(f"Parser does not support comments above comment entries: "
-                                                     f"comment entry: {token}, unsupported comment: {comment}")
-                            elif entry_type.lower() == "preamble":
-                                result.content.append(Preamble(token))
-                                if comment != "":
-                                    raise ValueError(f"Parser does not support comments above preamble entries: "
-                                                     f"preamble entry: {token}, unsupported comment: {comment}")
-                            elif entry_type.lower() == "string":
-                                if token.startswith("{") and token.endswith("}"):
-                                    enclosure = Enclosure.BRACES
-                                elif token.startswith("\"") and token.endswith("\""):
-                                    enclosure = Enclosure.QUOTATION_MARKS
-                                else:
-                                    raise ValueError(f"Bib file contains a string with invalid enclosure: {token}")
-                                result.content.append(String(comment, key, _parse_string(token), enclosure))
-                            else:
-                                reference = Reference(comment, entry_type, key)
-                                token = token.strip()
-                                if token != "":
-                                    if current_state == State.VALUE:  # Since a comma in the last field is optional.
-                                        _add_field(fields, field_type, token)
-                                    else:
-                                        raise ValueError(f"Parser does not support comments after final field value: "
-                                                         f"key: '{key}', comment: '{token}'")
-                                for field, field_value in fields.items():
-                                    setattr(reference, field, field_value)
-                                result.content.append(reference)
-                            token = ""
-                            current_state = State.EXTRA
-                            fields = {}
-                            comment = ""
-                            continue
-                        elif current_state == State.BRACES_ENCLOSURE:
-                            braces_level -= 1
-                            if braces_level == 0:
-                                current_state = State.VALUE
-                if remove_whitespace:
-                    remove_whitespace = False
-                    token += " "  # Add a single space to replace all the removed whitespace.
-                token += char
-    result.content.append(token.strip())
+                unfinished_start = None
+                entries, chunk_span_end, tail = scanned
+                if entries:
+                    _join_chunk(entries[0], comment, span_end, mapping)
+                    comment = tail
+                    span_end = chunk_span_end
+                elif tail != "":
+                    raise _AmbiguousInput  # Only the first chunk can be without entries.
+                content.extend(entries)
+        except _AmbiguousInput:
+            unfinished_start = 0
+        if unfinished_start is not None:
+            executor.shutdown(cancel_futures=True)
+            return None
+    content.append(comment)
+    return content
+
+
+def parse_bib(file_path, remove_newlines_in_fields=None, engine=None, use_mmap=None, workers=1,
+              config=None) -> BibFile:
+    """
+    Parses the file at the file_path into a BibFile object.
+    :param file_path: the path of the file to parse.
+    :param remove_newlines_in_fields: replace newlines in field values by a space. If None: taken from the config.
+    :param engine: SCANNER_ENGINE or STATE_MACHINE_ENGINE. If None: taken from the config ("parser_engine").
+    The scanner engine sets the source_span of the entries (see objects.Entry), so unchanged entries can be copied
+    from the file when generating it again. Entries whose values lost newlines (remove_newlines_in_fields) do not get
+    a source span, their bytes in the file differ from their values.
+    :param use_mmap: let the scanner engine work on a memory mapped file instead of reading the file into memory.
+    If None: only files of at least MMAP_THRESHOLD bytes are memory mapped.
+    :param workers: the number of processes the scanner engine splits the file over, the file is always parsed in
+    a single process if it is smaller than twice PARALLEL_CHUNK_SIZE.
+    :param config: the json_loader.Config to take the options that are None from. If None: json_loader.get_config().
+    """
+    remove_newlines_in_fields, engine = _resolve_options(remove_newlines_in_fields, engine, config)
+    result = BibFile(file_path)
+
+    if engine == SCANNER_ENGINE:
+        if use_mmap is None:
+            use_mmap = os.path.getsize(file_path) >= MMAP_THRESHOLD
+        if workers > 1:
+            result.content.extend(_scan_file_parallel(file_path, remove_newlines_in_fields, workers))
+        elif use_mmap:
+            result.content.extend(_scan_mapped_file(file_path, remove_newlines_in_fields))
+        else:
+            with open(file_path, "rb") as file:
+                source_file = _source_file(file)
+                result.content.extend(_scan_entries(_MappedSource(file.read()), remove_newlines_in_fields, source_file))
+    elif engine == STATE_MACHINE_ENGINE:
+        with open(file_path, encoding='utf-8') as file:
+            result.content.extend(_iter_state_machine(file, remove_newlines_in_fields))
+    else:
+        raise _unknown_engine(engine)
     return result
+
+
+def _resolve_options(remove_newlines_in_fields, engine, config):
+    if remove_newlines_in_fields is None or engine is None:
+        if config is None:
+            config = utils.json_loader.get_config()
+        if remove_newlines_in_fields is None:
+            remove_newlines_in_fields = config.remove_newlines_in_fields
+        if engine is None:
+            engine = config.parser_engine
+    return remove_newlines_in_fields, engine
+
+
+def _unknown_engine(engine) -> ValueError:
+    return ValueError(f"Unknown parser engine '{engine}', use '{SCANNER_ENGINE}' or '{STATE_MACHINE_ENGINE}'.")
+
+
+def parse_bib_string(text: str, remove_newlines_in_fields=None, engine=None, file_path="", config=None) -> BibFile:
+    """
+    Parses bib text that is already in memory into a BibFile object, with the same result as parse_bib of a file
+    with that text. The entries have no source span, since they do not come from a file.
+    :param text: the text to parse, newlines are translated like in a file opened in text mode.
+    :param remove_newlines_in_fields: replace newlines in field values by a space. If None: taken from the config.
+    :param engine: SCANNER_ENGINE or STATE_MACHINE_ENGINE. If None: taken from the config ("parser_engine").
+    :param file_path: the file_path of the BibFile object, for example the path it will be generated at.
+    :param config: the json_loader.Config to take the options that are None from. If None: json_loader.get_config().
+    """
+    remove_newlines_in_fields, engine = _resolve_options(remove_newlines_in_fields, engine, config)
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    result = BibFile(file_path)
+    if engine == SCANNER_ENGINE:
+        result.content.extend(_scan_entries(_TextSource(io.StringIO(text).read), remove_newlines_in_fields))
+    elif engine == STATE_MACHINE_ENGINE:
+        result.content.extend(_iter_state_machine(io.StringIO(text), remove_newlines_in_fields))
+    else:
+        raise _unknown_engine(engine)
+    return result
+
+
+def parse_bib_bytes(data, remove_newlines_in_fields=None, engine=None, file_path="", config=None) -> BibFile:
+    """
+    Parses the utf-8 bytes of a bib file that are already in memory into a BibFile object, with the same result as
+    parse_bib of a file with those bytes. The entries have no source span, since they do not come from a file.
+    :param data: bytes, or any other bytes-like object like a bytearray or memoryview (which is copied to bytes).
+    :param remove_newlines_in_fields: replace newlines in field values by a space. If None: taken from the config.
+    :param engine: SCANNER_ENGINE or STATE_MACHINE_ENGINE. If None: taken from the config ("parser_engine").
+    :param file_path: the file_path of the BibFile object, for example the path it will be generated at.
+    :param config: the json_loader.Config to take the options that are None from. If None: json_loader.get_config().
+    """
+    remove_newlines_in_fields, engine = _resolve_options(remove_newlines_in_fields, engine, config)
+    if not isinstance(data, bytes):
+        data = bytes(data)
+    result = BibFile(file_path)
+    if engine == SCANNER_ENGINE:
+        result.content.extend(_scan_entries(_MappedSource(data), remove_newlines_in_fields))
+    elif engine == STATE_MACHINE_ENGINE:
+        text = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8")
+        result.content.extend(_iter_state_machine(text, remove_newlines_in_fields))
+    else:
+        raise _unknown_engine(engine)
+    return result
+
+
+class Changes(object):
+    """
+    The cite keys of the references that were added, removed and modified when a file was parsed again.
+    """
+    def __init__(self):
+        self.added = []
+        self.removed = []
+        self.modified = []
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+    def __str__(self):
+        return f"[added: {self.added} - removed: {self.removed} - modified: {self.modified}]"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def _depends_on_previous(data, start):
+    """
+    With remove_newlines_in_fields, the whitespace state of the entry before an entry is only reset by a character
+    other than a space in between. Returns whether the span starting at start has no such character before its "@",
+    so the entry can not be parsed on its own.
+    """
+    at = data.find(b"@", start)
+    return at == -1 or data[start:at].strip(b" ") == b""
+
+
+def _decode_tail(data, position):
+    """
+    Returns the stripped text after the last entry, or None if it is not valid utf-8.
+    """
+    try:
+        return _decode_bytes(data[position:]).strip()
+    except ValueError:
+        return None
+
+
+def _reuse_references(old_entries, new_entries, changes):
+    """
+    Replaces the new references that did not change by the old Reference objects (with the new source span), and
+    records the cite keys that were added, removed or modified.
+    """
+    old_references = {entry.cite_key: entry for entry in old_entries if type(entry) is Reference}
+    new_keys = set()
+    for index, entry in enumerate(new_entries):
+        if type(entry) is not Reference:
+            continue
+        old = old_references.get(entry.cite_key)
+        if old is not None and old == entry:
+            old.source_span = entry.source_span
+            new_entries[index] = old
+            del old_references[entry.cite_key]
+        elif entry.cite_key in new_keys:
+            pass  # Duplicate cite keys are only reported once.
+        elif old is None:
+            changes.added.append(entry.cite_key)
+        else:
+            changes.modified.append(entry.cite_key)
+        new_keys.add(entry.cite_key)
+    changes.removed.extend(key for key in old_references if key not in new_keys)
+
+
+def reparse_bib(previous: BibFile, remove_newlines_in_fields=None):
+    """
+    Parses the file of a BibFile object again after the file changed, by only scanning the bytes that changed.
+    The entries at the start and the end of the file whose bytes did not change are reused, found by the digests
+    in their source spans (see parse_bib). Everything else is parsed again, or the whole file if the changed part
+    can not be parsed on its own, so the content is always the same as a full parse_bib of the file would give.
+    Unchanged Reference objects are kept, so code holding on to them (indexes, the GUI) can update in place.
+    :param previous: a BibFile parsed with the scanner engine from an earlier version of the file. Its unchanged
+    entries are moved to the result (with new source spans), so it should not be used afterwards.
+    :param remove_newlines_in_fields: replace newlines in field values by a space. If None: taken from the config.
+    This must be the same value the previous version was parsed with.
+    :return: (new BibFile, Changes)
+    """
+    if remove_newlines_in_fields is None:
+        remove_newlines_in_fields = utils.json_loader.get_config().remove_newlines_in_fields
+    file_path = previous.file_path
+    changes = Changes()
+    with open(file_path, "rb") as file:
+        source_file = _source_file(file)
+        data = file.read()
+
+    old_entries = list(previous.content)
+    tail = old_entries.pop() if old_entries and isinstance(old_entries[-1], str) else None
+    old_source = next((entry.source_span[0] for entry in old_entries
+                       if getattr(entry, "source_span", None) is not None), None)
+    scanned = None
+    if tail is not None and old_source is not None and old_source.file_path == source_file.file_path:
+        scanned = _reparse_changed_range(old_entries, tail, old_source, data, source_file, remove_newlines_in_fields)
+    if scanned is None:
+        result = parse_bib(file_path, remove_newlines_in_fields, engine=SCANNER_ENGINE)
+        _reuse_references(old_entries, result.content, changes)
+        return result, changes
+
+    prefix, middle, suffix, new_middle = scanned
+    _reuse_references(middle, new_middle, changes)
+    result = BibFile(file_path)
+    result.content = prefix + new_middle + suffix
+    return result, changes
+
+
+def _reparse_changed_range(old_entries, tail, old_source, data, source_file, remove_newlines_in_fields):
+    """
+    Does the work of reparse_bib: finds the unchanged entries at the start (the prefix) and the end (the suffix) of
+    the file and scans the bytes in between.
+    :return: (prefix, old entries in between, suffix and the tail, new entries in between) or None if the whole file
+    has to be parsed again.
+    """
+    rn = remove_newlines_in_fields
+    spans = [getattr(entry, "source_span", None) for entry in old_entries]
+
+    # The unchanged entries at the start of the file, their spans must still start at the same offsets.
+    prefix = 0
+    start = 0
+    for span in spans:
+        if (span is None or span[0] != old_source or span[1] != start or span[2] > len(data)
+                or _span_digest(data, span[1], span[2]) != span[3]):
+            break
+        prefix += 1
+        start = span[2]
+    # The span of an entry only ends for sure if it ends with a newline, otherwise the rest of the line decides.
+    while prefix > 0 and data[start - 1:start] != b"\n":
+        prefix -= 1
+        start = spans[prefix][1]
+
+    # The unchanged entries at the end of the file, shifted by the difference in size. The text after the last
+    # entry must be the same as well, and not contain an unterminated entry.
+    delta = len(data) - old_source.size
+    suffix = len(old_entries)
+    end = len(data)
+    if spans and spans[-1] is not None and spans[-1][0] == old_source:
+        tail_start = spans[-1][2] + delta
+        if (tail_start >= start and data[tail_start - 1:tail_start] == b"\n" and data.find(b"@", tail_start) == -1
+                and _decode_tail(data, tail_start) == tail):
+            end = tail_start
+            while suffix > prefix:
+                span = spans[suffix - 1]
+                if (span is None or span[0] != old_source or span[2] + delta != end or span[1] + delta < start
+                        or _span_digest(data, span[1] + delta, span[2] + delta) != span[3]
+                        or data[span[1] + delta - 1:span[1] + delta] != b"\n"
+                        or rn and _depends_on_previous(data, span[1] + delta)):
+                    break
+                suffix -= 1
+                end = span[1] + delta
+    if end == len(data):
+        suffix = len(old_entries)  # Without the tail, the text after the last entry is scanned again.
+
+    # The first entry after the prefix is parsed with a fresh whitespace state, which is only right if something
+    # other than a space comes before it.
+    while rn and prefix > 0 and _depends_on_previous(data, start):
+        prefix -= 1
+        start = spans[prefix][1]
+
+    extend = 1
+    while True:
+        try:
+            new_middle, position, span_end, _ = _scan_range(data[start:end], start, rn, source_file)
+            if end == len(data) or data[start + position:end].strip() == b"":
+                break
+        except _IncompleteInput:
+            if end == len(data):
+                return None
+        except (_AmbiguousInput, ValueError):
+            return None  # A full parse hands the rest of the file over to the state machine here.
+        # The changed bytes do not end cleanly before the suffix, take entries of the suffix along, twice as many
+        # every time so an unterminated entry does not make this quadratic.
+        if suffix < len(old_entries):
+            suffix = min(suffix + extend, len(old_entries))
+            end = spans[suffix - 1][2] + delta
+            extend *= 2
+        else:
+            end = len(data)
+    if end == len(data):
+        tail = _decode_tail(data, start + position)
+        if tail is None:
+            return None
+
+    result_prefix = old_entries[:prefix]
+    for entry in result_prefix:
+        span = entry.source_span
+        entry.source_span = (source_file, span[1], span[2], span[3])
+    result_suffix = old_entries[suffix:]
+    span_start = start + span_end
+    for entry in result_suffix:
+        span = entry.source_span
+        span_end = span[2] + delta
+        if span_start == span[1] + delta:
+            entry.source_span = (source_file, span_start, span_end, span[3])
+        else:  # The whitespace after the changed bytes belongs to the first entry of the suffix.
+            entry.source_span = (source_file, span_start, span_end, _span_digest(data, span_start, span_end))
+        span_start = span_end
+    result_suffix.append(tail)
+    return result_prefix, old_entries[prefix:suffix], result_suffix, new_middle
@@ -1,4 +1,17 @@
-from objects import BibFile
+from objects import BibFile, Reference
+from utils import tagging
+
+REFERENCE_META_DATA = ("comment_above_reference", "entry_type", "cite_key")
+
+
+def _fields_with_meta_data(ref: Reference) -> dict:
+    """
+    The fields of the reference with its meta data (the comment above it, entry type and cite key), which get_fields
+    does not return, so they can be filtered and searched like fields.
+    """
+    fields = {name: getattr(ref, name) or "" for name in REFERENCE_META_DATA}
+    fields.update(ref.get_fields())
+    return fields
 
 
 def filterByFieldExistence(bibFile: BibFile, field):
@@ -6,7 +19,7 @@ def filterByFieldExistence(bibFile: BibFile, field):
     returns a file with all the references with a certain field
     """
 
-    relevant = [ref for ref in bibFile.get_references() if field in ref.get_fields().keys()]
+    relevant = [ref for ref in bibFile.get_references() if field in _fields_with_meta_data(ref).keys()]
     if not relevant:
         raise Exception(f"No references found with a field named '{field}'")
 
@@ -20,7 +33,8 @@ def filterByFieldValue(bibFile: BibFile, field, value):
     value = value.lower()
     relevant = []
     for ref in bibFile.get_references():
-            if field in ref.get_fields().keys() and value in str.lower(ref.get_fields().get(field)):
+            fields = _fields_with_meta_data(ref)
+            if field in fields.keys() and value in str.lower(fields.get(field)):
                       relevant.append(ref)
     
     if not relevant:
@@ -29,25 +43,56 @@ def filterByFieldValue(bibFile: BibFile, field, value):
     return relevant
 
 
+def filterByTagQuery(bibFile: BibFile, query):
+    """
+    returns all the references with tags that match the tag query, like 'ML AND (survey OR benchmark) AND NOT retracted'
+    """
+    references = bibFile.get_references()
+    relevant_cite_keys = tagging.get_tag_store().query(query, [ref.cite_key for ref in references])
+    relevant = [ref for ref in references if ref.cite_key in relevant_cite_keys]
+    if not relevant:
+        raise Exception(f"No references found with tags matching '{query}'")
+
+    return relevant
+
+
+def _contains_searchterm(ref: Reference, searchterm) -> bool:
+    fields = _fields_with_meta_data(ref)
+    #search through the field names
+    if searchterm in fields.keys():
+        return True
+
+    #serach through the values
+    for val in fields.values():
+        if searchterm in str.lower(val):
+            return True
+    return False
+
+
 def search(bibFile: BibFile, searchterm):
     """
     function that returns a file containing the references including a certain searchterm
     """
     searchterm = str.lower(searchterm)
-    array = []
-    for ref in bibFile.get_references():
-        #search through the field names
-        if searchterm in ref.get_fields().keys():
-            array.append(ref)
-            continue
-
-        #serach through the values
-        for val in ref.get_fields().values():
-            if searchterm in str.lower(val):
-                array.append(ref)
-                break
+    array = [ref for ref in bibFile.get_references() if _contains_searchterm(ref, searchterm)]
 
     if not array:
         raise Exception(f"No instances of '{searchterm}' found. Returning nothing...")
 
     return array
+
+
+def iter_search(entries, searchterm):
+    """
+    streaming variant of search: yields the references including a certain searchterm one at a time
+    entries can be any iterable of entries, e.g. file_parser.iter_bib, so the first results show up before the file is fully read
+    """
+    searchterm = str.lower(searchterm)
+    found = False
+    for entry in entries:
+        if type(entry) is Reference and _contains_searchterm(entry, searchterm):
+            found = True
+            yield entry
+
+    if not found:
+        raise Exception(f"No instances of '{searchterm}' found. Returning nothing...")
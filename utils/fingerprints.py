@@ -0,0 +1,141 @@
+import hashlib
+import os
+import pickle
+
+# Bump when the operations change in a way that makes the remembered entries invalid.
+FINGERPRINT_VERSION = 2
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../cache/fingerprints")
+
+_EXTENSION = ".fingerprints"
+
+
+def _settings_hash(settings) -> str:
+    return hashlib.blake2b(repr((FINGERPRINT_VERSION, settings)).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class EntryFingerprints(object):
+    """
+    The fingerprints of the entries of a file that an operation (like the cleanup) left unchanged the last time it
+    ran: the content digest of the entry, for the hash of the settings of the operation. An entry with a remembered
+    fingerprint is already done, so the next run with the same settings can skip it. A value can be remembered with
+    every fingerprint, for what the operation needs to know about the entries it skips.
+    The fingerprints are stored per file and operation in CACHE_DIRECTORY, the least recently used ones are removed
+    when the directory grows over maximum_size bytes.
+    """
+    def __init__(self, operation: str, file_path, settings, maximum_size=None):
+        """
+        :param operation: the name of the operation, like "cleanup".
+        :param file_path: the path of the bib file.
+        :param settings: everything the result of the operation depends on besides the entry, as a value with a
+        stable repr (tuples, lists, dicts, strings, numbers and booleans).
+        :param maximum_size: the size in bytes CACHE_DIRECTORY is kept within when saving. If None: no limit.
+        """
+        self.settings_hash = _settings_hash(settings)
+        self.maximum_size = maximum_size
+        key = hashlib.blake2b(f"{operation}|{os.path.abspath(file_path)}".encode("utf-8"),
+                              digest_size=16).hexdigest()
+        self.path = os.path.join(CACHE_DIRECTORY, key + _EXTENSION)
+        self._previous = {}
+        self._current = {}
+        try:
+            with open(self.path, "rb") as file:
+                stored = pickle.load(file)
+            if stored["settings"] == self.settings_hash:
+                self._previous = stored["entries"]
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError, KeyError, TypeError):
+            pass
+
+    def get(self, entry, default=None):
+        """
+        Returns the value remembered with the fingerprint of the entry, or default if the entry has to be done.
+        """
+        digest = entry.content_digest()
+        value = self._current.get(digest, default)
+        if value is default:
+            value = self._previous.get(digest, default)
+            if value is not default:
+                self._current[digest] = value
+        return value
+
+    def add(self, entry, value=True):
+        """
+        Remembers the fingerprint of an entry that the operation left unchanged.
+        """
+        self._current[entry.content_digest()] = value
+
+    def save(self):
+        """
+        Stores the fingerprints of the entries that were looked up or added since they were loaded, the others are
+        forgotten.
+        """
+        if self._current == self._previous:
+            try:
+                os.utime(self.path)  # Mark as recently used.
+            except OSError:
+                pass
+            return
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "wb") as file:
+                pickle.dump({"settings": self.settings_hash, "entries": self._current}, file,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary_path, self.path)
+        except OSError as e:
+            print(f"Could not write the fingerprints: {e}")
+        finally:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+        if self.maximum_size is not None:
+            _evict(self.maximum_size)
+
+
+def _evict(maximum_size):
+    """
+    Removes the least recently used fingerprints until the cache is within maximum_size bytes.
+    Every time fingerprints are saved their modification time is updated, so that is used as the time of last use.
+    """
+    stored = []
+    total_size = 0
+    for name in os.listdir(CACHE_DIRECTORY):
+        if not name.endswith(_EXTENSION):
+            continue
+        path = os.path.join(CACHE_DIRECTORY, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stored.append((stat.st_mtime_ns, stat.st_size, path))
+        total_size += stat.st_size
+    stored.sort()
+    for _, size, path in stored:
+        if total_size <= maximum_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        total_size -= size
+
+
+def get_fingerprints(operation: str, bib_file, settings, config) -> EntryFingerprints | None:
+    """
+    Returns the EntryFingerprints of the operation on the file, or None if the file has no path or the fingerprints
+    are turned off in the config (entry_fingerprints). The fingerprints are kept within the same size as the parse
+    cache (parse_cache_size_mb).
+    """
+    if not config.entry_fingerprints or not bib_file.file_path:
+        return None
+    return EntryFingerprints(operation, bib_file.file_path, settings, int(config.parse_cache_size_mb * 1024 * 1024))
+
+
+def clear_fingerprints():
+    """
+    Removes all stored fingerprints.
+    """
+    if os.path.isdir(CACHE_DIRECTORY):
+        for name in os.listdir(CACHE_DIRECTORY):
+            try:
+                os.remove(os.path.join(CACHE_DIRECTORY, name))
+            except OSError:
+                pass
@@ -1,3 +1,4 @@
+import copy
 import json
 import os
 
@@ -9,6 +10,13 @@ CONFIG_TEMPLATE = {
     "add_abbreviations_as_strings": False,
     "clean_before_merge": True,
     "remove_newlines_in_fields": False,
+    "parser_engine": "scanner",
+    "parse_cache": True,
+    "parse_cache_size_mb": 512,
+    "keep_unchanged_entries": True,
+    "save_durability": "file",
+    "tag_store": "json",
+    "entry_fingerprints": True,
     "convert_special_symbols_to_unicode": True,
     "prefer_doi_over_url": True,
     "remove_comments": False,
@@ -47,32 +55,159 @@ def _load_json(path):
 
 def _dump_json(dictionary: dict, path, indent: int, ensure_ascii: bool):
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as file:
-        file.seek(0)  # move pointer to first position
-        json.dump(dictionary, file, indent=indent, ensure_ascii=ensure_ascii)
-        file.truncate()  # remove all that comes after replaced text
+    # write to a temporary file and replace the old file with it, so the file is never half written
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(dictionary, file, indent=indent, ensure_ascii=ensure_ascii)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
 
 
-def load_config():
+def _read_config() -> dict:
+    config = _load_json(CONFIG_FILE)
     # error recovery: in case of deletion of file, dump template
-    if _load_json(CONFIG_FILE) == {}:
-        dump_config(CONFIG_TEMPLATE)
-    return _load_json(CONFIG_FILE)
+    if config == {}:
+        _dump_json(CONFIG_TEMPLATE, CONFIG_FILE, 2, True)
+        config = copy.deepcopy(CONFIG_TEMPLATE)
+    return config
+
+
+def _read_bool(config: dict, key: str, default: bool) -> bool:
+    return bool(config.get(key, default))
+
+
+def _read_str(config: dict, key: str, default: str) -> str:
+    value = config.get(key, default)
+    return value if isinstance(value, str) else default
+
+
+def _read_float(config: dict, key: str, default: float, minimum=None, maximum=None) -> float:
+    value = config.get(key, default)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        value = default
+    if minimum is not None:
+        value = max(minimum, value)
+    if maximum is not None:
+        value = min(maximum, value)
+    return value
+
+
+def _read_names(config: dict, key: str) -> tuple:
+    value = config.get(key, [])
+    if not isinstance(value, list):
+        return ()
+    return tuple(name for name in value if isinstance(name, str))
+
+
+class Config(object):
+    """
+    A snapshot of config.json with every value checked and converted to its type once, so code that runs often can
+    use the attributes instead of reading the file. Missing or invalid values get the default that the code used when
+    it read the value itself. Use get_config to get the current Config, and load_config/dump_config to change the
+    file.
+    """
+    def __init__(self, config: dict):
+        self.values = config
+        self.user_interface = _read_str(config, "user_interface", "CLI")
+        self.working_directory = _read_str(config, "working_directory", "")
+
+        self.abstract_strong_match = _read_float(config, "abstract_strong_match", 0.9, 0.0, 1.0)
+        # The mismatch threshold can not be above the match threshold.
+        self.abstract_strong_mismatch = _read_float(config, "abstract_strong_mismatch", 0.5, 0.0,
+                                                    self.abstract_strong_match)
+        self.clean_before_merge = _read_bool(config, "clean_before_merge", False)
+        self.add_abbreviations_as_strings = _read_bool(config, "add_abbreviations_as_strings", False)
+
+        self.remove_newlines_in_fields = _read_bool(config, "remove_newlines_in_fields", False)
+        self.parser_engine = _read_str(config, "parser_engine", "scanner")
+        self.parse_cache = _read_bool(config, "parse_cache", True)
+        self.parse_cache_size_mb = _read_float(config, "parse_cache_size_mb", 512, 0.0)
+        self.keep_unchanged_entries = _read_bool(config, "keep_unchanged_entries", True)
+        self.save_durability = _read_str(config, "save_durability", "file")
+        self.tag_store = _read_str(config, "tag_store", "json")
+        self.entry_fingerprints = _read_bool(config, "entry_fingerprints", True)
+
+        self.convert_special_symbols_to_unicode = _read_bool(config, "convert_special_symbols_to_unicode", False)
+        self.prefer_doi_over_url = _read_bool(config, "prefer_doi_over_url", False)
+        self.remove_comments = _read_bool(config, "remove_comments", False)
+        self.remove_comment_entries = _read_bool(config, "remove_comment_entries", False)
+        self.lowercase_entry_types = _read_bool(config, "lowercase_entry_types", False)
+        self.lowercase_fields = _read_bool(config, "lowercase_fields", False)
+        self.change_enclosures_to_braces = _read_bool(config, "change_enclosures_to_braces", False)
+        self.change_enclosures_to_quotation_marks = _read_bool(config, "change_enclosures_to_quotation_marks", False)
+        self.unnecessary_fields = _read_names(config, "unnecessary_fields")
+        self.preferred_field_order = _read_names(config, "preferred_field_order")
+        # The position of every field in preferred_field_order, the first one if a field is in there twice.
+        self.preferred_field_positions = {}
+        for position, name in enumerate(self.preferred_field_order):
+            self.preferred_field_positions.setdefault(name, position)
+
+    def field_position(self, name: str) -> int:
+        """
+        Returns the position of the field in preferred_field_order, or the length of that order for other fields.
+        """
+        return self.preferred_field_positions.get(name, len(self.preferred_field_order))
+
+    def get(self, key, default=None):
+        """
+        Returns the value in the file as it is, for values that have no attribute.
+        """
+        return self.values.get(key, default)
+
+
+_config = None
+_config_stamp = None
+
+
+def _config_file_stamp():
+    try:
+        stat = os.stat(CONFIG_FILE)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_config() -> Config:
+    """
+    Returns the Config of this process. The file is only read again when its modification time or size changed, or
+    after dump_config. Do not change the result, use load_config and dump_config for that.
+    """
+    global _config, _config_stamp
+    stamp = _config_file_stamp()
+    if _config is None or stamp is None or stamp != _config_stamp:
+        _config = Config(_read_config())
+        _config_stamp = _config_file_stamp()
+    return _config
+
+
+def load_config() -> dict:
+    """
+    Returns the contents of config.json as a new dict, which can be changed and written with dump_config.
+    """
+    return copy.deepcopy(get_config().values)
 
 
 def dump_config(dictionary: dict):
-    return _dump_json(dictionary, CONFIG_FILE, 2, True)
+    global _config
+    try:
+        return _dump_json(dictionary, CONFIG_FILE, 2, True)
+    finally:
+        _config = None
 
 
 def get_wd_path():
     if not is_wd_path_set():
         raise Exception(f"working directory not set! Use cwd <absolute/path/to/directory> to set it")
-    return load_config().get("working_directory") or ""
+    return get_config().working_directory
 
 
 def is_wd_path_set():
-    wd_path = load_config().get("working_directory")
-    return False if wd_path == "" else True
+    return get_config().working_directory != ""
 
 
 def load_abbreviations():
@@ -1,3 +1,4 @@
+import functools
 import re
 import textwrap
 import unicodedata
@@ -10,29 +11,11 @@ from difflib import SequenceMatcher
 NON_ALNUM_RE = re.compile(r'[^a-z0-9]+')
 AUTHOR_SEPARATOR_RE = re.compile(r'\s+and\s+', re.IGNORECASE)
 
-# Similarity thresholds for abstract comparison (configurable via config.json)
-DEFAULT_ABSTRACT_STRONG_MATCH = 0.9
-DEFAULT_ABSTRACT_STRONG_MISMATCH = 0.5
-
-
-def _get_abstract_thresholds():
-    cfg = json_loader.load_config()
-    strong = cfg.get('abstract_strong_match', DEFAULT_ABSTRACT_STRONG_MATCH)
-    weak = cfg.get('abstract_strong_mismatch', DEFAULT_ABSTRACT_STRONG_MISMATCH)
-    try:
-        strong = float(strong)
-    except Exception:
-        strong = DEFAULT_ABSTRACT_STRONG_MATCH
-    try:
-        weak = float(weak)
-    except Exception:
-        weak = DEFAULT_ABSTRACT_STRONG_MISMATCH
-    # Clamp and ensure weak <= strong
-    strong = max(0.0, min(1.0, strong))
-    weak = max(0.0, min(1.0, weak))
-    if weak > strong:
-        weak = strong
-    return strong, weak
+def _get_abstract_thresholds(config: json_loader.Config = None):
+    # Similarity thresholds for abstract comparison (configurable via config.json, clamped by the Config)
+    if config is None:
+        config = json_loader.get_config()
+    return config.abstract_strong_match, config.abstract_strong_mismatch
 
 # URL domains considered relatively reliable for identity matching
 TRUSTED_URL_DOMAINS = {
@@ -50,23 +33,24 @@ def _stringify_field_value(value) -> str:
     return s
 
 
-def order_key(name: str):
-    preferred_field_order = json_loader.load_config().get("preferred_field_order", [])
-    return preferred_field_order.index(name) if name in preferred_field_order else len(preferred_field_order), name
+def order_key(name: str, config: json_loader.Config = None):
+    if config is None:
+        config = json_loader.get_config()
+    return config.field_position(name), name
 
 
-def _ordered_field_names(ref: Reference) -> list:
-    fields = list(ref.get_fields().keys())
-    # Remove internal/meta fields from display ordering context
-    for k in ["comment_above_reference", "entry_type"]:
-        if k in fields:
-            fields.remove(k)
-    return sorted(fields, key=order_key)
+def _ordered_field_names(ref: Reference, config: json_loader.Config = None) -> list:
+    # The cite key is shown along with the fields.
+    if config is None:
+        config = json_loader.get_config()
+    return sorted(["cite_key", *ref.get_fields()], key=lambda name: order_key(name, config))
 
 
-def _collect_all_fields(ref1: Reference, ref2: Reference) -> list:
-    names = set(_ordered_field_names(ref1)) | set(_ordered_field_names(ref2))
-    return sorted(names, key=order_key)
+def _collect_all_fields(ref1: Reference, ref2: Reference, config: json_loader.Config = None) -> list:
+    if config is None:
+        config = json_loader.get_config()
+    names = {"cite_key", *ref1.get_fields(), *ref2.get_fields()}
+    return sorted(names, key=lambda name: order_key(name, config))
 
 
 def print_reference_comparison(ref1: Reference, ref2: Reference, width: int = 100, left_col: int = 18) -> None:
@@ -111,6 +95,8 @@ def print_reference_comparison(ref1: Reference, ref2: Reference, width: int = 10
 
 
 def _strip_diacritics(value: str) -> str:
+    if value.isascii():
+        return value  # Nothing to decompose.
     normalized = unicodedata.normalize('NFKD', value)
     return ''.join(ch for ch in normalized if not unicodedata.combining(ch))
 
@@ -126,6 +112,8 @@ def _normalize_whitespace(value: str) -> str:
     return ' '.join(value.split())
 
 
+# The normalized values are cached, because the references are compared with the references of every other file.
+@functools.lru_cache(maxsize=65536)
 def normalize_author_field(raw_author) -> str:
     if not raw_author:
         return ''
@@ -146,6 +134,7 @@ def normalize_author_field(raw_author) -> str:
     return '::'.join(normalized_people)
 
 
+@functools.lru_cache(maxsize=65536)
 def normalize_title_field(raw_title) -> str:
     if not raw_title:
         return ''
@@ -154,6 +143,7 @@ def normalize_title_field(raw_title) -> str:
     return NON_ALNUM_RE.sub('', text)
 
 
+@functools.lru_cache(maxsize=4096)
 def normalize_abstract_field(raw_abstract) -> str:
     if not raw_abstract:
         return ''
@@ -169,6 +159,8 @@ def abstract_similarity(a, b) -> float:
     b_norm = normalize_abstract_field(getattr(b, 'abstract', None) if isinstance(b, Reference) else b)
     if not a_norm or not b_norm:
         return 0.0
+    if a_norm == b_norm:
+        return 1.0
     return SequenceMatcher(None, a_norm, b_norm).ratio()
 
 
@@ -399,10 +391,6 @@ def merge_reference(reference_1: Reference, reference_2: Reference) -> Reference
     for field_type, data in reference_1_fields.items():
         if field_type in reference_2_fields:
             other = reference_2_fields[field_type]
-            # Skip meta fields (never alter or wrap these)
-            if field_type in ("comment_above_reference", "entry_type", "cite_key"):
-                setattr(merged_reference, field_type, data)
-                continue
 
             # If equal after normalization, prefer a canonical/cleaner representation without prompting
             if normalize_field_for_compare(field_type, data) == normalize_field_for_compare(field_type, other):
@@ -420,10 +408,7 @@ def merge_reference(reference_1: Reference, reference_2: Reference) -> Reference
                     manual = interface_handler.prompt_text_input(prompt, _stringify_field_value(data))
                     data = manual
         # add field from reference 1 to merged reference (ensure braces after decision)
-        if field_type == 'cite_key':
-            setattr(merged_reference, field_type, data)
-        else:
-            setattr(merged_reference, field_type, _ensure_braces(data))
+        setattr(merged_reference, field_type, _ensure_braces(data))
 
     for field_type, data in reference_2_fields.items():
         if field_type not in merged_reference.get_fields():
@@ -461,22 +446,200 @@ def merge_strings(bib_file_1: BibFile, bib_file_2: BibFile) -> (BibFile, BibFile
             if choice == 1:
                 old_abbreviation = string.abbreviation
                 batch_editor.batch_rename_abbreviation(bib_file_1, string.abbreviation, new_abbreviation)
-                string_list.append([x for x in bib_file_1.get_strings() if x.abbreviation == new_abbreviation][0])
-                string_list.append([x for x in bib_file_2.get_strings() if x.abbreviation == old_abbreviation][0])
+                string_list.append(bib_file_1.get_string_by_abbreviation(new_abbreviation))
+                string_list.append(bib_file_2.get_string_by_abbreviation(old_abbreviation))
             elif choice == 2:
                 batch_editor.batch_rename_abbreviation(bib_file_2, string.abbreviation, new_abbreviation)
                 string_list.append(string)  # The unchanged string from file 1.
-                string_list.append([x for x in bib_file_2.get_strings() if x.abbreviation == new_abbreviation][0])
+                string_list.append(bib_file_2.get_string_by_abbreviation(new_abbreviation))
             else:
                 raise ValueError("Invalid choice. Please enter 1 or 2.")
     return bib_file_1, bib_file_2, string_list
 
 
-def merge_files(bib_file_1: BibFile, bib_file_2: BibFile) -> BibFile:
-    clean_before_merge = json_loader.load_config().get("clean_before_merge", False)
-    if clean_before_merge:
-        cleanup.cleanup(bib_file_1)
-        cleanup.cleanup(bib_file_2)
+def _trusted_url_key(reference: Reference) -> str | None:
+    # The canonical URL key of the reference, only for the trusted domains.
+    url_key = _canonical_url_key(getattr(reference, 'url', None))
+    if url_key:
+        domain = url_key.split('|', 1)[0]
+        if domain in TRUSTED_URL_DOMAINS or url_key.startswith('doi:'):
+            return url_key
+    return None
+
+
+def _most_similar_abstract(reference: Reference, candidates: list) -> Reference:
+    # The first candidate, or the one with the most similar abstract if there are multiple.
+    best = candidates[0]
+    if len(candidates) > 1:
+        best_sim = -1.0
+        for candidate in candidates:
+            sim = abstract_similarity(reference, candidate)
+            if sim > best_sim:
+                best_sim = sim
+                best = candidate
+    return best
+
+
+def _match_reference(entry: Reference, find_candidates, config: json_loader.Config) -> tuple | None:
+    """
+    Matches a reference with the references of another file. The DOI is tried first (auto-merge), then the
+    author+title signature (decided by the abstracts, or by the user) and then a trusted URL (decided by the user).
+    :param entry: the reference.
+    :param find_candidates: a function(kind, key) with kind "doi", "signature" or "url", that returns the references of
+    the other file with that key that are not matched yet.
+    :param config: the config with the abstract thresholds.
+    :return: None if no reference matched, otherwise (the matched reference, the list of references that take the
+    place of both in the merged file).
+    """
+    # 1) Try DOI match for auto-merge
+    doi_norm = _normalize_doi(getattr(entry, 'doi', None))
+    if doi_norm:
+        candidates = find_candidates("doi", doi_norm)
+        if candidates:
+            other_ref = _most_similar_abstract(entry, candidates)
+            target_key = other_ref.cite_key
+            # If fully equal (normalized), add only once without prompt
+            if _references_equal_normalized(entry, other_ref):
+                interface_handler.show_toast(
+                    f"Auto-dedup '{entry.cite_key}' and '{target_key}' (identical by DOI).", level='success')
+            else:
+                interface_handler.show_toast(
+                    f"Auto-merging '{entry.cite_key}' + '{target_key}' (by DOI: {doi_norm}).", level='success')
+            return other_ref, [merge_reference(entry, other_ref)]
+
+    # 2) Try author+title signature matching
+    signature = build_reference_signature(entry)
+    if signature:
+        candidates = find_candidates("signature", signature)
+        if candidates:
+            # If multiple candidates share the same signature, pick the one with highest abstract similarity
+            other_ref = None
+            best_sim = -1.0
+            for candidate in candidates:
+                sim = abstract_similarity(entry, candidate)
+                if sim > best_sim:
+                    best_sim = sim
+                    other_ref = candidate
+            target_key = other_ref.cite_key
+
+            # Decide based on abstract similarity if abstracts exist
+            has_abs_1 = bool(normalize_abstract_field(getattr(entry, 'abstract', None)))
+            has_abs_2 = bool(normalize_abstract_field(getattr(other_ref, 'abstract', None)))
+
+            if has_abs_1 and has_abs_2:
+                strong_thr, weak_thr = _get_abstract_thresholds(config)
+                if best_sim >= strong_thr:
+                    if _references_equal_normalized(entry, other_ref):
+                        interface_handler.show_toast(
+                            f"Auto-dedup '{entry.cite_key}' and '{target_key}' (identical).", level='success')
+                    else:
+                        interface_handler.show_toast(f"Auto-merging '{entry.cite_key}' + '{target_key}' "
+                                                     f"(by author+title; abstract sim {best_sim:.2f} >= strong {strong_thr:.2f}).",
+                                                     level='success')
+                    return other_ref, [merge_reference(entry, other_ref)]
+                elif best_sim <= weak_thr:
+                    # If identical aside from benign differences (e.g., pages dash), dedup
+                    if _references_equal_normalized(entry, other_ref):
+                        interface_handler.show_toast(
+                            f"Auto-dedup '{entry.cite_key}' and '{target_key}' (equal after normalization).", level='success')
+                        return other_ref, [merge_reference(entry, other_ref)]
+                    interface_handler.show_toast(
+                        f"Keeping both for '{entry.cite_key}' and '{target_key}' "
+                        f"(by author+title; abstract sim {best_sim:.2f} <= weak {weak_thr:.2f}).", level='info')
+                    return other_ref, [entry, other_ref]
+
+            # If references are equal after normalization, dedup without prompt
+            if _references_equal_normalized(entry, other_ref):
+                interface_handler.show_toast(
+                    f"Auto-dedup '{entry.cite_key}' and '{target_key}' (equal after normalization).", level='success')
+                return other_ref, [merge_reference(entry, other_ref)]
+
+            # Otherwise, ask user
+            choice = _prompt_ref_merge_decision(entry, other_ref)
+
+            if choice == 1:
+                interface_handler.show_lines([
+                    f"Merging '{entry.cite_key}' with '{target_key}' "
+                    f"(by user choice after author+title match)."
+                ])
+                return other_ref, [merge_reference(entry, other_ref)]
+            elif choice == 2:
+                # Keep only ref 1
+                interface_handler.show_lines([f"Keeping only ref 1 for '{entry.cite_key}'."])
+                return other_ref, [entry]
+            elif choice == 3:
+                # Keep only ref 2
+                interface_handler.show_lines([f"Keeping only ref 2 for '{target_key}'."])
+                return other_ref, [other_ref]
+            elif choice == 4:
+                interface_handler.show_lines([f"Skipping merge for '{entry.cite_key}'. Keeping both entries."])
+                return other_ref, [entry, other_ref]
+
+    # 3) Try URL match on trusted domains (prompt)
+    url_key = _trusted_url_key(entry)
+    if url_key:
+        candidates = find_candidates("url", url_key)
+        if candidates:
+            # If multiple, show the best by abstract similarity
+            other_ref = _most_similar_abstract(entry, candidates)
+            target_key = other_ref.cite_key
+            interface_handler.show_lines([f"References share the same trusted URL; "
+                                          f"please confirm merge. URL key: {url_key}"])
+            print_reference_comparison(entry, other_ref, width=110)
+            header = f"References share the same trusted URL; please confirm merge. URL key: {url_key}"
+            # If fully equal (normalized), auto-dedup without prompt
+            if _references_equal_normalized(entry, other_ref):
+                interface_handler.show_toast(
+                    f"Auto-dedup '{entry.cite_key}' and '{target_key}' (identical by trusted URL).", level='success')
+                return other_ref, [merge_reference(entry, other_ref)]
+            if (getattr(interface_handler, 'user_interface', 'CLI') == 'GUI' and
+                    hasattr(interface_handler, 'prompt_reference_comparison')):
+                choice = interface_handler.prompt_reference_comparison(
+                    _render_reference_block(entry),
+                    _render_reference_block(other_ref),
+                    header=header,
+                    option1="Merge references",
+                    option2="Keep ref 1 only",
+                    option3="Keep ref 2 only",
+                    option4="Keep both references"
+                )
+            else:
+                interface_handler.show_lines([header])
+                print_reference_comparison(entry, other_ref, width=110)
+                interface_handler.show_lines([
+                    "Choose where to merge or skip:",
+                    "1: Merge references",
+                    "2: Keep ref 1 only",
+                    "3: Keep ref 2 only",
+                    "4: Keep both references"
+                ])
+                choice = interface_handler.get_selection("Enter your choice (1-4): ", 4)
+
+            if choice == 1:
+                interface_handler.show_lines([
+                    f"Merging '{entry.cite_key}' with '{target_key}' "
+                    f"(by user choice after URL match: {url_key})."
+                ])
+                return other_ref, [merge_reference(entry, other_ref)]
+            elif choice == 2:
+                interface_handler.show_lines([f"Keeping only ref 1 for '{entry.cite_key}'."])
+                return other_ref, [entry]
+            elif choice == 3:
+                interface_handler.show_lines([f"Keeping only ref 2 for '{target_key}'."])
+                return other_ref, [other_ref]
+            elif choice == 4:
+                interface_handler.show_lines([f"Keeping both entries for '{entry.cite_key}'."])
+                return other_ref, [entry, other_ref]
+
+    return None
+
+
+def merge_files(bib_file_1: BibFile, bib_file_2: BibFile, config: json_loader.Config = None) -> BibFile:
+    if config is None:
+        config = json_loader.get_config()
+    if config.clean_before_merge:
+        cleanup.cleanup(bib_file_1, config)
+        cleanup.cleanup(bib_file_2, config)
 
     # File name will be set when generating the file, this is just temporary.
     merged_bib_file = BibFile(bib_file_1.file_path + '+' + bib_file_2.file_path)
@@ -499,239 +662,37 @@ def merge_files(bib_file_1: BibFile, bib_file_2: BibFile) -> BibFile:
         if isinstance(entry, Reference)
     }
 
-    # Build DOI and URL indexes for file 2
-    bib2_doi_index = {}
-    bib2_url_index = {}
-
-    bib2_signatures = {}
+    # Build DOI, signature and URL indexes for file 2
+    bib2_key_indexes = {"doi": {}, "signature": {}, "url": {}}
     for reference in bib2_index.values():
         signature = build_reference_signature(reference)
         if signature:
-            bib2_signatures.setdefault(signature, []).append(reference.cite_key)
+            bib2_key_indexes["signature"].setdefault(signature, []).append(reference.cite_key)
         # DOI index
         doi_norm = _normalize_doi(getattr(reference, 'doi', None))
         if doi_norm:
-            bib2_doi_index.setdefault(doi_norm, []).append(reference.cite_key)
+            bib2_key_indexes["doi"].setdefault(doi_norm, []).append(reference.cite_key)
         # URL index (trusted domains only)
-        url_key = _canonical_url_key(getattr(reference, 'url', None))
+        url_key = _trusted_url_key(reference)
         if url_key:
-            domain = url_key.split('|', 1)[0]
-            if domain in TRUSTED_URL_DOMAINS or url_key.startswith('doi:'):
-                bib2_url_index.setdefault(url_key, []).append(reference.cite_key)
+            bib2_key_indexes["url"].setdefault(url_key, []).append(reference.cite_key)
 
     consumed_bib2_keys = set()
 
+    def find_candidates(kind, key):
+        return [bib2_index[cite_key] for cite_key in bib2_key_indexes[kind].get(key, [])
+                if cite_key not in consumed_bib2_keys]
+
     # Add references from bib file 1.
     for entry in bib_file_1.content:
         if isinstance(entry, Reference):
-            # 1) Try DOI match for auto-merge
-            doi_norm = _normalize_doi(getattr(entry, 'doi', None))
-            if doi_norm:
-                candidate_keys = [
-                    key for key in bib2_doi_index.get(doi_norm, [])
-                    if key not in consumed_bib2_keys
-                ]
-                if candidate_keys:
-                    # Choose best by abstract similarity if multiple
-                    best_key = candidate_keys[0]
-                    if len(candidate_keys) > 1:
-                        best_sim = -1.0
-                        for key in candidate_keys:
-                            sim = abstract_similarity(entry, bib2_index[key])
-                            if sim > best_sim:
-                                best_sim = sim
-                                best_key = key
-                    target_key = best_key
-                    other_ref = bib2_index[target_key]
-                    # If fully equal (normalized), add only once without prompt
-                    if _references_equal_normalized(entry, other_ref):
-                        interface_handler.show_toast(
-                            f"Auto-dedup '{entry.cite_key}' and '{target_key}' (identical by DOI).", level='success')
-                        merged_bib_file.content.append(merge_reference(entry, other_ref))
-                    else:
-                        interface_handler.show_toast(
-                            f"Auto-merging '{entry.cite_key}' + '{target_key}' (by DOI: {doi_norm}).", level='success')
-                        merged_reference = merge_reference(entry, other_ref)
-                        merged_bib_file.content.append(merged_reference)
-                    consumed_bib2_keys.add(target_key)
-                    continue
-
-            # 2) Try author+title signature matching
-            signature = build_reference_signature(entry)
-            if signature:
-                candidate_keys = [
-                    key for key in bib2_signatures.get(signature, [])
-                    if key not in consumed_bib2_keys
-                ]
-                if candidate_keys:
-                    # If multiple candidates share the same signature, pick the one with highest abstract similarity
-                    best_key = None
-                    best_sim = -1.0
-                    for key in candidate_keys:
-                        sim = abstract_similarity(entry, bib2_index[key])
-                        if sim > best_sim:
-                            best_sim = sim
-                            best_key = key
-
-                    target_key = best_key
-                    other_ref = bib2_index[target_key]
-
-                    # Decide based on abstract similarity if abstracts exist
-                    has_abs_1 = bool(normalize_abstract_field(getattr(entry, 'abstract', None)))
-                    has_abs_2 = bool(normalize_abstract_field(getattr(other_ref, 'abstract', None)))
-
-                    if has_abs_1 and has_abs_2:
-                        strong_thr, weak_thr = _get_abstract_thresholds()
-                        if best_sim >= strong_thr:
-                            if _references_equal_normalized(entry, other_ref):
-                                interface_handler.show_toast(
-                                    f"Auto-dedup '{entry.cite_key}' and '{target_key}' (identical).", level='success')
-                                merged_bib_file.content.append(merge_reference(entry, other_ref))
-                            else:
-                                interface_handler.show_toast(f"Auto-merging '{entry.cite_key}' + '{target_key}' "
-                                                             f"(by author+title; abstract sim {best_sim:.2f} >= strong {strong_thr:.2f}).",
-                                                             level='success')
-                                merged_reference = merge_reference(entry, other_ref)
-                                merged_bib_file.content.append(merged_reference)
-                            consumed_bib2_keys.add(target_key)
-                            continue
-                        elif best_sim <= weak_thr:
-                            # If identical aside from benign differences (e.g., pages dash), dedup
-                            if _references_equal_normalized(entry, other_ref):
-                                interface_handler.show_toast(
-                                    f"Auto-dedup '{entry.cite_key}' and '{target_key}' (equal after normalization).", level='success')
-                                merged_bib_file.content.append(merge_reference(entry, other_ref))
-                                consumed_bib2_keys.add(target_key)
-                            else:
-                                interface_handler.show_toast(
-                                    f"Keeping both for '{entry.cite_key}' and '{target_key}' "
-                                    f"(by author+title; abstract sim {best_sim:.2f} <= weak {weak_thr:.2f}).", level='info')
-                                merged_bib_file.content.append(entry)
-                                merged_bib_file.content.append(other_ref)
-                                consumed_bib2_keys.add(target_key)
-                            continue
-
-                    # If references are equal after normalization, dedup without prompt
-                    if _references_equal_normalized(entry, other_ref):
-                        interface_handler.show_toast(
-                            f"Auto-dedup '{entry.cite_key}' and '{target_key}' (equal after normalization).", level='success')
-                        merged_bib_file.content.append(merge_reference(entry, other_ref))
-                        consumed_bib2_keys.add(target_key)
-                        continue
-
-                    # Otherwise, ask user
-                    choice = _prompt_ref_merge_decision(entry, other_ref)
-
-                    if choice == 1:
-                        interface_handler.show_lines([
-                            f"Merging '{entry.cite_key}' with '{target_key}' "
-                            f"(by user choice after author+title match)."
-                        ])
-                        merged_reference = merge_reference(entry, other_ref)
-                        merged_bib_file.content.append(merged_reference)
-                        consumed_bib2_keys.add(target_key)
-                        continue
-                    elif choice == 2:
-                        # Keep only ref 1
-                        interface_handler.show_lines([f"Keeping only ref 1 for '{entry.cite_key}'."])
-                        merged_bib_file.content.append(entry)
-                        consumed_bib2_keys.add(target_key)
-                        continue
-                    elif choice == 3:
-                        # Keep only ref 2
-                        interface_handler.show_lines([f"Keeping only ref 2 for '{target_key}'."])
-                        merged_bib_file.content.append(other_ref)
-                        consumed_bib2_keys.add(target_key)
-                        continue
-                    elif choice == 4:
-                        interface_handler.show_lines([f"Skipping merge for '{entry.cite_key}'. Keeping both entries."])
-                        merged_bib_file.content.append(entry)
-                        merged_bib_file.content.append(other_ref)
-                        consumed_bib2_keys.add(target_key)
-                        continue
-
-            # 3) Try URL match on trusted domains (prompt)
-            url_key = _canonical_url_key(getattr(entry, 'url', None))
-            if url_key:
-                domain = url_key.split('|', 1)[0]
-                if domain in TRUSTED_URL_DOMAINS or url_key.startswith('doi:'):
-                    candidate_keys = [
-                        key for key in bib2_url_index.get(url_key, [])
-                        if key not in consumed_bib2_keys
-                    ]
-                    if candidate_keys:
-                        # If multiple, show the best by abstract similarity
-                        best_key = candidate_keys[0]
-                        if len(candidate_keys) > 1:
-                            best_sim = -1.0
-                            for key in candidate_keys:
-                                sim = abstract_similarity(entry, bib2_index[key])
-                                if sim > best_sim:
-                                    best_sim = sim
-                                    best_key = key
-                        target_key = best_key
-                        other_ref = bib2_index[target_key]
-                        interface_handler.show_lines([f"References share the same trusted URL; "
-                                                      f"please confirm merge. URL key: {url_key}"])
-                        print_reference_comparison(entry, other_ref, width=110)
-                        header = f"References share the same trusted URL; please confirm merge. URL key: {url_key}"
-                        # If fully equal (normalized), auto-dedup without prompt
-                        if _references_equal_normalized(entry, other_ref):
-                            interface_handler.show_toast(
-                                f"Auto-dedup '{entry.cite_key}' and '{target_key}' (identical by trusted URL).", level='success')
-                            merged_bib_file.content.append(merge_reference(entry, other_ref))
-                            consumed_bib2_keys.add(target_key)
-                            continue
-                        if (getattr(interface_handler, 'user_interface', 'CLI') == 'GUI' and
-                                hasattr(interface_handler, 'prompt_reference_comparison')):
-                            choice = interface_handler.prompt_reference_comparison(
-                                _render_reference_block(entry),
-                                _render_reference_block(other_ref),
-                                header=header,
-                                option1="Merge references",
-                                option2="Keep ref 1 only",
-                                option3="Keep ref 2 only",
-                                option4="Keep both references"
-                            )
-                        else:
-                            interface_handler.show_lines([header])
-                            print_reference_comparison(entry, other_ref, width=110)
-                            interface_handler.show_lines([
-                                "Choose where to merge or skip:",
-                                "1: Merge references",
-                                "2: Keep ref 1 only",
-                                "3: Keep ref 2 only",
-                                "4: Keep both references"
-                            ])
-                            choice = interface_handler.get_selection("Enter your choice (1-4): ", 4)
-
-                        if choice == 1:
-                            interface_handler.show_lines([
-                                f"Merging '{entry.cite_key}' with '{target_key}' "
-                                f"(by user choice after URL match: {url_key})."
-                            ])
-                            merged_reference = merge_reference(entry, other_ref)
-                            merged_bib_file.content.append(merged_reference)
-                            consumed_bib2_keys.add(target_key)
-                            continue
-                        elif choice == 2:
-                            interface_handler.show_lines([f"Keeping only ref 1 for '{entry.cite_key}'."])
-                            merged_bib_file.content.append(entry)
-                            consumed_bib2_keys.add(target_key)
-                            continue
-                        elif choice == 3:
-                            interface_handler.show_lines([f"Keeping only ref 2 for '{target_key}'."])
-                            merged_bib_file.content.append(other_ref)
-                            consumed_bib2_keys.add(target_key)
-                            continue
-                        elif choice == 4:
-                            interface_handler.show_lines([f"Keeping both entries for '{entry.cite_key}'."])
-                            merged_bib_file.content.append(entry)
-                            merged_bib_file.content.append(other_ref)
-                            consumed_bib2_keys.add(target_key)
-                            continue
-
-            merged_bib_file.content.append(entry)
+            match = _match_reference(entry, find_candidates, config)
+            if match is None:
+                merged_bib_file.content.append(entry)
+            else:
+                other_ref, references = match
+                merged_bib_file.content.extend(references)
+                consumed_bib2_keys.add(other_ref.cite_key)
 
     # Add remaining references from bib file 2.
     for entry in bib_file_2.content:
@@ -741,6 +702,146 @@ def merge_files(bib_file_1: BibFile, bib_file_2: BibFile) -> BibFile:
     return merged_bib_file
 
 
+def merge_all_strings(bib_files: list) -> [String]:
+    """
+    Merge the Strings from any number of bib files together into a single list of Strings, the files are updated when
+    an abbreviation is renamed. The Strings that only occur in a later file are kept too.
+    :param bib_files: the list of files.
+    :return: the list of the strings for the merged file.
+    """
+    string_list = []
+    owners = {}  # The abbreviations in the list: abbreviation -> (String, number of its file).
+    for file_number, bib_file in enumerate(bib_files):
+        for string in bib_file.get_strings():
+            if string.abbreviation not in owners:
+                string_list.append(string)
+                owners[string.abbreviation] = (string, file_number)
+                continue
+            other_string, other_file_number = owners[string.abbreviation]
+            if other_string.long_form == string.long_form:
+                continue
+            choice = interface_handler.prompt_abbreviation_conflict(
+                other_string.long_form,
+                string.long_form,
+                string.abbreviation,
+            )
+            if choice == 1:
+                renamed, renamed_file_number, kept, kept_file_number = (other_string, other_file_number,
+                                                                        string, file_number)
+            elif choice == 2:
+                renamed, renamed_file_number, kept, kept_file_number = (string, file_number,
+                                                                        other_string, other_file_number)
+            else:
+                raise ValueError("Invalid choice. Please enter 1 or 2.")
+            old_abbreviation = string.abbreviation
+            new_abbreviation = interface_handler.prompt_text_input(
+                f"Now input the new abbreviation for '{renamed.long_form}'. (Old abbreviation: '{old_abbreviation}'): ",
+                default=old_abbreviation,
+            )
+            if new_abbreviation in owners:
+                raise ValueError(f"Abbreviation '{new_abbreviation}' already exists in the merged files!")
+            batch_editor.batch_rename_abbreviation(bib_files[renamed_file_number], old_abbreviation, new_abbreviation)
+            owners[old_abbreviation] = (kept, kept_file_number)
+            owners[new_abbreviation] = (renamed, renamed_file_number)
+            string_list.append(string)
+    return string_list
+
+
+def _reference_keys(reference: Reference) -> list:
+    # The (kind, key) pairs a reference is matched by, see _match_reference.
+    keys = []
+    doi_norm = _normalize_doi(getattr(reference, 'doi', None))
+    if doi_norm:
+        keys.append(("doi", doi_norm))
+    signature = build_reference_signature(reference)
+    if signature:
+        keys.append(("signature", signature))
+    url_key = _trusted_url_key(reference)
+    if url_key:
+        keys.append(("url", url_key))
+    return keys
+
+
+def merge_all_files(bib_files: list, config: json_loader.Config = None) -> BibFile:
+    """
+    Merge any number of bib files at once, with the same result as merging them one after another with merge_files.
+    The references of all files are indexed once by DOI, author+title signature and trusted URL. Every reference that
+    is not matched yet starts a cluster, which is matched with the later files in order (with the priorities and
+    prompts of merge_files), and the clusters are written to the merged file in one pass.
+    :param bib_files: the list of files, in the order of merging.
+    :param config: the config, the current config by default.
+    :return: the merged file.
+    """
+    if config is None:
+        config = json_loader.get_config()
+    if config.clean_before_merge:
+        for bib_file in bib_files:
+            cleanup.cleanup(bib_file, config)
+
+    # File name will be set when generating the file, this is just temporary.
+    merged_bib_file = BibFile('+'.join(bib_file.file_path for bib_file in bib_files))
+
+    # Add the preambles if they are different.
+    preamble_contents = set()
+    for bib_file in bib_files:
+        for preamble in bib_file.get_preambles():
+            if preamble.preamble not in preamble_contents:
+                preamble_contents.add(preamble.preamble)
+                merged_bib_file.content.append(preamble)
+
+    merged_bib_file.content.extend(merge_all_strings(bib_files))
+
+    # One index over the references of all files: kind -> key -> file number -> references.
+    file_references = [[entry for entry in bib_file.content if isinstance(entry, Reference)]
+                       for bib_file in bib_files]
+    key_indexes = {"doi": {}, "signature": {}, "url": {}}
+    for file_number, references in enumerate(file_references):
+        for reference in references:
+            for kind, key in _reference_keys(reference):
+                key_indexes[kind].setdefault(key, {}).setdefault(file_number, []).append(reference)
+
+    consumed = set()  # The ids of the references that are in a cluster.
+
+    def merge_cluster(reference: Reference, file_number: int) -> list:
+        # Matches the reference with the later files, returns the references the cluster ends up as. The references
+        # kept next to it are placed right after it, the latest first, like merge_files does one file at a time.
+        kept_references = []
+        current_file_number = file_number
+        while True:
+            keys = _reference_keys(reference)
+            next_file_numbers = [number for kind, key in keys for number in key_indexes[kind].get(key, {})
+                                 if number > current_file_number]
+            if not next_file_numbers:
+                break
+            current_file_number = min(next_file_numbers)
+
+            def find_candidates(kind, key):
+                return [candidate for candidate in key_indexes[kind].get(key, {}).get(current_file_number, [])
+                        if id(candidate) not in consumed]
+
+            match = _match_reference(reference, find_candidates, config)
+            if match is None:
+                continue
+            other_ref, references = match
+            consumed.add(id(other_ref))
+            reference = references[0]
+            if len(references) > 1:
+                kept_references.append((references[1], current_file_number))
+
+        cluster = [reference]
+        for kept_reference, kept_file_number in reversed(kept_references):
+            cluster.extend(merge_cluster(kept_reference, kept_file_number))
+        return cluster
+
+    for file_number, references in enumerate(file_references):
+        for reference in references:
+            if id(reference) not in consumed:
+                consumed.add(id(reference))
+                merged_bib_file.content.extend(merge_cluster(reference, file_number))
+
+    return merged_bib_file
+
+
 def _render_reference_block(ref: Reference) -> str:
     lines = []
     for name in _ordered_field_names(ref):
@@ -801,8 +902,9 @@ def _prompt_field_conflict_choice(field_name: str, v1, v2, reference_1: Referenc
 
 
 def _references_equal_normalized(ref1: Reference, ref2: Reference) -> bool:
-    names = set(_ordered_field_names(ref1)) | set(_ordered_field_names(ref2))
-    names.discard('cite_key')
+    if ref1.content_digest() == ref2.content_digest():
+        return True  # Identical references, no need to normalize the fields.
+    names = {*ref1.get_fields(), *ref2.get_fields()}  # The cite keys are not compared.
     for name in names:
         v1 = getattr(ref1, name, None)
         v2 = getattr(ref2, name, None)
@@ -9,8 +9,8 @@ class GroupingType(Enum):
 
 
 def order_by_entry_type(bib_file: BibFile, enum: GroupingType):
-    # get all references from the bib obj
-    references_by_entry_types = references_to_entry_type_dict(bib_file.get_references())
+    # get all references from the bib obj, grouped by entry type
+    references_by_entry_types = bib_file.get_entry_type_dict()
 
     # sort dictionary either AtoZ or ZtoA
     references_by_entry_types = sorted(references_by_entry_types.items(), reverse=bool(enum.value))
@@ -28,8 +28,7 @@ def references_to_entry_type_dict(references: [Reference]):
     # define dict with structure: {entry_type: [reference1, reference2, reference3]}
     entry_type_dict = {}
     for reference in references:
-        fields = reference.get_fields()
-        entry_type = fields["entry_type"]
+        entry_type = reference.entry_type
 
         if entry_type not in entry_type_dict.keys():
             entry_type_dict[entry_type] = [reference]
@@ -0,0 +1,121 @@
+import concurrent.futures
+import multiprocessing
+from objects import Reference
+
+PARALLEL_CHUNK_REFERENCES = 1000  # Number of references per task when transforming in parallel.
+
+# The references that are transformed in parallel, only set inside the worker processes (see _share_references).
+# Forked worker processes inherit them, so only the ranges of the chunks have to be sent to the workers instead of the
+# references.
+_shared_references = None
+
+
+def _reference_state(reference: Reference) -> tuple:
+    """
+    The compact tuple a reference is sent as between the processes: its meta data and its field names and values.
+    """
+    return (reference.comment_above_reference, reference.entry_type, reference.cite_key,
+            tuple(reference.field_items()))
+
+
+def _reference_from_state(state: tuple) -> Reference:
+    comment_above_reference, entry_type, cite_key, fields = state
+    reference = Reference(comment_above_reference, entry_type, cite_key)
+    reference.set_fields(dict(fields))
+    return reference
+
+
+def _set_reference_state(reference: Reference, state: tuple):
+    comment_above_reference, entry_type, cite_key, fields = state
+    reference.comment_above_reference = comment_above_reference
+    reference.entry_type = entry_type
+    reference.cite_key = cite_key
+    reference.set_fields(dict(fields))
+
+
+def _share_references(references: list):
+    """
+    Initializer of the forked worker processes. The references are passed to the process when it is forked instead of
+    pickled, and every pool gets its own, so concurrent calls (in threads) do not mix them up.
+    """
+    global _shared_references
+    _shared_references = references
+
+
+def _run_chunk(references, function, arguments: tuple, write_back: bool) -> list:
+    """
+    Calls the function on a chunk of references, runs inside the worker processes.
+    :param references: a list of reference states, or a (start, end) range of the inherited _shared_references.
+    :return: the list of (new state of the reference, or None if it did not change; result of the function).
+    """
+    if isinstance(references, tuple):
+        references = _shared_references[references[0]:references[1]]
+    else:
+        references = [_reference_from_state(state) for state in references]
+    results = []
+    for reference in references:
+        state = _reference_state(reference) if write_back else None
+        result = function(reference, *arguments)
+        if write_back:
+            new_state = _reference_state(reference)
+            results.append((new_state if new_state != state else None, result))
+        else:
+            results.append((None, result))
+    return results
+
+
+def _run_parallel(references: list, function, arguments: tuple, workers: int, write_back: bool) -> list:
+    forked = multiprocessing.get_start_method() == "fork"
+    initializer, initargs = (_share_references, (references,)) if forked else (None, ())
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=initializer, initargs=initargs) as executor:
+        futures = []
+        for start in range(0, len(references), PARALLEL_CHUNK_REFERENCES):
+            end = start + PARALLEL_CHUNK_REFERENCES
+            if forked:
+                chunk = (start, end)
+            else:
+                chunk = [_reference_state(reference) for reference in references[start:end]]
+            futures.append(executor.submit(_run_chunk, chunk, function, arguments, write_back))
+        results = []
+        for future in futures:
+            results.extend(future.result())
+    return results
+
+
+def _is_parallel(references: list, workers: int) -> bool:
+    # The pool only pays off with at least two chunks of references.
+    return workers > 1 and len(references) >= 2 * PARALLEL_CHUNK_REFERENCES
+
+
+def map_references(references: list, function, arguments=(), workers=1) -> list:
+    """
+    Calls function(reference, *arguments) for every reference and returns the results in the order of the references.
+    With more than one worker the references are split in chunks of PARALLEL_CHUNK_REFERENCES over a process pool,
+    the function and its arguments must then be picklable (a function of a module, not a lambda), and changes the
+    function makes to the references are lost.
+    :param references: the list of references.
+    :param function: the function, called with a reference and the arguments.
+    :param arguments: a tuple of the other arguments of the function.
+    :param workers: the number of processes.
+    :return: the list of results.
+    """
+    if not _is_parallel(references, workers):
+        return [function(reference, *arguments) for reference in references]
+    return [result for _, result in _run_parallel(references, function, arguments, workers, False)]
+
+
+def transform_references(references: list, transform, arguments=(), workers=1) -> list:
+    """
+    Like map_references, but the changes the transform makes to the meta data and fields of the references in the
+    worker processes are made to the references in this process, in the order of the references. Only the references
+    that changed are sent back.
+    :return: the list of results of the transform.
+    """
+    if not _is_parallel(references, workers):
+        return [transform(reference, *arguments) for reference in references]
+    results = []
+    for reference, (state, result) in zip(references, _run_parallel(references, transform, arguments, workers, True)):
+        if state is not None:
+            _set_reference_state(reference, state)
+        results.append(result)
+    return results
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import pickle
+import time
+from objects import BibFile
+from utils import file_parser, json_loader
+
+# Bump when the parser or the objects change in a way that makes old snapshots invalid.
+SNAPSHOT_VERSION = 8
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../cache/parsed")
+HASH_BLOCK_SIZE = 1024 * 1024
+# Files modified this close to the moment their snapshot is written can change again without a visible change in
+# the modification time, so their snapshots are always validated by the hash.
+RACY_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+_META_EXTENSION = ".meta"
+_SNAPSHOT_EXTENSION = ".snapshot"
+
+
+def _file_digest(file_path) -> str:
+    """
+    Returns the blake2b hash of the bytes of the file.
+    """
+    digest = hashlib.blake2b()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_key(file_path, remove_newlines_in_fields) -> str:
+    """
+    The name of the snapshot of the file, the parse options that change the result are part of the key.
+    """
+    key = f"{SNAPSHOT_VERSION}|{os.path.abspath(file_path)}|{bool(remove_newlines_in_fields)}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _dump_atomic(path, *objects):
+    """
+    Pickles the objects into the path, through a temporary file so other processes never see half a snapshot.
+    """
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "wb") as file:
+            for obj in objects:
+                pickle.dump(obj, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def _load_meta(meta_path):
+    try:
+        with open(meta_path, "rb") as file:
+            return pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        return None
+
+
+def _load_snapshot(snapshot_path, meta):
+    """
+    Loads the content of the snapshot, or None if the snapshot does not belong to the meta data
+    (for example because another process replaced it in the meantime).
+    """
+    try:
+        with open(snapshot_path, "rb") as file:
+            if pickle.load(file) != meta["digest"]:
+                return None
+            return pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError, ImportError):
+        return None
+
+
+def _stat_matches(meta, stat) -> bool:
+    return not meta["racy"] and meta["size"] == stat.st_size and meta["mtime_ns"] == stat.st_mtime_ns
+
+
+def _update_source_files(content, stat):
+    """
+    The file has the same bytes as when the snapshot was made, so the source spans of the entries are still valid
+    for the current version of the file (whose modification time may have changed).
+    """
+    for entry in content:
+        span = getattr(entry, "source_span", None)
+        if span is not None and span[0].mtime_ns != stat.st_mtime_ns:
+            span[0].mtime_ns = stat.st_mtime_ns
+
+
+def _evict(maximum_size):
+    """
+    Removes the least recently used snapshots until the cache is within maximum_size bytes.
+    Every time a snapshot is used its modification time is updated, so that is used as the time of last use.
+    """
+    snapshots = []
+    total_size = 0
+    for name in os.listdir(CACHE_DIRECTORY):
+        if not name.endswith(_SNAPSHOT_EXTENSION):
+            continue
+        path = os.path.join(CACHE_DIRECTORY, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        snapshots.append((stat.st_mtime_ns, stat.st_size, path))
+        total_size += stat.st_size
+    snapshots.sort()
+    for _, size, path in snapshots:
+        if total_size <= maximum_size:
+            break
+        for remove_path in (path[:-len(_SNAPSHOT_EXTENSION)] + _META_EXTENSION, path):
+            try:
+                os.remove(remove_path)
+            except OSError:
+                pass
+        total_size -= size
+
+
+def _store(file_path, remove_newlines_in_fields, bib_file: BibFile, stat, maximum_size):
+    """
+    Writes the snapshot of the parsed file to the cache, stat is the result of os.stat from before parsing.
+    """
+    digest = _file_digest(file_path)
+    if os.stat(file_path).st_mtime_ns != stat.st_mtime_ns:
+        return  # Changed while parsing, the parsed content might not match the digest.
+    meta = {"path": os.path.abspath(file_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "racy": stat.st_mtime_ns >= time.time_ns() - RACY_WINDOW_NS,
+            "digest": digest}
+    key = _cache_key(file_path, remove_newlines_in_fields)
+    os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+    _dump_atomic(os.path.join(CACHE_DIRECTORY, key + _SNAPSHOT_EXTENSION), digest, bib_file.content)
+    _dump_atomic(os.path.join(CACHE_DIRECTORY, key + _META_EXTENSION), meta)
+    _evict(maximum_size)
+
+
+def load_bib(file_path, remove_newlines_in_fields=None, **parse_options) -> BibFile:
+    """
+    Parses the file at the file_path into a BibFile object, just like file_parser.parse_bib, but reuses the snapshot
+    of an earlier parse of the same (unchanged) file if there is one.
+    A snapshot is valid if the size and modification time of the file did not change, and otherwise if the hash of
+    the file is still the same. If the file did change, the entries of the snapshot are reused by
+    file_parser.reparse_bib so only the changed part of the file is parsed again.
+    Every call returns new objects, so the result can be changed freely.
+    :param file_path: the path of the file to parse.
+    :param remove_newlines_in_fields: replace newlines in field values by a space. If None: taken from the config.
+    :param parse_options: other keyword arguments for file_parser.parse_bib, used when the file has to be parsed.
+    """
+    config = json_loader.get_config()
+    if remove_newlines_in_fields is None:
+        remove_newlines_in_fields = config.remove_newlines_in_fields
+    if not config.parse_cache:
+        return file_parser.parse_bib(file_path, remove_newlines_in_fields, **parse_options)
+
+    stat = os.stat(file_path)
+    key = _cache_key(file_path, remove_newlines_in_fields)
+    meta_path = os.path.join(CACHE_DIRECTORY, key + _META_EXTENSION)
+    snapshot_path = os.path.join(CACHE_DIRECTORY, key + _SNAPSHOT_EXTENSION)
+    meta = _load_meta(meta_path)
+    if meta is not None and meta["size"] == stat.st_size:
+        valid = _stat_matches(meta, stat)
+        if not valid and _file_digest(file_path) == meta["digest"]:
+            valid = True
+            # Remember the new modification time, so the next load does not need the hash.
+            meta["mtime_ns"] = stat.st_mtime_ns
+            meta["racy"] = stat.st_mtime_ns >= time.time_ns() - RACY_WINDOW_NS
+            _dump_atomic(meta_path, meta)
+        if valid:
+            content = _load_snapshot(snapshot_path, meta)
+            if content is not None:
+                _update_source_files(content, stat)
+                try:
+                    os.utime(snapshot_path)  # Mark as recently used.
+                except OSError:
+                    pass
+                result = BibFile(file_path)
+                result.content = content
+                return result
+
+    previous = None
+    if meta is not None and parse_options.get("engine", file_parser.SCANNER_ENGINE) == file_parser.SCANNER_ENGINE:
+        # The file changed since the snapshot, only the entries that changed have to be parsed again.
+        previous = _load_snapshot(snapshot_path, meta)
+    if previous is not None:
+        previous_file = BibFile(file_path)
+        previous_file.content = previous
+        result, _ = file_parser.reparse_bib(previous_file, remove_newlines_in_fields)
+    else:
+        result = file_parser.parse_bib(file_path, remove_newlines_in_fields, **parse_options)
+    maximum_size = int(config.parse_cache_size_mb * 1024 * 1024)
+    try:
+        _store(file_path, remove_newlines_in_fields, result, stat, maximum_size)
+    except OSError as e:
+        print(f"Could not write the parse cache: {e}")
+    return result
+
+
+def clear_cache():
+    """
+    Removes all snapshots from the cache.
+    """
+    if os.path.isdir(CACHE_DIRECTORY):
+        _evict(0)
@@ -1,7 +1,7 @@
 import utils.file_parser as file_parser
 import utils.file_generator as file_generator
 from objects import BibFile, Reference
-from utils import json_loader
+from utils import tagging
 
 
 def filter_entry_types(file: BibFile, entry_types: list) -> BibFile:
@@ -10,30 +10,37 @@ def filter_entry_types(file: BibFile, entry_types: list) -> BibFile:
     which have entry types in the entry_types list
     """
     new_file = BibFile(file.file_path)
-    for entry in file.content:
+    new_file.content.extend(iter_filter_entry_types(file.content, entry_types))
+    return new_file
+
+
+def iter_filter_entry_types(entries, entry_types: list):
+    """
+    Streaming variant of filter_entry_types, yields the entries one at a time.
+    :param entries: any iterable of entries, for example file_parser.iter_bib.
+    :param entry_types: the entry types of the references to keep.
+    """
+    for entry in entries:
         if type(entry) is Reference:
             if entry.entry_type.lower() in entry_types:
-                new_file.content.append(entry)
+                yield entry
         else:
             # Always add all other types (string, comment and preamble)
-            new_file.content.append(entry)
+            yield entry
 
-    return new_file
 
-
-def filter_tags(file: BibFile, tags: list) -> BibFile:
+def filter_tags(file: BibFile, tags) -> BibFile:
     """
-    Returns a BibFile object with all references that have a tag from the tags list.
+    Returns a BibFile object with all references that have a tag from the tags list, or that match the tag query.
     :param file: the input file
-    :param tags: a list of tags
+    :param tags: a list of tags, or a tag query like 'ML AND (survey OR benchmark) AND NOT retracted'
     :return: the output file
     """
-    tags_dict = json_loader.load_tags()
-
-    relevant_cite_keys = set()
-    for tag, cite_keys in tags_dict.items():
-        if tag in tags:
-            relevant_cite_keys.update(cite_keys)
+    store = tagging.get_tag_store()
+    if isinstance(tags, str):
+        relevant_cite_keys = store.query(tags, [reference.cite_key for reference in file.get_references()])
+    else:
+        relevant_cite_keys = store.get_tagged_cite_keys(tags)
 
     new_file = BibFile(file.file_path)
     for entry in file.content:
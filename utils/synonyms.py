@@ -1,39 +1,148 @@
+import os
+import re
+
+from objects import BibFile, Reference
 from utils import json_loader
 
+# The fields canonicalize_bib changes by default. Author fields are canonicalized per name.
+CANONICALIZED_FIELDS = ("author", "journal")
+NAME_LIST_FIELDS = {"author", "editor"}
+_NAME_SEPARATOR = re.compile(r"(\s+and\s+)")
+
+
+def _normalize(text: str) -> str:
+    # remove whitespace and curly braces if needed
+    return text.strip().strip("{}")
+
+
+class SynonymIndex(object):
+    """
+    The synonyms of synonyms.json ({canonical: [variants]}) with an index from every normalized canonical name and
+    variant to its canonical name, so a lookup does not scan all synonyms. When a name is in the lists of several
+    canonical names, the first one in the file is used.
+    """
+    def __init__(self, synonyms: dict):
+        self.synonyms = synonyms
+        self._canonical = {}
+        for key, values in synonyms.items():
+            self._index(key, values)
+
+    def _index(self, key, values):
+        self._canonical.setdefault(_normalize(key), key)
+        for value in values:
+            self._canonical.setdefault(_normalize(value), key)
+
+    def canonical(self, text: str) -> str | None:
+        """
+        Returns the canonical name of the text, or None if it has no synonyms.
+        """
+        return self._canonical.get(_normalize(text))
+
+    def add(self, synonym_rules: dict) -> bool:
+        """
+        Adds the synonym rules ({canonical: [variants]}). The variants of a name that already has a canonical name
+        are added to that canonical name instead.
+        :return: whether the synonyms changed.
+        """
+        changed = False
+        for key, values in synonym_rules.items():
+            syn_key = self.canonical(key)
+            if syn_key is not None:
+                variants = self.synonyms[syn_key]
+                for value in values:
+                    if value not in variants:
+                        variants.append(value)
+                        self._canonical.setdefault(_normalize(value), syn_key)
+                        changed = True
+            else:
+                self.synonyms[key] = list(values)
+                self._index(key, values)
+                changed = True
+        return changed
+
+
+_index = None
+_index_stamp = None
+
+
+def _synonyms_file_stamp():
+    try:
+        stat = os.stat(json_loader.SYNONYMS_FILE)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_synonym_index() -> SynonymIndex:
+    """
+    Returns the SynonymIndex of this process. synonyms.json is only read again when it was changed by someone else.
+    """
+    global _index, _index_stamp
+    stamp = _synonyms_file_stamp()
+    if _index is None or stamp is None or stamp != _index_stamp:
+        _index = SynonymIndex(json_loader.load_synonyms())
+        _index_stamp = _synonyms_file_stamp()
+    return _index
+
 
 def replace_synonym(text: str) -> str | None:
-    synonyms = json_loader.load_synonyms()
-    text = text.strip().strip("{}")   # remove whitespace and curly braces if needed
-    for key, values in synonyms.items():
-        if text == key or text in values:
-            return key 
-    return None
+    return get_synonym_index().canonical(text)
+
 
 def add_synonyms(synonym_rules: dict) -> None:
-    synonym_list = json_loader.load_synonyms()
-    for key in synonym_rules:
-        syn_key = replace_synonym(key)
-        if syn_key != None:
-            for value in synonym_rules[key]:
-                if value not in synonym_list[syn_key]:
-                    synonym_list[syn_key].append(value)
-
-    for key, values in synonym_rules.items():
-        if replace_synonym(key) != None:
-            continue
-        if key in synonym_list:
-            for value in values:
-                if replace_synonym(value) != None:
-                    continue
-                if value not in synonym_list[key]:
-                    synonym_list[key].append(value)
-        else:
-            synonym_list[key] = values
-    json_loader.dump_synonyms(synonym_list)
+    global _index_stamp
+    index = get_synonym_index()
+    if index.add(synonym_rules):
+        json_loader.dump_synonyms(index.synonyms)
+        _index_stamp = _synonyms_file_stamp()
+
+
+def _canonicalize_value(index: SynonymIndex, value: str, is_name_list: bool) -> str:
+    if len(value) < 2 or (value[0], value[-1]) not in (("{", "}"), ('"', '"')):
+        # macros and numbers are left as they are
+        return value
+    inner = value[1:-1]
+    parts = _NAME_SEPARATOR.split(inner) if is_name_list else [inner]
+    # the odd parts are the separators between the names
+    for position in range(0, len(parts), 2):
+        canonical = index.canonical(parts[position])
+        if canonical is not None:
+            parts[position] = canonical
+    return value[0] + "".join(parts) + value[-1]
+
+
+def canonicalize_references(references, fields=CANONICALIZED_FIELDS) -> int:
+    """
+    Replaces the names in the fields of the references by their canonical names in synonyms.json. Every name in
+    an author or editor field is replaced separately, other fields are replaced as a whole.
+    :param references: the references to change.
+    :param fields: the names of the fields to canonicalize.
+    :return: the number of fields that changed.
+    """
+    index = get_synonym_index()
+    fields = set(fields)
+    changed = 0
+    for reference in references:
+        for name, value in reference.field_items():
+            if name in fields:
+                new_value = _canonicalize_value(index, value, name in NAME_LIST_FIELDS)
+                if new_value != value:
+                    setattr(reference, name, new_value)
+                    changed += 1
+    return changed
+
+
+def canonicalize_bib(bib_file: BibFile, fields=CANONICALIZED_FIELDS) -> int:
+    """
+    Canonicalizes the fields of all references of the file in one pass, see canonicalize_references.
+    :return: the number of fields that changed.
+    """
+    return canonicalize_references((entry for entry in bib_file.content if type(entry) is Reference), fields)
+
 
 if __name__ == "__main__":
     new_synonyms = {
         "P Visser": ["Visser, Pepijn", "Pepijn Visser"],
         "John Doe": ["Doe J", "J. Doe", "Doe, J."]
     }
-    add_synonyms(new_synonyms)
\ No newline at end of file
+    add_synonyms(new_synonyms)
@@ -1,36 +1,456 @@
+import contextlib
+import os
+import re
+import sqlite3
+
 from objects import Reference
 from utils import json_loader
 
-def tag_refs(tag,reflist: list[Reference]):
-    #get cite_keys only
-    newarr = [ref.cite_key for ref in reflist]
+JSON_STORE = "json"
+SQLITE_STORE = "sqlite"
+TAG_STORES = (JSON_STORE, SQLITE_STORE)
+
+TAGS_DATABASE = os.path.join(os.path.dirname(json_loader.TAGS_FILE), "tags.sqlite3")
+
+
+class _JsonTagBackend(object):
+    """
+    Keeps the tags in tags.json as {tag: [cite keys]}, which is rewritten atomically on every save.
+    """
+    def __init__(self, path=None):
+        self.path = path or json_loader.TAGS_FILE
+
+    def stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> dict:
+        tags = json_loader._load_json(self.path)
+        return {tag: cite_keys for tag, cite_keys in tags.items() if isinstance(cite_keys, list)}
+
+    def save(self, store, changes):
+        json_loader._dump_json(store.to_dict(), self.path, 2, True)
+
+    def close(self):
+        pass
+
+
+class _SqliteTagBackend(object):
+    """
+    Keeps the tags in a SQLite database with one row per (tag, cite key), so a save only writes the changed rows.
+    The rows are read in the order they were added. When the database does not exist yet, it starts with the tags in
+    tags.json.
+    """
+    def __init__(self, path=None):
+        self.path = path or TAGS_DATABASE
+        is_new = not os.path.exists(self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, cite_key TEXT NOT NULL, "
+                                    "PRIMARY KEY (tag, cite_key))")
+            if is_new and os.path.exists(json_loader.TAGS_FILE):
+                self._insert((tag, cite_key) for tag, cite_keys in _JsonTagBackend().load().items()
+                             for cite_key in cite_keys)
+
+    def _insert(self, rows):
+        self.connection.executemany("INSERT OR IGNORE INTO tags (tag, cite_key) VALUES (?, ?)", rows)
+
+    def stamp(self):
+        # data_version changes when another connection changed the database.
+        return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def load(self) -> dict:
+        tags = {}
+        for tag, cite_key in self.connection.execute("SELECT tag, cite_key FROM tags ORDER BY rowid"):
+            tags.setdefault(tag, []).append(cite_key)
+        return tags
+
+    def save(self, store, changes):
+        with self.connection:
+            for added, tag, cite_key in changes:
+                if added:
+                    self._insert([(tag, cite_key)])
+                else:
+                    self.connection.execute("DELETE FROM tags WHERE tag = ? AND cite_key = ?", (tag, cite_key))
+
+    def close(self):
+        self.connection.close()
+
+
+class TagStore(object):
+    """
+    The tags of the cite keys, indexed both ways: tag -> cite keys and cite key -> tags, so the tags of a reference
+    and the references of a tag can be found without scanning all tags. The cite keys of a tag are kept in the order
+    they were tagged in (dict keys are used as an ordered set).
+
+    For queries (see TagQuery), every cite key gets a number the first time the store sees it, which it keeps while
+    the process runs, and every tag has a bitset of the numbers of its cite keys in a python int. AND, OR and NOT are
+    then bitwise operations on those ints. The numbers are not saved: a new process numbers the cite keys again in the
+    order of the tags file, so they only make the queries faster and never change their results.
+
+    Every change is saved when it is done, or once at the end of a transaction, which also undoes all changes when it
+    fails. Use get_tag_store to get the store of this process.
+    """
+    def __init__(self, backend):
+        self._backend = backend
+        self._transaction_depth = 0
+        self._changes = []
+        self._stamp = None
+        self._tag_keys = {}
+        self._key_tags = {}
+        self._tag_bits = {}
+        self._numbers = {}
+        self._numbered_keys = []
+        self.reload()
+
+    def reload(self):
+        """
+        Reads the tags again from the file, discarding all changes that are not saved.
+        """
+        self._tag_keys = {}
+        self._key_tags = {}
+        self._tag_bits = {}
+        for tag, cite_keys in self._backend.load().items():
+            for cite_key in cite_keys:
+                self._add(tag, cite_key)
+        self._changes = []
+        self._stamp = self._backend.stamp()
+
+    def is_outdated(self) -> bool:
+        """
+        Returns whether the file changed since it was read or saved by this store.
+        """
+        return self._transaction_depth == 0 and self._backend.stamp() != self._stamp
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        Groups changes, so they are saved once when the with block ends. If the block raises an exception, all its
+        changes are undone instead. Transactions can be nested, only the outer one saves.
+        """
+        self._transaction_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._transaction_depth -= 1
+            if self._transaction_depth == 0:
+                self.reload()
+            raise
+        self._transaction_depth -= 1
+        if self._transaction_depth == 0 and self._changes:
+            self._backend.save(self, self._changes)
+            self._changes = []
+            self._stamp = self._backend.stamp()
+
+    def _add(self, tag, cite_key) -> bool:
+        cite_keys = self._tag_keys.setdefault(tag, {})
+        if cite_key in cite_keys:
+            return False
+        cite_keys[cite_key] = None
+        self._key_tags.setdefault(cite_key, set()).add(tag)
+        self._tag_bits[tag] = self._tag_bits.get(tag, 0) | 1 << self.number_of(cite_key)
+        self._changes.append((True, tag, cite_key))
+        return True
+
+    def _remove(self, tag, cite_key) -> bool:
+        cite_keys = self._tag_keys.get(tag)
+        if cite_keys is None or cite_key not in cite_keys:
+            return False
+        del cite_keys[cite_key]
+        self._tag_bits[tag] &= ~(1 << self._numbers[cite_key])
+        # if we have removed all the cite keys of a tag, remove the full tag
+        if not cite_keys:
+            del self._tag_keys[tag]
+            del self._tag_bits[tag]
+        tags = self._key_tags[cite_key]
+        tags.discard(tag)
+        if not tags:
+            del self._key_tags[cite_key]
+        self._changes.append((False, tag, cite_key))
+        return True
+
+    def tag(self, tag: str, cite_keys) -> int:
+        """
+        Adds the tag to the cite keys.
+        :return: the number of cite keys that did not have the tag yet.
+        """
+        with self.transaction():
+            return sum(self._add(tag, cite_key) for cite_key in cite_keys)
+
+    def untag(self, tag: str, cite_keys) -> int:
+        """
+        Removes the tag from the cite keys, and removes the tag when no cite key has it anymore.
+        :return: the number of cite keys that had the tag.
+        """
+        with self.transaction():
+            return sum(self._remove(tag, cite_key) for cite_key in cite_keys)
+
+    def remove_tag(self, tag: str) -> int:
+        """
+        Removes the tag from all cite keys.
+        :return: the number of cite keys that had the tag.
+        """
+        return self.untag(tag, list(self._tag_keys.get(tag, ())))
+
+    def untag_all(self, cite_keys) -> int:
+        """
+        Removes all tags from the cite keys.
+        :return: the number of tags that were removed.
+        """
+        with self.transaction():
+            return sum(self._remove(tag, cite_key) for cite_key in cite_keys
+                       for tag in list(self._key_tags.get(cite_key, ())))
+
+    def has_tag(self, tag: str) -> bool:
+        return tag in self._tag_keys
+
+    def get_tags(self) -> list:
+        """
+        Returns all tags, in the order they were added.
+        """
+        return list(self._tag_keys)
+
+    def get_cite_keys(self, tag: str) -> set:
+        """
+        Returns the cite keys with the tag.
+        """
+        return set(self._tag_keys.get(tag, ()))
 
-    # add the new tagged references
-    tags = json_loader.load_tags()
-    if tag in tags.keys():
-        citekeyarr = tags[tag]
-        for citekey in newarr:
-            if citekey not in citekeyarr:
-                citekeyarr.append(citekey)
-    else:
-        tags[tag] = newarr
+    def get_tags_of(self, cite_key: str) -> set:
+        """
+        Returns the tags of the cite key.
+        """
+        return set(self._key_tags.get(cite_key, ()))
+
+    def get_tagged_cite_keys(self, tags) -> set:
+        """
+        Returns the cite keys that have at least one of the tags.
+        """
+        cite_keys = set()
+        for tag in tags:
+            cite_keys.update(self._tag_keys.get(tag, ()))
+        return cite_keys
+
+    def number_of(self, cite_key: str) -> int:
+        """
+        Returns the number of the cite key in the bitsets, and gives it the next number if it does not have one yet.
+        """
+        number = self._numbers.get(cite_key)
+        if number is None:
+            number = self._numbers[cite_key] = len(self._numbered_keys)
+            self._numbered_keys.append(cite_key)
+        return number
+
+    def get_bits(self, cite_keys) -> int:
+        """
+        Returns the bitset of the cite keys.
+        """
+        bits = 0
+        for cite_key in cite_keys:
+            bits |= 1 << self.number_of(cite_key)
+        return bits
+
+    def get_tag_bits(self, tag: str) -> int:
+        """
+        Returns the bitset of the cite keys with the tag.
+        """
+        return self._tag_bits.get(tag, 0)
+
+    def get_cite_keys_of_bits(self, bits: int) -> list:
+        """
+        Returns the cite keys in the bitset, ordered by their number.
+        """
+        cite_keys = []
+        # the binary string reversed, so the character at index n is the bit of number n
+        binary = bin(bits)[:1:-1]
+        position = binary.find("1")
+        while position != -1:
+            cite_keys.append(self._numbered_keys[position])
+            position = binary.find("1", position + 1)
+        return cite_keys
+
+    def query(self, query, cite_keys=None) -> set:
+        """
+        Returns the cite keys that match the tag query.
+        :param query: a TagQuery or the text of one, like 'ML AND (survey OR benchmark) AND NOT retracted'.
+        :param cite_keys: the cite keys to select from, for example the references of a file. NOT selects from these,
+        if not given from all tagged cite keys.
+        :return: the matching cite keys.
+        """
+        if not isinstance(query, TagQuery):
+            query = TagQuery(query)
+        if cite_keys is None:
+            cite_keys = self._key_tags
+        universe = self.get_bits(cite_keys)
+        return set(self.get_cite_keys_of_bits(query.evaluate(self.get_tag_bits, universe)))
+
+    def to_dict(self) -> dict:
+        """
+        Returns the tags as {tag: [cite keys]}, like they are stored in tags.json.
+        """
+        return {tag: list(cite_keys) for tag, cite_keys in self._tag_keys.items()}
+
+    def close(self):
+        self._backend.close()
+
+
+# A single quote only starts a quoted tag at the start of a word, so tags like O'Brien can be written without quotes.
+_QUERY_TOKEN = re.compile(r"\s*(?:(\()|(\))|\"([^\"]*)\"|'([^']*)'|([^\s()\"'][^\s()\"]*))")
+_QUERY_OPERATORS = ("AND", "OR", "NOT")
+
+
+class TagQuery(object):
+    """
+    A boolean query over tags, like 'ML AND (survey OR benchmark) AND NOT retracted'. NOT binds strongest, then AND,
+    then OR, and parentheses group. The operators can be written in any case; tags with spaces, parentheses or
+    names like an operator have to be quoted, like "Computer Science". A single quote inside a tag, like in O'Brien,
+    does not need quotes.
+    """
+    def __init__(self, text: str):
+        self.text = text
+        self._tokens = self._tokenize(text)
+        self._position = 0
+        self.tree = self._parse_or()
+        if self._position != len(self._tokens):
+            self._fail("expected AND, OR or the end of the query")
+        del self._tokens
+
+    def _fail(self, message):
+        raise ValueError(f"invalid tag query '{self.text}': {message}")
+
+    def _tokenize(self, text) -> list:
+        tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = _QUERY_TOKEN.match(text, position)
+            if match is None:
+                self._fail(f"unclosed quote at position {position}")
+            opening, closing, double_quoted, single_quoted, word = match.groups()
+            if opening or closing:
+                tokens.append(opening or closing)
+            elif word is not None and word.upper() in _QUERY_OPERATORS:
+                tokens.append(word.upper())
+            else:
+                tokens.append(("tag", next(t for t in (double_quoted, single_quoted, word) if t is not None)))
+            position = match.end()
+        return tokens
+
+    def _peek(self):
+        return self._tokens[self._position] if self._position < len(self._tokens) else None
+
+    def _parse_or(self):
+        tree = self._parse_and()
+        while self._peek() == "OR":
+            self._position += 1
+            tree = ("or", tree, self._parse_and())
+        return tree
+
+    def _parse_and(self):
+        tree = self._parse_not()
+        while self._peek() == "AND":
+            self._position += 1
+            tree = ("and", tree, self._parse_not())
+        return tree
+
+    def _parse_not(self):
+        if self._peek() == "NOT":
+            self._position += 1
+            return "not", self._parse_not()
+        return self._parse_atom()
+
+    def _parse_atom(self):
+        token = self._peek()
+        self._position += 1
+        if token == "(":
+            tree = self._parse_or()
+            if self._peek() != ")":
+                self._fail("missing closing parenthesis")
+            self._position += 1
+            return tree
+        if isinstance(token, tuple):
+            return token
+        self._fail("expected a tag" if token is None else f"expected a tag instead of '{token}'")
+
+    @staticmethod
+    def any_of(tags):
+        """
+        Returns the query that matches cite keys with at least one of the tags.
+        """
+        return TagQuery(" OR ".join('"' + tag.replace('"', "") + '"' for tag in tags) or '""')
+
+    def get_tags(self) -> set:
+        """
+        Returns the tags in the query.
+        """
+        tags = set()
+        stack = [self.tree]
+        while stack:
+            node = stack.pop()
+            if node[0] == "tag":
+                tags.add(node[1])
+            else:
+                stack.extend(node[1:])
+        return tags
+
+    def evaluate(self, tag_bits, universe: int) -> int:
+        """
+        Returns the bitset of the cite keys that match.
+        :param tag_bits: function that returns the bitset of a tag.
+        :param universe: the bitset of the cite keys to select from, which NOT is taken relative to.
+        """
+        def evaluate(node):
+            match node[0]:
+                case "tag":
+                    return tag_bits(node[1]) & universe
+                case "not":
+                    return universe & ~evaluate(node[1])
+                case "and":
+                    return evaluate(node[1]) & evaluate(node[2])
+                case "or":
+                    return evaluate(node[1]) | evaluate(node[2])
+        return evaluate(self.tree)
+
+    def __repr__(self):
+        return f"TagQuery({self.text!r})"
+
+
+_store = None
+_store_kind = None
+
+
+def get_tag_store() -> TagStore:
+    """
+    Returns the TagStore of this process, which uses tags.json or the SQLite database depending on the tag_store
+    config value. The tags are only read again when the file was changed by someone else.
+    """
+    global _store, _store_kind
+    kind = json_loader.get_config().tag_store
+    if _store is None or kind != _store_kind:
+        if _store is not None:
+            _store.close()
+        _store = TagStore(_SqliteTagBackend() if kind == SQLITE_STORE else _JsonTagBackend())
+        _store_kind = kind
+    elif _store.is_outdated():
+        _store.reload()
+    return _store
+
+
+def tag_refs(tag, reflist: list[Reference]):
+    """
+    Adds the tag to the references. A tag only exists while a cite key has it (the sqlite store keeps one row per tag
+    and cite key), so tagging no references does not add an empty tag to the tags file like it used to.
+    :return: the number of references that did not have the tag yet.
+    """
+    return get_tag_store().tag(tag, [ref.cite_key for ref in reflist])
 
-    json_loader.dump_tags(tags)  # replace content
-    
 
 def untag_refs(tag, citekeylist: list[str]):
-    # remove the tagged references
-    tags = json_loader.load_tags()
-    if tag in tags.keys():
-        citekeyarr = tags[tag]
-        for citekey in citekeylist:
-            if citekey in citekeyarr:
-                citekeyarr.remove(citekey)
-
-        # if we have removed all the citekeys in a tag, remove the full tag
-        if citekeyarr == []:
-            tags.pop(tag)
-    else:
+    store = get_tag_store()
+    if not store.has_tag(tag):
         return -1
-
-    json_loader.dump_tags(tags)
\ No newline at end of file
+    store.untag(tag, citekeylist)
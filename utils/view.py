@@ -36,44 +36,52 @@ def print_refarray_short(refarray: list[Reference]):
     print(f"{BLUE}{15 * '.'} {GREEN}{20 * '.'} {WHITE}{30 * '.'} {30 * '.'} {4 * '.'}")
 
     for entry in refarray:
-        #since title, author and year could be none, they get added dynamically
-        fields = [entry.get_fields().get("title"), entry.get_fields().get("author"), entry.get_fields().get("year")]
-        str = f"{BLUE}{var_w_space('@' + entry.entry_type, 15)}{GREEN}{var_w_space(entry.cite_key, 20)}{WHITE}"
-        for field in fields:
-            if field != None:
-                #CLEANING INPUT (yes this is needlessly long)
-                #strip the field of curly braces if there
-                if field.startswith("{"):
-                    field = field[1:-1]
-                #remove breaklines for multiple line fields
-                field = field.replace('\n', ' ').replace('\r', '')
-                #remove multiple spaces
-                field = re.sub(' +', ' ', field)
-                #if the field is too long, truncate and add ".." at the end
-                if len(field) > 30:
-                    field = field[:28] + ".."
+        print_ref_short(entry)
 
-                #add the string
-                if field == fields[-1]: 
-                    str += field #if it is the last one, do not add the spaces at the end
-                else: 
-                    str += var_w_space(field, 30)
-            else: #if the field is none add a bunch of spaces as a placeholder
-                if field != fields[-1]:
-                    str += f"{31  * ' '}"
-        print(str)
-            
+def print_entries_short(entries):
+    """
+    Streaming variant of print_refarray_short
+    Takes any iterable of entries (e.g. file_parser.iter_bib) and prints each reference as soon as it is parsed
+    """
+    print_refarray_short(entry for entry in entries if type(entry) == Reference)
+
+def print_ref_short(entry: Reference):
+    """
+    Prints the shortform line of a single ref
+    """
+    #since title, author and year could be none, they get added dynamically
+    fields = [entry.get_fields().get("title"), entry.get_fields().get("author"), entry.get_fields().get("year")]
+    str = f"{BLUE}{var_w_space('@' + entry.entry_type, 15)}{GREEN}{var_w_space(entry.cite_key, 20)}{WHITE}"
+    for field in fields:
+        if field != None:
+            #CLEANING INPUT (yes this is needlessly long)
+            #strip the field of curly braces if there
+            if field.startswith("{"):
+                field = field[1:-1]
+            #remove breaklines for multiple line fields
+            field = field.replace('\n', ' ').replace('\r', '')
+            #remove multiple spaces
+            field = re.sub(' +', ' ', field)
+            #if the field is too long, truncate and add ".." at the end
+            if len(field) > 30:
+                field = field[:28] + ".."
+
+            #add the string
+            if field == fields[-1]: 
+                str += field #if it is the last one, do not add the spaces at the end
+            else: 
+                str += var_w_space(field, 30)
+        else: #if the field is none add a bunch of spaces as a placeholder
+            if field != fields[-1]:
+                str += f"{31  * ' '}"
+    print(str)
+        
 def print_ref_pretty(ref: Reference):
     print("")
     print(f"{BLUE}{var_w_space('@' + ref.entry_type, 16)}{GREEN}{ref.cite_key}{WHITE}")
-    for field in ref.get_fields():
-        val = ref.get_fields().get(field)
-        if field == "comment_above_reference":
-            if val != "":
-                print(f"{GREY}{val}{WHITE}")
-            continue
-        elif field == "entry_type" or field == "cite_key":
-            continue
+    if ref.comment_above_reference != "":
+        print(f"{GREY}{ref.comment_above_reference}{WHITE}")
+    for field, val in ref.get_fields().items():
         if val.startswith("{"):
             val = val[1:-1]
         print(f"{YELLOW}{field}{WHITE}{c_space(field, 17)}{val}")